@@ -5,6 +5,7 @@ import os
 import sys
 from multiprocessing import Process
 
+import click
 import markdown
 import sentry_sdk
 from flask import Flask, Response, jsonify, render_template, request
@@ -20,7 +21,7 @@ from githubapp.events import (
 )
 
 from config import default_configs
-from src.helpers import request_helper
+from src.helpers import request_helper, storage_helper
 from src.managers import issue_manager, pull_request_manager, release_manager
 from src.models import IssueJobStatus
 from src.services import IssueJobService
@@ -97,17 +98,29 @@ def process_jobs_endpoint(issue_url: str = None) -> tuple[Response, int]:
     issue_url = issue_url or request.get_json(force=True).get("issue_url")
     if not issue_url:
         return jsonify({"error": "issue_url is required"}), 400
+    if storage_helper.in_process_storage():
+        # The writes of a forked process would be lost with the memory backend, the jobs run in the request
+        if issue_job_status := issue_manager.process_jobs(issue_url):
+            return jsonify({"status": issue_job_status.value}), 200
+        return jsonify({"error": f"IssueJob for {issue_url=} not found"}), 404
     process = Process(target=issue_manager.process_jobs, args=(issue_url,))
     process.start()
     process.join(float(Config.TIMEOUT))
-    if issue_job := next(iter(IssueJobService.filter(issue_url=issue_url)), None):
-        if process.is_alive():
-            IssueJobService.update(issue_job, issue_job_status=IssueJobStatus.PENDING)
+    while issue_job := IssueJobService.get(issue_url=issue_url):
+        if not process.is_alive():
+            return jsonify({"status": issue_job.issue_job_status.value}), 200
+        # The process is handed to a new request only if the job didn't change after being read, otherwise the
+        # process is still running it (e.g. the progress changed) and it is read again
+        if IssueJobService.compare_and_set(
+            issue_job,
+            {"issue_job_status": issue_job.issue_job_status},
+            issue_job_status=IssueJobStatus.PENDING,
+        ):
+            process.terminate()
             request_helper.make_thread_request(
                 request_helper.get_request_url("process_jobs_endpoint"), issue_url
             )
-        process.terminate()
-        return jsonify({"status": issue_job.issue_job_status.value}), 200
+            return jsonify({"status": issue_job.issue_job_status.value}), 200
     return jsonify({"error": f"IssueJob for {issue_url=} not found"}), 404
 
 
@@ -130,10 +143,46 @@ def marketplace() -> str:  # pragma: no cover
 
 
 def create_tables() -> str:  # pragma: no cover
-    """Create the database tables"""
+    """
+    Create the database tables and the secondary indexes missing, waiting until they are ready, and verify them.
+    Run in the deploy, so the requests can use TRUST_TABLE_SCHEMA and never describe the tables
+    """
     from src.helpers.db_helper import BaseModelService
 
+    problems = []
     for subclass in BaseModelService.__subclasses__():
-        logger.info("Creating table for %s", subclass.clazz.__name__)
-        subclass.create_table()
+        logger.info("Provisioning table for %s", subclass.clazz.__name__)
+        problems.extend(subclass.provision())
+    if problems:
+        raise click.ClickException("\n".join(problems))
+    return "OK"
+
+
+def migrate_jobs_table() -> str:  # pragma: no cover
+    """
+    Copy the jobs from the old table, partitioned by task, to the table partitioned by original_issue_url.
+    Can be run again, the jobs already copied are not overwritten
+    """
+    from src.services import JobService
+
+    logger.info("Copying jobs from job to %s", JobService.table_name)
+    JobService.copy_from("job")
     return "OK"
+
+
+@click.option("--output-dir", default="archive", show_default=True, help="Directory of the archive files")
+@click.option(
+    "--older-than-days",
+    default=0.0,
+    show_default=True,
+    help="Only the jobs done at least these days ago",
+)
+def archive_jobs(output_dir: str, older_than_days: float) -> str:  # pragma: no cover
+    """Move the finished IssueJobs and their Jobs from the tables to gzipped JSON lines files"""
+    issue_manager.archive_finished_jobs(output_dir, older_than_days)
+    return "OK"
+
+
+app.cli.command("create-tables")(create_tables)
+app.cli.command("migrate-jobs-table")(migrate_jobs_table)
+app.cli.command("archive-jobs")(archive_jobs)
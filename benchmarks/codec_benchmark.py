@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the conversion of the models to and from DynamoDB items, per row.
+
+Compares the resource path (`model_dump` and the boto3 serializer to write, the boto3 deserializer and the pydantic
+validation to read) with the model codec (AttributeValues directly, `model_construct` to read).
+
+Run with `python -m benchmarks.codec_benchmark [rows]`
+"""
+
+import sys
+import timeit
+from typing import Any, Callable
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from src.helpers.codec_helper import model_codec
+from src.helpers.db_helper import BaseModel, to_dynamo_value
+from src.models import IssueJob, IssueJobStatus, Job, JobStatus
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def sample_models(rows: int) -> dict[type[BaseModel], list[BaseModel]]:
+    """Returns the models to convert, a tasklist of `rows` jobs and as many issue jobs"""
+    return {
+        Job: [
+            Job(
+                original_issue_url="https://api.github.com/repos/owner/repo/issues/1",
+                task=f"Task {i}",
+                checked=bool(i % 2),
+                job_status=JobStatus.DONE,
+                repository_url="https://api.github.com/repos/owner/repo",
+                title=f"Task {i}",
+                issue_ref=f"owner/repo#{i}",
+                issue_url=f"https://api.github.com/repos/owner/repo/issues/{i}",
+            )
+            for i in range(rows)
+        ],
+        IssueJob: [
+            IssueJob(
+                issue_url=f"https://api.github.com/repos/owner/repo/issues/{i}",
+                repository_url="https://api.github.com/repos/owner/repo",
+                title=f"Issue {i}",
+                issue_job_status=IssueJobStatus.RUNNING,
+                issue_comment_id=i,
+                hook_installation_target_id=1,
+                installation_id=1,
+            )
+            for i in range(rows)
+        ],
+    }
+
+
+def resource_encode(model: BaseModel) -> dict[str, Any]:
+    """Write through the resource: model_dump and the boto3 serializer"""
+    return {k: serializer.serialize(to_dynamo_value(v)) for k, v in model.model_dump().items()}
+
+
+def resource_decode(model_class: type[BaseModel], item: dict[str, Any]) -> BaseModel:
+    """Read through the resource: the boto3 deserializer and the pydantic validation"""
+    return model_class(**{k: deserializer.deserialize(v) for k, v in item.items()})
+
+
+def per_row(function: Callable[[], Any], rows: int) -> float:
+    """Returns the best time of the function, in microseconds per row"""
+    return min(timeit.repeat(function, number=1, repeat=5)) / rows * 1_000_000
+
+
+def main(rows: int = 1000) -> None:
+    """Print the time per row of each path, for each model"""
+    print(f"{'model':<10}{'direction':<10}{'resource (us)':>15}{'codec (us)':>12}{'speedup':>9}")
+    for model_class, models in sample_models(rows).items():
+        codec = model_codec(model_class)
+        items = [codec.to_attribute_values(model) for model in models]
+        assert [codec.from_attribute_values(item) for item in items] == models
+        paths = {
+            "encode": (
+                lambda: [resource_encode(model) for model in models],
+                lambda: [codec.to_attribute_values(model) for model in models],
+            ),
+            "decode": (
+                lambda: [resource_decode(model_class, item) for item in items],
+                lambda: [codec.from_attribute_values(item) for item in items],
+            ),
+        }
+        for direction, (resource_path, codec_path) in paths.items():
+            resource_time = per_row(resource_path, rows)
+            codec_time = per_row(codec_path, rows)
+            print(
+                f"{model_class.__name__:<10}{direction:<10}{resource_time:>15.2f}{codec_time:>12.2f}"
+                f"{resource_time / codec_time:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
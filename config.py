@@ -1,9 +1,64 @@
-"""Module to create the githubapp Configs"""
+"""
+Module to create the githubapp Configs and the settings of the process
 
-from typing import NoReturn
+The settings are read from the environment variables, as the uppercase Configs, with the defaults in `SETTINGS`.
+"""
+
+import os
+from typing import Any, Callable, NoReturn
 
 from githubapp import Config
 
+# The settings read from the environment variables, with their defaults. See `setting`
+SETTINGS: dict[str, Any] = {
+    # Storage backend: "dynamodb", "memory" (only for the tests and the benchmarks) or "sqlite", see storage_backend
+    "STORAGE_BACKEND": "dynamodb",
+    # Database file of the sqlite backend
+    "SQLITE_DATABASE": "bartholomew.sqlite3",
+    # DynamoDB connection, see dynamodb_settings
+    "DYNAMODB_REGION": "us-east-1",
+    "DYNAMODB_ENDPOINT_URL": None,
+    "DYNAMODB_MAX_POOL_CONNECTIONS": 20,
+    "DYNAMODB_CONNECT_TIMEOUT": 2.0,
+    "DYNAMODB_READ_TIMEOUT": 5.0,
+    "DYNAMODB_MAX_ATTEMPTS": 3,
+    "DYNAMODB_RETRY_MODE": "standard",
+    # Billing mode of the tables that don't set it: PROVISIONED or PAY_PER_REQUEST
+    "DYNAMODB_BILLING_MODE": "PROVISIONED",
+    # Max write capacity units per second of the bulk writes of a table. The bulk writes start at this rate, halved
+    # each time the table throttles
+    "DYNAMODB_MAX_WRITE_RATE": 500.0,
+    # Take the tables as provisioned, never describing them, see BaseModelService.provision
+    "TRUST_TABLE_SCHEMA": False,
+    # How the Jobs of the new IssueJobs are stored: "rows" (one Job item each), "document" (a map in the IssueJob, see
+    # JobService) or "compressed" (the same map, compressed)
+    "TASKS_STORAGE": "rows",
+    # Max tasks in a document, the Jobs of larger tasklists are moved to Job rows. DynamoDB items are limited to 400 KB
+    "TASKS_DOCUMENT_MAX_TASKS": 200,
+    # Days the finished IssueJobs and their Jobs are kept before DynamoDB deletes them
+    "FINISHED_JOBS_TTL_DAYS": 30.0,
+    # How the pipeline makes the GitHub calls: "sync" in a thread pool with PyGithub (JobPipeline) or "async" in an
+    # event loop (AsyncJobPipeline)
+    "GITHUB_ENGINE": "sync",
+    # Max concurrent GitHub calls of each installation. GitHub limits the concurrent requests of an installation
+    # (secondary rate limits)
+    "GITHUB_MAX_WORKERS": 8,
+    # Max open connections of the async GitHub client
+    "GITHUB_MAX_CONNECTIONS": 100,
+    # Max concurrent requests of the async GitHub client to each repository. GitHub throttles the concurrent writes to
+    # the same repository
+    "GITHUB_MAX_REPOSITORY_REQUESTS": 4,
+    # Max bytes of the cached GitHub GET responses, see github_cache_helper
+    "GITHUB_CACHE_MAX_BYTES": 32 * 1024 * 1024,
+    # SQLite database of the cached GitHub GET responses, shared by the processes, in a writable path like
+    # /tmp/github_cache.sqlite3. Not set to keep them only in the memory of each process
+    "GITHUB_CACHE_DATABASE": None,
+    # Seconds the responses not used are kept in the database
+    "GITHUB_CACHE_DATABASE_TTL": 3600.0,
+}
+
+_after_fork_callbacks: list[Callable[[], None]] = []
+
 
 def default_configs() -> None:
     """Create the default configs"""
@@ -31,3 +86,36 @@ def default_configs() -> None:
         close_subtasks=True,
         handle_checkbox=True,
     )
+
+
+def setting(name: str) -> Any:
+    """
+    Returns the setting in the environment variable with its name, converted to the type of its default, or the
+    default if the variable is not set. Booleans are true with "1", "true" or "yes"
+    """
+    default = SETTINGS[name]
+    value = getattr(Config, name)
+    if value is None or value == "":
+        return default
+    if isinstance(default, bool):
+        return str(value).lower() in ("1", "true", "yes")
+    return value if default is None else type(default)(value)
+
+
+def after_fork(callback: Callable[[], None]) -> Callable[[], None]:
+    """
+    Register the function to run in the forked processes, like the job processes, to reset the state they can't share
+    with the parent: locks that may have been held by another thread, thread pools and connections
+    """
+    _after_fork_callbacks.append(callback)
+    return callback
+
+
+def _run_after_fork() -> None:
+    """Run the functions registered with `after_fork`"""
+    for callback in _after_fork_callbacks:
+        callback()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_run_after_fork)
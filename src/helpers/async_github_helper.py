@@ -0,0 +1,112 @@
+"""
+Async GitHub Helper Functions
+
+This module has an asyncio client of the GitHub REST API, used to make the GitHub calls of many jobs concurrently in
+one event loop, see `AsyncJobPipeline`.
+The requests share one connection pool and are limited by installation and by repository, the errors are raised as
+the PyGithub exceptions so the callers handle them as in the sync path.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Optional
+
+import aiohttp
+from github import Consts, GithubException, UnknownObjectException
+
+from config import setting
+
+# Times a request is retried when GitHub is rate limiting or fails
+GITHUB_MAX_RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def repository_of(url: str) -> str:
+    """Returns the {owner}/{repo} of a repository or issue API url"""
+    return "/".join(url.split("/repos/", 1)[-1].split("/")[:2])
+
+
+def retry_after(response: aiohttp.ClientResponse, attempt: int) -> Optional[float]:
+    """Returns the seconds to wait before retrying the request, None if it must not be retried"""
+    if attempt >= GITHUB_MAX_RETRIES:
+        return None
+    if "Retry-After" in response.headers:
+        return float(response.headers["Retry-After"])
+    if response.status == 403 and response.headers.get("X-RateLimit-Remaining") == "0":
+        return max(float(response.headers.get("X-RateLimit-Reset", 0)) - time.time(), 1)
+    if response.status in RETRY_STATUSES:
+        return 2**attempt
+    return None
+
+
+class AsyncGithubClient:
+    """
+    Client of the GitHub REST API for asyncio, to use as an async context manager.
+
+    The requests of all the installations share the connection pool of the client (GITHUB_MAX_CONNECTIONS) and run
+    at most `max_installation_requests` at a time for each installation and GITHUB_MAX_REPOSITORY_REQUESTS for each
+    repository.
+    """
+
+    def __init__(self, max_installation_requests: int) -> None:
+        self.max_installation_requests = max_installation_requests
+        self.max_repository_requests = setting("GITHUB_MAX_REPOSITORY_REQUESTS")
+        self.installation_limits: dict[int, asyncio.Semaphore] = {}
+        self.repository_limits: dict[str, asyncio.Semaphore] = {}
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "AsyncGithubClient":
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=setting("GITHUB_MAX_CONNECTIONS")),
+            timeout=aiohttp.ClientTimeout(total=Consts.DEFAULT_TIMEOUT),
+            headers={"User-Agent": Consts.DEFAULT_USER_AGENT, "Accept": "application/vnd.github+json"},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.session.close()
+        self.session = None
+
+    def limits(self, installation_id: int, url: str) -> tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        """Returns the concurrency limits of the installation and of the repository of the url"""
+        if installation_id not in self.installation_limits:
+            self.installation_limits[installation_id] = asyncio.Semaphore(self.max_installation_requests)
+        repository = repository_of(url)
+        if repository not in self.repository_limits:
+            self.repository_limits[repository] = asyncio.Semaphore(self.max_repository_requests)
+        return self.installation_limits[installation_id], self.repository_limits[repository]
+
+    async def request(
+        self,
+        installation_id: int,
+        authorization: str,
+        method: str,
+        url: str,
+        payload: Optional[dict[str, Any]] = None,
+    ) -> dict[str, Any]:
+        """
+        Make a request to the API with the Authorization header of the installation, returning the json response.
+        Raises UnknownObjectException if the object is not found and GithubException on the other errors.
+        """
+        installation_limit, repository_limit = self.limits(installation_id, url)
+        attempt = 0
+        while True:
+            async with installation_limit, repository_limit:
+                async with self.session.request(
+                    method, url, json=payload, headers={"Authorization": authorization}
+                ) as response:
+                    if response.status < 400:
+                        return await response.json() if response.status != 204 else {}
+                    body = await response.read()
+                    data = json.loads(body) if body else None
+                    wait = retry_after(response, attempt)
+            if wait is None:
+                exception = UnknownObjectException if response.status in (404, 410) else GithubException
+                raise exception(response.status, data, dict(response.headers))
+            attempt += 1
+            await asyncio.sleep(wait)
+
+    async def edit_issue(self, installation_id: int, authorization: str, url: str, **fields: Any) -> dict[str, Any]:
+        """Change the fields of the issue of the url"""
+        return await self.request(installation_id, authorization, "PATCH", url, fields)
@@ -0,0 +1,208 @@
+"""
+Capacity Helper Functions
+
+This module tracks the capacity consumed by the DynamoDB requests and the throttling, by table, and paces the bulk
+writes of each table with an adaptive token bucket.
+The DynamoDB clients are instrumented with `instrument`, so every request returns its consumed capacity.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Optional
+
+from config import after_fork, setting
+
+# Errors returned when the requests exceed the throughput of the table or of the account
+THROTTLING_ERRORS = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+READ_OPERATIONS = {"GetItem", "BatchGetItem", "Query", "Scan", "TransactGetItems"}
+MIN_WRITE_RATE = 1
+# Units per second added to the rate after each bulk write not throttled
+WRITE_RATE_INCREASE = 5
+
+
+class CapacityTracker:
+    """The capacity units consumed and the throttled requests, by table"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.usage: dict[str, dict[str, float]] = defaultdict(
+            lambda: {"read_units": 0.0, "write_units": 0.0, "throttles": 0}
+        )
+
+    def record(self, operation_name: str, consumed_capacity: Any) -> None:
+        """Add the ConsumedCapacity of a response, one for each table or a list of them for the batch operations"""
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        default_kind = "read_units" if operation_name in READ_OPERATIONS else "write_units"
+        with self.lock:
+            for table_capacity in consumed_capacity:
+                usage = self.usage[table_capacity["TableName"]]
+                if "ReadCapacityUnits" in table_capacity or "WriteCapacityUnits" in table_capacity:
+                    usage["read_units"] += float(table_capacity.get("ReadCapacityUnits", 0))
+                    usage["write_units"] += float(table_capacity.get("WriteCapacityUnits", 0))
+                else:
+                    usage[default_kind] += float(table_capacity.get("CapacityUnits", 0))
+
+    def record_throttle(self, table_name: str, write: bool) -> None:
+        """Count a throttled request, or a batch with unprocessed items, slowing down the bulk writes if it's a write"""
+        with self.lock:
+            self.usage[table_name]["throttles"] += 1
+        if write:
+            write_limiter(table_name).throttled()
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """Returns a copy of the usage by table"""
+        with self.lock:
+            return {table_name: dict(usage) for table_name, usage in self.usage.items()}
+
+    def reset(self) -> None:
+        """Forget the usage"""
+        with self.lock:
+            self.usage.clear()
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket that paces the writes of a table, in capacity units per second.
+
+    The rate is halved each time the table throttles and grows back additively after each write not throttled (AIMD),
+    between MIN_WRITE_RATE and `max_rate`. The bucket holds at most one second of tokens.
+    """
+
+    def __init__(self, max_rate: float) -> None:
+        self.lock = threading.Lock()
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.tokens = max_rate
+        self.updated_at = time.monotonic()
+
+    def refill(self) -> None:
+        """Add the tokens of the time elapsed since the last refill, must hold the lock"""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, units: float = 1) -> float:
+        """
+        Take the units, waiting until the bucket has them. The units may be an estimate, see `consumed`.
+        Returns the seconds waited.
+        """
+        with self.lock:
+            self.refill()
+            wait = max(0.0, (units - self.tokens) / self.rate)
+            self.tokens -= units
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def call(self, units: float, request: Callable[[], dict]) -> dict:
+        """
+        Send the write request paced, taking `units` as the estimate of its capacity units, corrected by the consumed
+        capacity of the response, if any. Returns the response.
+        The throttling of the request slows down the bucket through the instrumented client, see `instrument`.
+        """
+        self.acquire(units)
+        response = request()
+        if "ConsumedCapacity" in response:
+            self.consumed(consumed_units(response["ConsumedCapacity"]) - units)
+        if not response.get("UnprocessedItems"):
+            self.succeeded()
+        return response
+
+    def consumed(self, units: float) -> None:
+        """Take (or give back, if negative) the difference between the units acquired and the consumed ones"""
+        with self.lock:
+            self.tokens -= units
+
+    def throttled(self) -> None:
+        """Halve the rate and empty the bucket"""
+        with self.lock:
+            self.refill()
+            self.rate = max(MIN_WRITE_RATE, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self) -> None:
+        """Increase the rate after a write not throttled"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + WRITE_RATE_INCREASE)
+
+
+capacity_tracker = CapacityTracker()
+_write_limiters: dict[str, AdaptiveTokenBucket] = {}
+_write_limiters_lock = threading.Lock()
+
+
+def write_limiter(table_name: str) -> AdaptiveTokenBucket:
+    """Returns the token bucket of the bulk writes of the table, shared by the process"""
+    with _write_limiters_lock:
+        if table_name not in _write_limiters:
+            _write_limiters[table_name] = AdaptiveTokenBucket(setting("DYNAMODB_MAX_WRITE_RATE"))
+        return _write_limiters[table_name]
+
+
+def consumed_units(consumed_capacity: Any) -> float:
+    """Returns the total of capacity units of a response ConsumedCapacity, 0 if the response doesn't have it"""
+    if not consumed_capacity:
+        return 0
+    if isinstance(consumed_capacity, dict):
+        consumed_capacity = [consumed_capacity]
+    return sum(float(table_capacity.get("CapacityUnits", 0)) for table_capacity in consumed_capacity)
+
+
+def request_table_names(params: dict[str, Any]) -> list[str]:
+    """Returns the tables of the request"""
+    if "TableName" in params:
+        return [params["TableName"]]
+    if "RequestItems" in params:
+        return list(params["RequestItems"])
+    table_names = []
+    for transact_item in params.get("TransactItems", []):
+        for request in transact_item.values():
+            if request.get("TableName") not in table_names:
+                table_names.append(request.get("TableName"))
+    return table_names
+
+
+def _provide_params(params: dict[str, Any], model: Any, context: dict[str, Any], **_) -> None:
+    """Ask for the consumed capacity in the requests that can return it, and keep their tables in the context"""
+    if "ReturnConsumedCapacity" in model.input_shape.members:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+    context["table_names"] = request_table_names(params)
+
+
+def _needs_retry(response: Optional[tuple], operation: Any, request_dict: dict[str, Any], **_) -> None:
+    """Count the throttled attempts, including the ones retried by botocore"""
+    if response and response[1].get("Error", {}).get("Code") in THROTTLING_ERRORS:
+        for table_name in request_dict["context"].get("table_names", []):
+            capacity_tracker.record_throttle(table_name, write=operation.name not in READ_OPERATIONS)
+
+
+def _after_call(parsed: dict[str, Any], model: Any, context: dict[str, Any], **_) -> None:
+    """Record the capacity consumed by the request, and the batches with unprocessed items as throttled"""
+    if consumed_capacity := parsed.get("ConsumedCapacity"):
+        capacity_tracker.record(model.name, consumed_capacity)
+    for table_name in parsed.get("UnprocessedItems", {}):
+        capacity_tracker.record_throttle(table_name, write=True)
+    for table_name in parsed.get("UnprocessedKeys", {}):
+        capacity_tracker.record_throttle(table_name, write=False)
+
+
+def instrument(client: Any) -> Any:
+    """Track the consumed capacity and the throttling of the requests of the DynamoDB client, returning the client"""
+    events = client.meta.events
+    events.register("provide-client-params.dynamodb", _provide_params)
+    events.register("needs-retry.dynamodb", _needs_retry)
+    events.register("after-call.dynamodb", _after_call)
+    return client
+
+
+@after_fork
+def _reset_after_fork() -> None:
+    """The forked process starts its own usage, with new locks, they may have been held by another thread"""
+    global _write_limiters_lock  # pylint: disable=global-statement
+    _write_limiters_lock = threading.Lock()
+    capacity_tracker.lock = threading.Lock()
+    capacity_tracker.usage.clear()
+    for limiter in _write_limiters.values():
+        limiter.lock = threading.Lock()
@@ -0,0 +1,211 @@
+"""
+Codec Helper Functions
+
+This module converts the models to and from DynamoDB items, as python values for the resource and the local backends
+or as AttributeValues for the low-level client, without `model_dump`, the pydantic validation and the boto3 serializer.
+"""
+
+from decimal import Decimal
+from enum import Enum
+from functools import cache
+from typing import Any, Callable, NamedTuple, Union, get_args, get_origin
+
+from pydantic import BaseModel
+
+
+def to_attribute_value(value: Any) -> dict[str, Any]:
+    """Returns the DynamoDB AttributeValue of a python value"""
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, (int, float, Decimal)):
+        return {"N": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"B": bytes(value)}
+    if isinstance(value, dict):
+        return {"M": {str(k): to_attribute_value(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"L": [to_attribute_value(v) for v in value]}
+    if isinstance(value, (set, frozenset)) and value:
+        sample = next(iter(value))
+        if isinstance(sample, str):
+            return {"SS": list(value)}
+        if isinstance(sample, (bytes, bytearray)):
+            return {"BS": [bytes(v) for v in value]}
+        return {"NS": [str(v) for v in value]}
+    raise TypeError(f"Unsupported type {type(value).__name__} for DynamoDB")
+
+
+def from_attribute_value(attribute_value: dict[str, Any]) -> Any:
+    """Returns the python value of a DynamoDB AttributeValue, numbers are int or Decimal"""
+    ((dynamo_type, value),) = attribute_value.items()
+    if dynamo_type in ("S", "BOOL", "B"):
+        return value
+    if dynamo_type == "N":
+        return _number(value)
+    if dynamo_type == "NULL":
+        return None
+    if dynamo_type == "M":
+        return {k: from_attribute_value(v) for k, v in value.items()}
+    if dynamo_type == "L":
+        return [from_attribute_value(v) for v in value]
+    if dynamo_type == "NS":
+        return {_number(v) for v in value}
+    return set(value)
+
+
+def to_attribute_values(item: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    """Returns the item with the values as DynamoDB AttributeValues"""
+    return {k: to_attribute_value(v) for k, v in item.items()}
+
+
+def from_attribute_values(item: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """Returns the item with the DynamoDB AttributeValues as python values"""
+    return {k: from_attribute_value(v) for k, v in item.items()}
+
+
+def _number(value: str) -> Union[int, Decimal]:
+    """Returns the DynamoDB number as int, if it's integral, or Decimal"""
+    try:
+        return int(value)
+    except ValueError:
+        return Decimal(value)
+
+
+def _field_type(annotation: Any) -> Any:
+    """Returns the type of the field, without the Optional"""
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+class FieldCodec(NamedTuple):
+    """The functions to convert the values of a model field, the values may be None"""
+
+    name: str
+    # Model value to the item value (python) and back, as returned by the resource
+    to_item: Callable[[Any], Any]
+    from_item: Callable[[Any], Any]
+    # Model value to the AttributeValue and back, as returned by the low-level client
+    to_attribute_value: Callable[[Any], dict[str, Any]]
+    from_attribute_value: Callable[[dict[str, Any]], Any]
+
+
+def _same(value: Any) -> Any:
+    """Returns the value, for the fields that don't need conversion"""
+    return value
+
+
+def field_codec(name: str, python_type: Any) -> FieldCodec:
+    """Returns the functions to convert the values of a field of the type"""
+    if isinstance(python_type, type) and issubclass(python_type, Enum):
+        return FieldCodec(
+            name,
+            lambda value: value.value if isinstance(value, Enum) else value,
+            lambda value: None if value is None else python_type(value),
+            to_attribute_value,
+            lambda attribute_value: python_type(from_attribute_value(attribute_value)),
+        )
+    if python_type is str:
+        return FieldCodec(
+            name,
+            _same,
+            _same,
+            lambda value: {"NULL": True} if value is None else {"S": value},
+            lambda attribute_value: attribute_value["S"],
+        )
+    if python_type is bool:
+        return FieldCodec(
+            name,
+            _same,
+            _same,
+            lambda value: {"NULL": True} if value is None else {"BOOL": value},
+            lambda attribute_value: attribute_value["BOOL"],
+        )
+    if python_type in (int, float):
+        return FieldCodec(
+            name,
+            _same,
+            lambda value: None if value is None else python_type(value),
+            lambda value: {"NULL": True} if value is None else {"N": str(value)},
+            lambda attribute_value: python_type(attribute_value["N"]),
+        )
+    return FieldCodec(name, _same, _same, to_attribute_value, from_attribute_value)
+
+
+class ModelCodec:
+    """
+    Converts the models of a class to and from DynamoDB items, with the conversion of each field compiled once.
+
+    The items read from the tables are trusted: the models are built without the pydantic validation, the missing
+    attributes get the field default.
+    """
+
+    def __init__(self, model_class: type[BaseModel]) -> None:
+        self.model_class = model_class
+        self.fields = [
+            field_codec(field_name, _field_type(field_info.annotation))
+            for field_name, field_info in model_class.model_fields.items()
+        ]
+        self.optional_fields = [
+            (field_name, field_info)
+            for field_name, field_info in model_class.model_fields.items()
+            if not field_info.is_required()
+        ]
+        # Without aliases and private attributes, the models can be built skipping the generic steps of model_construct
+        self.plain = not model_class.__pydantic_post_init__ and all(
+            field_info.alias is None and field_info.validation_alias is None
+            for field_info in model_class.model_fields.values()
+        )
+
+    def construct(self, values: dict[str, Any]) -> BaseModel:
+        """Returns the model with the field values, without validation, like `model_construct`"""
+        if not self.plain:
+            return self.model_class.model_construct(**values)
+        fields_set = set(values)
+        for field_name, field_info in self.optional_fields:
+            if field_name not in values:
+                values[field_name] = field_info.get_default(call_default_factory=True)
+        model = self.model_class.__new__(self.model_class)
+        object.__setattr__(model, "__dict__", values)
+        object.__setattr__(model, "__pydantic_fields_set__", fields_set)
+        object.__setattr__(model, "__pydantic_extra__", None)
+        object.__setattr__(model, "__pydantic_private__", None)
+        return model
+
+    def to_item(self, model: BaseModel) -> dict[str, Any]:
+        """Returns the item of the model, with python values"""
+        values = model.__dict__
+        return {field.name: field.to_item(values[field.name]) for field in self.fields}
+
+    def from_item(self, item: dict[str, Any]) -> BaseModel:
+        """Returns the model of the item with python values, as returned by the resource"""
+        return self.construct(
+            {field.name: field.from_item(item[field.name]) for field in self.fields if field.name in item}
+        )
+
+    def to_attribute_values(self, model: BaseModel) -> dict[str, dict[str, Any]]:
+        """Returns the item of the model, with DynamoDB AttributeValues"""
+        values = model.__dict__
+        return {field.name: field.to_attribute_value(values[field.name]) for field in self.fields}
+
+    def from_attribute_values(self, item: dict[str, dict[str, Any]]) -> BaseModel:
+        """Returns the model of the item with DynamoDB AttributeValues, as returned by the low-level client"""
+        values = {}
+        for field in self.fields:
+            if (attribute_value := item.get(field.name)) is not None:
+                values[field.name] = None if "NULL" in attribute_value else field.from_attribute_value(attribute_value)
+        return self.construct(values)
+
+
+@cache
+def model_codec(model_class: type[BaseModel]) -> ModelCodec:
+    """Returns the codec of the model class, compiled the first time"""
+    return ModelCodec(model_class)
@@ -1,13 +1,25 @@
 """
 Database Helper Functions
 
-This module contains helper functions for interacting with DynamoDB tables using the AWS SDK.
+This module contains helper functions for interacting with DynamoDB tables using the AWS SDK, or with the local
+storage backends in `storage_helper`.
 """
 
+import functools
+import json
 import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from enum import Enum
-from typing import Any, ClassVar, Generic, NoReturn, TypeVar
+from itertools import islice
+from queue import Queue
+from types import SimpleNamespace
+from typing import IO, Any, Callable, ClassVar, Generic, Iterable, Iterator, NoReturn, Optional, TypeVar
 
 import boto3
 from boto3.resources.base import ServiceResource
@@ -15,6 +27,11 @@ from botocore.exceptions import ClientError
 from pydantic import BaseModel as PydanticBaseModel
 from pydantic import Field
 
+from config import setting
+from src.helpers.capacity_helper import capacity_tracker, write_limiter
+from src.helpers.codec_helper import ModelCodec, from_attribute_values, model_codec, to_attribute_values
+from src.helpers.storage_helper import dynamo_key_schema, dynamodb_client, remove_path, set_path, storage_backend
+
 logger = logging.getLogger(__name__)
 T = TypeVar("T")
 
@@ -33,6 +50,169 @@ type_map = {
     dict: "M",
 }
 
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_MAX_KEYS = 100
+# TransactWriteItems accepts at most 100 items per transaction
+TRANSACT_MAX_ITEMS = 100
+# BatchWriteItem accepts at most 25 items per request
+BATCH_WRITE_MAX_ITEMS = 25
+# Max seconds to wait before sending again the items not processed in a batch write
+BATCH_WRITE_MAX_BACKOFF = 1
+# Max concurrent requests when updating many items
+UPDATE_MANY_MAX_WORKERS = 10
+# Max document paths changed in one UpdateItem, to keep the update expression under the DynamoDB limit (4 KB)
+UPDATE_MAX_PATHS = 100
+# Seconds between the checks of the secondary indexes status while provisioning
+PROVISION_POLL_INTERVAL = 5
+# Capacity of the tables and secondary indexes in the PROVISIONED billing mode
+PROVISIONED_THROUGHPUT = {"ReadCapacityUnits": 10, "WriteCapacityUnits": 10}
+
+# The secondary indexes of the tables already described in the process, by table name, see `get_table`.
+# Inherited by the forked processes, so they don't describe the tables again
+_described_tables: dict[str, list[dict[str, Any]]] = {}
+
+
+def trust_table_schema() -> bool:
+    """
+    Returns if the tables are taken as provisioned, set in the TRUST_TABLE_SCHEMA environment variable.
+    See `BaseModelService.provision`
+    """
+    return setting("TRUST_TABLE_SCHEMA")
+
+
+def to_dynamo_value(value: Any) -> Any:
+    """Returns the value in a format that dynamo will understand"""
+    return value.value if isinstance(value, Enum) else value
+
+
+class Session:
+    """
+    Unit of work shared by all the services, see `BaseModelService.session`.
+
+    Keeps an identity map with the models loaded, by table and primary key, and the partitions (hash key values) that
+    were loaded entirely, so filters by those partitions can be answered from memory.
+    With `write_behind`, the writes are buffered, merging the changes to the same item, until `flush`.
+    """
+
+    def __init__(self, write_behind: bool = False) -> None:
+        self.identity_map: dict[tuple[str, tuple], "BaseModel"] = {}
+        self.loaded_partitions: set[tuple[str, Any]] = set()
+        self.write_behind = write_behind
+        # The pending writes by identity, the values are taken from the identity map when flushing
+        self.pending_puts: dict[tuple[str, tuple], type["BaseModelService"]] = {}
+        # The attributes changed, None if the whole item must be updated
+        self.pending_updates: dict[tuple[str, tuple], tuple[type["BaseModelService"], Optional[set[str]]]] = {}
+        # The deltas of the numeric attributes incremented, see `BaseModelService.increment`
+        self.pending_increments: dict[tuple[str, tuple], tuple[type["BaseModelService"], dict[str, int]]] = {}
+
+    def get(self, table_name: str, key: dict[str, Any]) -> Optional["BaseModel"]:
+        """Returns the model with the key, if loaded"""
+        return self.identity_map.get((table_name, tuple(key.values())))
+
+    def register(self, table_name: str, key: dict[str, Any], item: "BaseModel") -> "BaseModel":
+        """Register a model loaded from the table, returning the already loaded one with the same key, if any"""
+        return self.identity_map.setdefault((table_name, tuple(key.values())), item)
+
+    def put(self, table_name: str, key: dict[str, Any], item: "BaseModel") -> None:
+        """Put a model written in the table, replacing the loaded one with the same key, if any"""
+        self.identity_map[(table_name, tuple(key.values()))] = item
+
+    def buffer_put(self, service: type["BaseModelService"], key: dict[str, Any], item: "BaseModel") -> None:
+        """Buffer the insertion of the item, replacing any pending update of it"""
+        identity = (service.table_name, tuple(key.values()))
+        self.identity_map[identity] = item
+        self.pending_updates.pop(identity, None)
+        self.pending_increments.pop(identity, None)
+        self.pending_puts[identity] = service
+
+    def buffer_update(self, service: type["BaseModelService"], key: dict[str, Any], attr_names: set[str]) -> None:
+        """
+        Buffer the update of the attributes of the item (the whole item if there is no attributes), merging with the
+        pending write of the item. The item in the identity map must already have the new values.
+        """
+        identity = (service.table_name, tuple(key.values()))
+        if identity in self.pending_puts:
+            return
+        if identity in self.pending_updates:
+            pending_attr_names = self.pending_updates[identity][1]
+            if pending_attr_names is None or not attr_names:
+                attr_names = None
+            else:
+                attr_names = pending_attr_names | attr_names
+        self.pending_updates[identity] = (service, attr_names or None)
+
+    def buffer_increment(self, service: type["BaseModelService"], key: dict[str, Any], deltas: dict[str, int]) -> None:
+        """
+        Buffer the increment of the numeric attributes of the item, adding to the pending increments of it.
+        The item in the identity map must already have the new values, a pending insertion of it writes them.
+        """
+        identity = (service.table_name, tuple(key.values()))
+        if identity in self.pending_puts:
+            return
+        pending_deltas = self.pending_increments.setdefault(identity, (service, {}))[1]
+        for attr_name, delta in deltas.items():
+            pending_deltas[attr_name] = pending_deltas.get(attr_name, 0) + delta
+
+    def flush(self) -> None:
+        """
+        Send the pending writes to the tables, with one request per item at most, and one more for the increments of
+        the attributes not set. The increments are always sent as ADD, even with an update of the whole item, so the
+        increments of other workers are kept
+        """
+        pending_puts, self.pending_puts = self.pending_puts, {}
+        pending_updates, self.pending_updates = self.pending_updates, {}
+        pending_increments, self.pending_increments = self.pending_increments, {}
+        puts = defaultdict(list)
+        for identity, service in pending_puts.items():
+            puts[service].append(self.identity_map[identity])
+        updates = defaultdict(list)
+        for identity, (service, attr_names) in pending_updates.items():
+            item = self.identity_map[identity]
+            if attr_names is None and identity in pending_increments:
+                # The whole item but the attributes incremented, they are added to the values in the table
+                attr_names = set(type(item).model_fields) - set(pending_increments[identity][1])
+                pending_updates[identity] = (service, attr_names)
+            updates[service].append((item, {attr_name: getattr(item, attr_name) for attr_name in attr_names or []}))
+        increments = defaultdict(list)
+        for identity, (service, deltas) in pending_increments.items():
+            if identity in pending_updates:
+                # The update writes the values in memory of the attributes set, with the increments
+                attr_names = pending_updates[identity][1]
+                deltas = {attr_name: delta for attr_name, delta in deltas.items() if attr_name not in attr_names}
+            if deltas:
+                increments[service].append((self.identity_map[identity], deltas))
+        for service, items in puts.items():
+            service.put_items(items)
+        for service, service_updates in updates.items():
+            service.send_updates(service_updates)
+        for service, service_increments in increments.items():
+            service.send_increments(service_increments)
+
+    def discard(self) -> None:
+        """Drop the pending writes, not sent to the tables"""
+        self.pending_puts = {}
+        self.pending_updates = {}
+        self.pending_increments = {}
+
+    def remove(self, table_name: str, key: dict[str, Any]) -> None:
+        """Forget the model deleted from the table and its pending writes"""
+        identity = (table_name, tuple(key.values()))
+        self.identity_map.pop(identity, None)
+        self.pending_puts.pop(identity, None)
+        self.pending_updates.pop(identity, None)
+        self.pending_increments.pop(identity, None)
+
+    def partition(self, table_name: str, hash_value: Any) -> list["BaseModel"]:
+        """Returns the loaded models with the hash key value"""
+        return [
+            item
+            for (item_table_name, key), item in self.identity_map.items()
+            if item_table_name == table_name and key[0] == hash_value
+        ]
+
+
+_current_session: ContextVar[Optional[Session]] = ContextVar("current_session", default=None)
+
 
 class MetaBaseModelService(type):
     """
@@ -43,8 +223,8 @@ class MetaBaseModelService(type):
 
     def __init__(cls: type["BaseModelService"], *args) -> None:
         super().__init__(*args)
-        cls._resource = None
         cls._table = None
+        cls._table_resource = None
 
     @property
     def table(cls: type["BaseModelService"]) -> ServiceResource:
@@ -52,26 +232,30 @@ class MetaBaseModelService(type):
         Returns the DynamoDB table associated with the service class.
 
         If the table doesn't exist, it attempts to create it.
+        The table is loaded again when the resource changes, as in a forked process.
         """
-        if cls._table is None:
+        resource = BaseModelService.resource
+        if cls._table is None or cls._table_resource is not resource:
             cls._table = cls.get_table()
+            cls._table_resource = resource
         return cls._table
 
     @property
     def resource(cls: type["BaseModelService"]) -> boto3.resource:
-        """Returns the DynamoDB resource client."""
-        if cls._resource is None:
-            cls._resource = boto3.resource("dynamodb", region_name="us-east-1")
-        return cls._resource
+        """
+        Returns the storage backend, the DynamoDB resource by default, shared by all the services.
+        See `storage_backend`
+        """
+        return storage_backend()
 
     @property
     def table_name(cls: type["BaseModelService"]) -> str:
         """
         Returns the name of the DynamoDB table associated with the service class.
 
-        The table name is derived from the class name in lowercase.
+        The table name is the model `table_name` or, if not set, derived from the class name in lowercase.
         """
-        return cls.clazz.__name__.lower()
+        return cls.clazz.table_name or cls.clazz.__name__.lower()
 
     @property
     def clazz(cls: type["BaseModelService"]) -> type["BaseModel"]:
@@ -82,6 +266,11 @@ class MetaBaseModelService(type):
         """
         return cls.__orig_bases__[0].__args__[0]
 
+    @property
+    def codec(cls: type["BaseModelService"]) -> ModelCodec:
+        """Returns the codec that converts the models of the service to and from the table items"""
+        return model_codec(cls.clazz)
+
 
 class BaseModelService(Generic[T], metaclass=MetaBaseModelService):
     """
@@ -91,90 +280,607 @@ class BaseModelService(Generic[T], metaclass=MetaBaseModelService):
     """
 
     _table = None
-    _resource = None
+    _table_resource = None
 
     @classmethod
     def get_table(cls) -> ServiceResource:
         """
         Returns the DynamoDB table associated with the service class.
 
-        If the table doesn't exist, it attempts to create it.
+        If the table doesn't exist, it attempts to create it, with the secondary indexes. The indexes missing in an
+        existing table are only created by `provision`, never in the requests.
+        The table is described (DescribeTable) only once in the process and in the processes forked from it.
+        With TRUST_TABLE_SCHEMA, the table is never described, the tables and the secondary indexes declared in the
+        models must be provisioned before, see `provision`.
         """
+        table = BaseModelService.resource.Table(cls.table_name)
+        if cls.table_name in _described_tables:
+            return table
+        if trust_table_schema():
+            _described_tables[cls.table_name] = [
+                {"IndexName": cls.index_name(index_key_schema), "IndexStatus": "ACTIVE"}
+                for index_key_schema in cls.clazz.secondary_indexes
+            ]
+            return table
         try:
-            table = BaseModelService.resource.Table(cls.table_name)
             if not table.creation_date_time:
                 raise AssertionError("Table doesn't exist")
         except ClientError as err:
             # This will not result in a failed assertion
-            if err.response["Error"]["Code"] == "ResourceNotFoundException":
-                return cls.create_table()
-            raise
+            if err.response["Error"]["Code"] != "ResourceNotFoundException":
+                raise
+            table = cls.create_table()
+        else:
+            cls.warn_missing_indexes(table)
+        _described_tables[cls.table_name] = table.global_secondary_indexes or []
         return table
 
     @classmethod
-    def all(cls) -> list["BaseModel"]:
-        """Return all models from the table."""
-        return cls.filter()
+    def warn_missing_indexes(cls, table: ServiceResource) -> None:
+        """
+        Log the secondary indexes declared in the model that doesn't exist in the table. The filters that would query
+        them scan the table instead, until they are created by `provision`
+        """
+        table_indexes = {index["IndexName"] for index in table.global_secondary_indexes or []}
+        for index_key_schema in cls.clazz.secondary_indexes:
+            if (index_name := cls.index_name(index_key_schema)) not in table_indexes:
+                logger.warning(
+                    "Index %s missing in %s, run `flask create-tables` to create it", index_name, cls.table_name
+                )
+
+    @classmethod
+    def index_name(cls, index_key_schema: list[str]) -> str:
+        """Returns the name of the secondary index with the given key schema"""
+        return "-".join(index_key_schema) + "-index"
 
     @classmethod
-    def filter(cls, **kwargs) -> list[T]:
-        """Return all models from the table matching the filter."""
+    def active_indexes(cls) -> dict[str, list[str]]:
+        """Returns the secondary indexes of the model that are ready to be queried, by name"""
+        # Loading the table describes it, see `get_table`
+        cls.table  # pylint: disable=pointless-statement
+        table_indexes = {
+            index["IndexName"]
+            for index in _described_tables[cls.table_name]
+            if index.get("IndexStatus", "ACTIVE") == "ACTIVE"
+        }
+        indexes = {}
+        for index_key_schema in cls.clazz.secondary_indexes:
+            if (index_name := cls.index_name(index_key_schema)) in table_indexes:
+                indexes[index_name] = index_key_schema
+        return indexes
+
+    @classmethod
+    def choose_index(cls, attr_names: Iterable[str]) -> tuple[Optional[str], Optional[list[str]]]:
+        """
+        Choose the best index to query the table filtering by the attributes.
+
+        Returns the index name (None for the table itself) and its key schema, or (None, None) if the table must be
+        scanned. The index must have its hash key in the attributes, preferring the ones that also have the range key,
+        and the table over the secondary indexes.
+        """
+        attr_names = set(attr_names)
+        best_index = (None, None)
+        best_score = 0
+        candidates = {None: cls.clazz.key_schema, **cls.active_indexes()}
+        for index_name, index_key_schema in candidates.items():
+            if index_key_schema[0] not in attr_names:
+                continue
+            if (score := sum(attr in attr_names for attr in index_key_schema)) > best_score:
+                best_index = (index_name, index_key_schema)
+                best_score = score
+        return best_index
+
+    @staticmethod
+    @contextmanager
+    def session(write_behind: bool = False) -> Iterator[Session]:
+        """
+        Open a unit of work for all the services, or join the one already open.
+
+        While the session is open, the models loaded are kept in memory by primary key and the writes go to the
+        table and to the memory, so the same models are not loaded again. Closing the session drops the models.
+        With `write_behind`, the writes are only sent to the tables on `commit` and when the session is closed,
+        successive updates to the same item are merged in one request. The writes not committed are dropped if the
+        session is closed by an exception.
+        """
+        if session := _current_session.get():
+            yield session
+            return
+        session = Session(write_behind=write_behind)
+        token = _current_session.set(session)
         try:
-            scan_attributes = {}
-            if kwargs:
-                filter_expression = []
-                expression_attribute_values = {}
-                for attr_name, attr_value in kwargs.items():
-                    filter_expression.append(f"{attr_name}=:{attr_name}")
-                    if isinstance(attr_value, Enum):
-                        attr_value = attr_value.value
-                    expression_attribute_values[f":{attr_name}"] = attr_value
-                scan_attributes = {
-                    "FilterExpression": " and ".join(filter_expression),
-                    "ExpressionAttributeValues": expression_attribute_values,
-                }
-            response = cls.table.scan(**scan_attributes)
+            yield session
+        except BaseException:
+            session.discard()
+            raise
+        else:
+            session.flush()
+        finally:
+            _current_session.reset(token)
+
+    @staticmethod
+    def commit() -> None:
+        """Send the writes buffered in the current session, if any, to the tables"""
+        if session := _current_session.get():
+            session.flush()
+
+    @classmethod
+    def write_behind_session(cls) -> Optional[Session]:
+        """Returns the current session if it buffers the writes"""
+        if (session := _current_session.get()) and session.write_behind:
+            return session
+        return None
+
+    @classmethod
+    def register(cls, item: T) -> T:
+        """Register the model loaded from the table in the session, if any, returning the model in the session"""
+        if session := _current_session.get():
+            return session.register(cls.table_name, cls.item_key(item), item)
+        return item
+
+    @classmethod
+    def write_through(cls, item: T, **kwargs) -> None:
+        """Reflect in the session, if any, the item written in the table with the kwargs (or entirely)"""
+        if not (session := _current_session.get()):
+            return
+        key = cls.item_key(item)
+        loaded = session.get(cls.table_name, key)
+        if kwargs and loaded is not None and loaded is not item:
+            for attr_name, attr_value in kwargs.items():
+                setattr(loaded, attr_name, attr_value)
+            loaded.version = item.version
+        elif isinstance(item, BaseModel):
+            # The partial records are not kept, the partition loaded later must have the whole models
+            session.put(cls.table_name, key, item)
+
+    @classmethod
+    def item_key(cls, item: "BaseModel") -> dict[str, Any]:
+        """Returns the primary key of the item"""
+        return {attr: to_dynamo_value(getattr(item, attr)) for attr in cls.clazz.key_schema}
+
+    @classmethod
+    def get_key(cls, **kwargs) -> dict[str, Any]:
+        """
+        Returns the primary key built from the kwargs, following the model key schema.
+
+        Raises ValueError if some key attribute is missing or if there are attributes not in the key schema.
+        """
+        key_schema = cls.clazz.key_schema
+        if missing := [attr for attr in key_schema if attr not in kwargs]:
+            raise ValueError(f"Missing key attributes for {cls.table_name}: {', '.join(missing)}")
+        if extra := [attr for attr in kwargs if attr not in key_schema]:
+            raise ValueError(f"Attributes not in the key schema of {cls.table_name}: {', '.join(extra)}")
+        return {attr: to_dynamo_value(kwargs[attr]) for attr in key_schema}
+
+    @staticmethod
+    def capacity_usage() -> dict[str, dict[str, float]]:
+        """
+        Returns the DynamoDB capacity units consumed (read_units and write_units) and the throttled requests
+        (throttles) by table, since the process started or was forked
+        """
+        return capacity_tracker.snapshot()
+
+    @classmethod
+    def raw_client(cls) -> Optional[Any]:
+        """
+        Returns the low-level DynamoDB client if the storage backend is DynamoDB, None otherwise.
+        With the low-level client, the items are converted directly by the model codec, skipping the conversion of the
+        resource.
+        """
+        return dynamodb_client() if isinstance(BaseModelService.resource, ServiceResource) else None
+
+    @classmethod
+    def from_item(cls, item: dict[str, Any], raw: bool = False) -> T:
+        """Returns the model of an item read from the table, with AttributeValues if `raw`. See `raw_client`"""
+        return cls.codec.from_attribute_values(item) if raw else cls.codec.from_item(item)
+
+    @classmethod
+    def get(cls, **kwargs) -> Optional[T]:
+        """Return the model with the given primary key or None if it doesn't exist"""
+        key = cls.get_key(**kwargs)
+        session = _current_session.get()
+        if session and (item := session.get(cls.table_name, key)):
+            return item
+        client = cls.raw_client()
+        try:
+            if client:
+                response = client.get_item(TableName=cls.table_name, Key=to_attribute_values(key))
+            else:
+                response = cls.table.get_item(Key=key)
         except ClientError as err:
             logger.error(
-                "Couldn't get any movie from table %s. Here's why: %s: %s",
-                cls.table.name,
+                "Couldn't get %s from table %s. Here's why: %s: %s",
+                key,
+                cls.table_name,
                 err.response["Error"]["Code"],
                 err.response["Error"]["Message"],
             )
             raise
-        return [cls.clazz(**item) for item in sorted(response["Items"], key=lambda item: item["created_at"])]
+        if item := response.get("Item"):
+            return cls.register(cls.from_item(item, raw=client is not None))
+        return None
+
+    @classmethod
+    def batch_get(cls, keys: list[dict[str, Any]]) -> list[T]:
+        """
+        Return the models with the given primary keys, in the same order as the keys.
+        Keys without a model in the table are ignored.
+        """
+        keys = [cls.get_key(**key) for key in keys]
+        items_by_key = {}
+        keys_to_get = keys
+        if session := _current_session.get():
+            for key in keys:
+                if item := session.get(cls.table_name, key):
+                    items_by_key[tuple(key.values())] = item
+            keys_to_get = [key for key in keys if tuple(key.values()) not in items_by_key]
+        client = cls.raw_client()
+        for start in range(0, len(keys_to_get), BATCH_GET_MAX_KEYS):
+            request_keys = keys_to_get[start : start + BATCH_GET_MAX_KEYS]
+            if client:
+                request_keys = [to_attribute_values(key) for key in request_keys]
+            request_items = {cls.table_name: {"Keys": request_keys}}
+            while request_items:
+                try:
+                    response = (client or BaseModelService.resource).batch_get_item(RequestItems=request_items)
+                except ClientError as err:
+                    logger.error(
+                        "Couldn't batch get from table %s. Here's why: %s: %s",
+                        cls.table_name,
+                        err.response["Error"]["Code"],
+                        err.response["Error"]["Message"],
+                    )
+                    raise
+                for item in response["Responses"].get(cls.table_name, []):
+                    model = cls.from_item(item, raw=client is not None)
+                    items_by_key[tuple(cls.item_key(model).values())] = cls.register(model)
+                request_items = response.get("UnprocessedKeys")
+        return [item for key in keys if (item := items_by_key.get(tuple(key.values()))) is not None]
+
+    @classmethod
+    def all(cls, segments: Optional[int] = None) -> list["BaseModel"]:
+        """Return all models from the table. See `iter_all`"""
+        return list(cls.iter_all(segments=segments))
+
+    @classmethod
+    def iter_all(cls, segments: Optional[int] = None, page_size: Optional[int] = None) -> Iterator[T]:
+        """
+        Yield all the models from the table, following the pagination lazily.
+
+        With `segments`, the table is scanned in that many segments in parallel (Segment/TotalSegments), one thread
+        for each, and the models are yielded as the pages arrive, in no particular order. For the operations over
+        the whole table, like maintenance and reports.
+        """
+        if not segments or segments <= 1:
+            yield from cls.iter_filter(page_size=page_size)
+            return
+        if session := _current_session.get():
+            # The table must have the buffered writes
+            session.flush()
+        operation, request_attributes = cls.filter_request()
+        if page_size:
+            request_attributes["Limit"] = page_size
+        raw = cls.raw_client() is not None
+        # Bounded, so the scan doesn't get too ahead of the consumer
+        pages: Queue = Queue(maxsize=2 * segments)
+        stop = threading.Event()
+
+        def scan_segment(segment: int) -> None:
+            """Put the pages of models of the segment in the queue, then the error, if any, and None when finished"""
+            try:
+                segment_attributes = {**request_attributes, "Segment": segment, "TotalSegments": segments}
+                for response in cls.iter_responses(operation, segment_attributes):
+                    if stop.is_set():
+                        return
+                    pages.put([cls.from_item(item, raw=raw) for item in response["Items"]])
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                pages.put(err)
+            finally:
+                pages.put(None)
+
+        finished = 0
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            for segment in range(segments):
+                executor.submit(scan_segment, segment)
+            try:
+                while finished < segments:
+                    page = pages.get()
+                    if page is None:
+                        finished += 1
+                    elif isinstance(page, Exception):
+                        raise page
+                    else:
+                        for item in page:
+                            yield cls.register(item)
+            finally:
+                # Stop the other segments, on error or when the consumer stops early
+                stop.set()
+                while finished < segments:
+                    if pages.get() is None:
+                        finished += 1
+
+    @classmethod
+    def filter(cls, **kwargs) -> list[T]:
+        """
+        Return all models from the table matching the filter, in the order they were created.
+        The queries of an index with the created_at range key return them in this order, the others are sorted.
+        """
+        items = list(cls.iter_filter(**kwargs))
+        if cls.creation_ordered(kwargs):
+            return items
+        # Partial records without created_at are kept in the table order
+        return sorted(items, key=lambda item: getattr(item, "created_at", ""))
+
+    @classmethod
+    def creation_ordered(cls, kwargs: dict[str, Any]) -> bool:
+        """
+        Returns if `iter_filter` yields the items matching the filter in the order they were created, querying a key
+        schema with the created_at range key. The scans and the partitions answered by the session are not ordered.
+        """
+        _, key_schema = cls.choose_index(kwargs)
+        if key_schema is None or key_schema[1:] != ["created_at"]:
+            return False
+        return not (_current_session.get() and cls.clazz.key_schema[0] in kwargs)
+
+    @classmethod
+    def iter_filter(
+        cls,
+        limit: Optional[int] = None,
+        page_size: Optional[int] = None,
+        fields: Optional[list[str]] = None,
+        **kwargs,
+    ) -> Iterator[T]:
+        """
+        Yield the models from the table matching the filter, following the pagination lazily.
+
+        If the hash key of the table or of a secondary index is in the filter, the best one is queried (see
+        `choose_index`), otherwise the table is scanned.
+        In a session, filters by the table hash key load the whole partition once and are answered from memory. With
+        `fields`, the partitions not loaded are queried with the projection instead, unless the session buffers the
+        writes, which are taken from the loaded models.
+        :param limit: The max number of models to yield.
+        :param page_size: The max number of items evaluated in each request, before the filter is applied.
+        :param fields: Fetch only these attributes (and the key and version), yielding partial records instead of models.
+        """
+        if limit is not None and limit <= 0:
+            return
+        if not (session := _current_session.get()):
+            yield from cls.iter_table(limit=limit, page_size=page_size, fields=fields, **kwargs)
+            return
+        hash_key = cls.clazz.key_schema[0]
+        if hash_key not in kwargs or (
+            fields
+            and not session.write_behind
+            and (cls.table_name, to_dynamo_value(kwargs[hash_key])) not in session.loaded_partitions
+        ):
+            # The table must have the buffered writes to answer the filter
+            session.flush()
+            for item in cls.iter_table(limit=limit, page_size=page_size, fields=fields, **kwargs):
+                yield item if fields else cls.register(item)
+            return
+        matching = islice(cls.iter_partition(session, **kwargs), limit)
+        if fields:
+            yield from (cls.project(item, fields) for item in matching)
+        else:
+            yield from matching
+
+    @classmethod
+    def iter_partition(cls, session: Session, **kwargs) -> Iterator[T]:
+        """Yield the models in the session matching the filter, loading the partition of the hash key if needed"""
+        hash_key = cls.clazz.key_schema[0]
+        hash_value = to_dynamo_value(kwargs[hash_key])
+        if (cls.table_name, hash_value) not in session.loaded_partitions:
+            for item in cls.iter_table(**{hash_key: hash_value}):
+                cls.register(item)
+            session.loaded_partitions.add((cls.table_name, hash_value))
+        for item in session.partition(cls.table_name, hash_value):
+            if all(to_dynamo_value(getattr(item, k, None)) == to_dynamo_value(v) for k, v in kwargs.items()):
+                yield item
+
+    @classmethod
+    def iter_table(
+        cls,
+        limit: Optional[int] = None,
+        page_size: Optional[int] = None,
+        fields: Optional[list[str]] = None,
+        **kwargs,
+    ) -> Iterator[T]:
+        """Yield the models from the table matching the filter, skipping the session. See `iter_filter`"""
+        operation, request_attributes = cls.filter_request(**kwargs)
+        if page_size:
+            request_attributes["Limit"] = page_size
+        if fields:
+            fields = list(dict.fromkeys(cls.clazz.key_schema + fields + ["version"]))
+            request_attributes.setdefault("ExpressionAttributeNames", {})
+            projection_expression = []
+            for attr_name in fields:
+                projection_expression.append(f"#{attr_name}")
+                request_attributes["ExpressionAttributeNames"][f"#{attr_name}"] = attr_name
+            request_attributes["ProjectionExpression"] = ",".join(projection_expression)
+
+        raw = cls.raw_client() is not None
+        yielded = 0
+        for response in cls.iter_responses(operation, request_attributes):
+            for item in response["Items"]:
+                if fields:
+                    yield cls.partial(from_attribute_values(item) if raw else item)
+                else:
+                    yield cls.from_item(item, raw=raw)
+                yielded += 1
+                if yielded == limit:
+                    return
+
+    @classmethod
+    def count(cls, **kwargs) -> int:
+        """
+        Return how many models in the table match the filter, without fetching them.
+
+        In a session, counts by the hash key of a partition already loaded are answered from memory, see `iter_filter`.
+        """
+        session = _current_session.get()
+        hash_key = cls.clazz.key_schema[0]
+        if (
+            session
+            and hash_key in kwargs
+            and (cls.table_name, to_dynamo_value(kwargs[hash_key])) in session.loaded_partitions
+        ):
+            return sum(1 for _ in cls.iter_partition(session, **kwargs))
+        if session:
+            session.flush()
+        operation, request_attributes = cls.filter_request(**kwargs)
+        request_attributes["Select"] = "COUNT"
+        return sum(response["Count"] for response in cls.iter_responses(operation, request_attributes))
+
+    @classmethod
+    def filter_request(cls, **kwargs) -> tuple[Callable[..., dict], dict[str, Any]]:
+        """
+        Returns the operation (query or scan) and the request attributes to get the items matching the filter.
+        With the low-level client, the operation is the client one and the values are AttributeValues.
+        See `iter_filter`.
+        """
+        index_name, key_schema = cls.choose_index(kwargs)
+        use_query = key_schema is not None
+        request_attributes = {}
+        if kwargs:
+            key_condition_expression = []
+            filter_expression = []
+            expression_attribute_names = {}
+            expression_attribute_values = {}
+            for attr_name, attr_value in kwargs.items():
+                expression = f"#{attr_name}=:{attr_name}"
+                if use_query and attr_name in key_schema:
+                    key_condition_expression.append(expression)
+                else:
+                    filter_expression.append(expression)
+                expression_attribute_names[f"#{attr_name}"] = attr_name
+                expression_attribute_values[f":{attr_name}"] = to_dynamo_value(attr_value)
+            request_attributes = {
+                "ExpressionAttributeNames": expression_attribute_names,
+                "ExpressionAttributeValues": expression_attribute_values,
+            }
+            if key_condition_expression:
+                request_attributes["KeyConditionExpression"] = " and ".join(key_condition_expression)
+            if filter_expression:
+                request_attributes["FilterExpression"] = " and ".join(filter_expression)
+        if index_name:
+            request_attributes["IndexName"] = index_name
+        if use_query:
+            # In the range key order, see `filter`
+            request_attributes["ScanIndexForward"] = True
+        if client := cls.raw_client():
+            if "ExpressionAttributeValues" in request_attributes:
+                request_attributes["ExpressionAttributeValues"] = to_attribute_values(
+                    request_attributes["ExpressionAttributeValues"]
+                )
+            operation = client.query if use_query else client.scan
+            return functools.partial(operation, TableName=cls.table_name), request_attributes
+        return (cls.table.query if use_query else cls.table.scan), request_attributes
+
+    @classmethod
+    def iter_responses(cls, operation: Callable[..., dict], request_attributes: dict[str, Any]) -> Iterator[dict]:
+        """Yield the responses of the operation (query or scan) following the pagination"""
+        request_attributes = dict(request_attributes)
+        while True:
+            try:
+                response = operation(**request_attributes)
+            except ClientError as err:
+                logger.error(
+                    "Couldn't get any movie from table %s. Here's why: %s: %s",
+                    cls.table_name,
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"],
+                )
+                raise
+            yield response
+            if "LastEvaluatedKey" not in response:
+                return
+            request_attributes["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    @classmethod
+    def field_type(cls, attr_name: str) -> type:
+        """Returns the python type of a model attribute, without the Optional"""
+        python_type = cls.clazz.model_fields[attr_name].annotation
+        if hasattr(python_type, "__args__"):
+            python_type = python_type.__args__[0]
+        return python_type
+
+    @classmethod
+    def partial(cls, item: dict[str, Any]) -> SimpleNamespace:
+        """
+        Returns a lightweight record with the attributes of a partial item, without the model validation.
+        Only Enum and numbers are converted to the attribute type.
+        """
+        values = {}
+        for attr_name, attr_value in item.items():
+            if attr_value is not None and attr_name in cls.clazz.model_fields:
+                python_type = cls.field_type(attr_name)
+                if issubclass(python_type, Enum) or python_type in (int, float):
+                    attr_value = python_type(attr_value)
+            values[attr_name] = attr_value
+        values.setdefault("version", 0)
+        return SimpleNamespace(**values)
+
+    @classmethod
+    def project(cls, item: "BaseModel", fields: list[str]) -> SimpleNamespace:
+        """Returns a partial record of the model with only the fields (and the key and version)"""
+        return SimpleNamespace(
+            **{attr_name: getattr(item, attr_name) for attr_name in cls.clazz.key_schema + fields + ["version"]}
+        )
+
+    @classmethod
+    def attribute_definition(cls, attr_name: str) -> dict[str, str]:
+        """Returns the DynamoDB attribute definition of a model attribute"""
+        python_type = cls.field_type(attr_name)
+        if issubclass(python_type, Enum):
+            python_type = str
+        return {"AttributeName": attr_name, "AttributeType": type_map[python_type]}
+
+    @classmethod
+    def billing_mode(cls) -> str:
+        """
+        Returns the billing mode of the table, PROVISIONED or PAY_PER_REQUEST (on-demand, for bursty workloads), from
+        the model `billing_mode` or the DYNAMODB_BILLING_MODE environment variable
+        """
+        return (cls.clazz.billing_mode or setting("DYNAMODB_BILLING_MODE")).upper()
+
+    @classmethod
+    def provisioned_throughput(cls) -> dict[str, Any]:
+        """Returns the ProvisionedThroughput attribute of the table and the indexes, none for on-demand billing"""
+        if cls.billing_mode() == "PAY_PER_REQUEST":
+            return {}
+        return {"ProvisionedThroughput": dict(PROVISIONED_THROUGHPUT)}
+
+    @classmethod
+    def global_secondary_index(cls, index_key_schema: list[str]) -> dict[str, Any]:
+        """Returns the DynamoDB definition of a secondary index"""
+        return {
+            "IndexName": cls.index_name(index_key_schema),
+            "KeySchema": dynamo_key_schema(index_key_schema),
+            "Projection": {"ProjectionType": "ALL"},
+            **cls.provisioned_throughput(),
+        }
 
     @classmethod
     def create_table(cls) -> ServiceResource:
-        """Creates a DynamoDB table"""
+        """Creates a DynamoDB table, with the secondary indexes"""
         try:
             key_schema = cls.clazz.key_schema
             if not key_schema:
                 raise AssertionError("Key schema doesn't exist")
-            dy_key_schema = []
-            attribute_definitions = []
-            for attr_name in key_schema:
-                dy_key_schema.append(
-                    {
-                        "AttributeName": attr_name,
-                        "KeyType": "HASH" if attr_name == key_schema[0] else "RANGE",
-                    }
-                )
-                attr = cls.clazz.model_fields[attr_name]
-                python_type = attr.annotation
-                if hasattr(python_type, "__args__"):
-                    python_type = python_type.__args__[0]
-                elif issubclass(python_type, Enum):
-                    python_type = str
-                attribute_definitions.append({"AttributeName": attr_name, "AttributeType": type_map[python_type]})
-            table = cls.resource.create_table(
+            attr_names = dict.fromkeys(key_schema)
+            for index_key_schema in cls.clazz.secondary_indexes:
+                attr_names.update(dict.fromkeys(index_key_schema))
+            table_attributes = {}
+            if cls.clazz.secondary_indexes:
+                table_attributes["GlobalSecondaryIndexes"] = [
+                    cls.global_secondary_index(index_key_schema) for index_key_schema in cls.clazz.secondary_indexes
+                ]
+            table = BaseModelService.resource.create_table(
                 TableName=cls.table_name,
-                KeySchema=dy_key_schema,
-                AttributeDefinitions=attribute_definitions,
-                ProvisionedThroughput={
-                    "ReadCapacityUnits": 10,
-                    "WriteCapacityUnits": 10,
-                },
+                KeySchema=dynamo_key_schema(key_schema),
+                AttributeDefinitions=[cls.attribute_definition(attr_name) for attr_name in attr_names],
+                BillingMode=cls.billing_mode(),
+                **cls.provisioned_throughput(),
+                **table_attributes,
             )
             table.wait_until_exists()
         except ClientError as err:
@@ -187,42 +893,519 @@ class BaseModelService(Generic[T], metaclass=MetaBaseModelService):
             raise
         return table
 
+    @classmethod
+    def create_missing_indexes(cls, table: ServiceResource) -> None:
+        """
+        Creates the secondary indexes declared in the model that doesn't exist in the table.
+
+        The indexes are only used in queries after DynamoDB finishes the backfill and they become active.
+        """
+        table_indexes = {index["IndexName"] for index in table.global_secondary_indexes or []}
+        for index_key_schema in cls.clazz.secondary_indexes:
+            if cls.index_name(index_key_schema) in table_indexes:
+                continue
+            logger.info("Creating index %s in %s", cls.index_name(index_key_schema), cls.table_name)
+            try:
+                table.update(
+                    AttributeDefinitions=[cls.attribute_definition(attr_name) for attr_name in index_key_schema],
+                    GlobalSecondaryIndexUpdates=[{"Create": cls.global_secondary_index(index_key_schema)}],
+                )
+            except ClientError as err:
+                # Only one index can be created at a time, the others will be created in a next time
+                logger.warning(
+                    "Couldn't create index %s in %s. Here's why: %s: %s",
+                    cls.index_name(index_key_schema),
+                    cls.table_name,
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"],
+                )
+                return
+
+    @classmethod
+    def provision(cls, timeout: float = 600) -> list[str]:
+        """
+        Create the table, or the secondary indexes missing in it, waiting until the indexes are active.
+        Returns the problems that can't be fixed, like a key schema different from the model.
+
+        Meant to run in the deploy (`flask create-tables`), so the requests can use TRUST_TABLE_SCHEMA.
+        """
+        table = BaseModelService.resource.Table(cls.table_name)
+        try:
+            table.load()
+        except ClientError as err:
+            if err.response["Error"]["Code"] != "ResourceNotFoundException":
+                raise
+            table = cls.create_table()
+        problems = []
+        if (key_schema := dynamo_key_schema(cls.clazz.key_schema)) != table.key_schema:
+            problems.append(f"Table {cls.table_name} key schema is {table.key_schema}, expected {key_schema}")
+        index_names = [cls.index_name(index_key_schema) for index_key_schema in cls.clazz.secondary_indexes]
+        deadline = time.monotonic() + timeout
+        while True:
+            # DynamoDB creates one index at a time
+            cls.create_missing_indexes(table)
+            table.reload()
+            status = {index["IndexName"]: index.get("IndexStatus") for index in table.global_secondary_indexes or []}
+            if not (pending := [index_name for index_name in index_names if status.get(index_name) != "ACTIVE"]):
+                break
+            if time.monotonic() > deadline:
+                problems.append(f"Table {cls.table_name} indexes not active: {', '.join(pending)}")
+                break
+            logger.info("Waiting for the indexes %s in %s", ", ".join(pending), cls.table_name)
+            time.sleep(PROVISION_POLL_INTERVAL)
+        _described_tables[cls.table_name] = table.global_secondary_indexes or []
+        for problem in [cls.update_billing_mode(table), cls.enable_ttl()]:
+            if problem:
+                problems.append(problem)
+        return problems
+
+    @classmethod
+    def update_billing_mode(cls, table: ServiceResource) -> Optional[str]:
+        """
+        Change the billing mode of the table to `billing_mode`, if different, returning the problem that prevents it,
+        like the limit of one change a day. The local backends don't have billing modes.
+        """
+        if not cls.raw_client():
+            return None
+        billing_mode = cls.billing_mode()
+        if (table.billing_mode_summary or {}).get("BillingMode", "PROVISIONED") == billing_mode:
+            return None
+        update_attributes = cls.provisioned_throughput()
+        if update_attributes and table.global_secondary_indexes:
+            # The provisioned indexes need their capacity too
+            update_attributes["GlobalSecondaryIndexUpdates"] = [
+                {"Update": {"IndexName": index["IndexName"], **cls.provisioned_throughput()}}
+                for index in table.global_secondary_indexes
+            ]
+        logger.info("Changing the billing mode of %s to %s", cls.table_name, billing_mode)
+        try:
+            table.update(BillingMode=billing_mode, **update_attributes)
+        except ClientError as err:
+            return f"Couldn't change the billing mode of {cls.table_name} to {billing_mode}: {err}"
+        return None
+
+    @classmethod
+    def enable_ttl(cls) -> Optional[str]:
+        """
+        Enable the Time To Live of the table in the model `ttl_attribute`, if any, returning the problem that prevents
+        it. The local backends don't expire the items.
+        """
+        if not (ttl_attribute := cls.clazz.ttl_attribute) or not (client := cls.raw_client()):
+            return None
+        description = client.describe_time_to_live(TableName=cls.table_name)["TimeToLiveDescription"]
+        status = description.get("TimeToLiveStatus")
+        if status in ("ENABLED", "ENABLING"):
+            if (attr_name := description.get("AttributeName")) != ttl_attribute:
+                return f"Table {cls.table_name} TTL attribute is {attr_name}, expected {ttl_attribute}"
+            return None
+        if status == "DISABLING":
+            # DynamoDB doesn't accept changes while disabling, enabled in the next provision
+            return f"Table {cls.table_name} TTL is being disabled"
+        logger.info("Enabling TTL in %s with %s", cls.table_name, ttl_attribute)
+        client.update_time_to_live(
+            TableName=cls.table_name,
+            TimeToLiveSpecification={"Enabled": True, "AttributeName": ttl_attribute},
+        )
+        return None
+
     @classmethod
     def insert_one(cls, item: T) -> T:
         """Insert one item in the table"""
-        cls.table.put_item(Item=item.dynamo_dict())
+        if session := cls.write_behind_session():
+            session.buffer_put(cls, cls.item_key(item), item)
+            return item
+        if client := cls.raw_client():
+            client.put_item(TableName=cls.table_name, Item=cls.codec.to_attribute_values(item))
+        else:
+            cls.table.put_item(Item=item.dynamo_dict())
+        cls.write_through(item)
         return item
 
     @classmethod
     def insert_many(cls, items: list["BaseModel"]) -> None:
         """Insert a list of items in the table"""
+        if session := cls.write_behind_session():
+            for item in items:
+                session.buffer_put(cls, cls.item_key(item), item)
+            return
+        cls.put_items(items)
+        for item in items:
+            cls.write_through(item)
+
+    @classmethod
+    def put_items(cls, items: list["BaseModel"]) -> None:
+        """Put the items in the table in batches, skipping the session"""
+        if client := cls.raw_client():
+            cls.batch_write(client, [{"PutRequest": {"Item": cls.codec.to_attribute_values(item)}} for item in items])
+            return
         with cls.table.batch_writer() as writer:
             for item in items:
                 writer.put_item(Item=item.dynamo_dict())
 
     @classmethod
-    def update(cls, item: "BaseModel", **kwargs) -> None:
-        """Update an item in the table"""
-        dy_key = {}
-        key_schema = cls.clazz.key_schema
-        attribute_values = kwargs or item.dynamo_dict()
-        for attr in key_schema:
-            dy_key[attr] = getattr(item, attr)
+    def batch_write(cls, client: Any, requests: list[dict[str, Any]]) -> None:
+        """
+        Send the write requests (PutRequest or DeleteRequest) with the low-level client, in batches paced by the write
+        limiter of the table (see `write_limiter`), sending again the items not processed with backoff
+        """
+        limiter = write_limiter(cls.table_name)
+        for start in range(0, len(requests), BATCH_WRITE_MAX_ITEMS):
+            request_items = {cls.table_name: requests[start : start + BATCH_WRITE_MAX_ITEMS]}
+            attempt = 0
+            while request_items:
+                if attempt:
+                    time.sleep(min(BATCH_WRITE_MAX_BACKOFF, 0.05 * 2**attempt))
+                # One capacity unit for each item, up to 1 KB
+                response = limiter.call(
+                    len(request_items[cls.table_name]),
+                    functools.partial(client.batch_write_item, RequestItems=request_items),
+                )
+                request_items = response.get("UnprocessedItems")
+                attempt += 1
+
+    @classmethod
+    def delete_many(cls, items: Iterable["BaseModel"]) -> None:
+        """Delete the items from the table in batches, and from the session"""
+        keys = [cls.item_key(item) for item in items]
+        if client := cls.raw_client():
+            cls.batch_write(client, [{"DeleteRequest": {"Key": to_attribute_values(key)}} for key in keys])
+        else:
+            with cls.table.batch_writer() as writer:
+                for key in keys:
+                    writer.delete_item(Key=key)
+        if session := _current_session.get():
+            for key in keys:
+                session.remove(cls.table_name, key)
+
+    @classmethod
+    def archive(cls, items: Iterable["BaseModel"], file: IO[str]) -> int:
+        """
+        Write the items to the file, as JSON lines, and delete them from the table, returning how many were archived.
+
+        The items are streamed in batches, each batch is flushed to the file before being deleted.
+        """
+        archived = 0
+        batch = []
+        for item in items:
+            file.write(json.dumps(item.model_dump(mode="json")) + "\n")
+            batch.append(item)
+            if len(batch) == BATCH_WRITE_MAX_ITEMS:
+                archived += cls.archive_batch(batch, file)
+                batch = []
+        return archived + cls.archive_batch(batch, file)
+
+    @classmethod
+    def archive_batch(cls, batch: list["BaseModel"], file: IO[str]) -> int:
+        """Flush the items written to the file and delete them. See `archive`"""
+        file.flush()
+        cls.delete_many(batch)
+        return len(batch)
+
+    @classmethod
+    def copy_from(cls, source_table_name: str) -> int:
+        """
+        Copy all the items from the source table to the table of the service, returning how many were copied.
+
+        Used to migrate the data when the key schema changes, since DynamoDB doesn't allow changing it in place.
+        It's safe to run more than once, the items already in the table are kept, they may have changed since the
+        previous copy.
+        """
+        source_table = BaseModelService.resource.Table(source_table_name)
+        hash_key = cls.clazz.key_schema[0]
+        # Only DynamoDB throttles the writes
+        limiter = write_limiter(cls.table_name) if cls.raw_client() else None
+        scan_attributes = {}
+        copied = 0
+        skipped = 0
+        while True:
+            response = source_table.scan(**scan_attributes)
+            for item in response["Items"]:
+                put = functools.partial(
+                    cls.table.put_item,
+                    Item=item,
+                    ConditionExpression="attribute_not_exists(#hash_key)",
+                    ExpressionAttributeNames={"#hash_key": hash_key},
+                )
+                try:
+                    if limiter:
+                        limiter.call(1, put)
+                    else:
+                        put()
+                except ClientError as err:
+                    if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                    skipped += 1
+                else:
+                    copied += 1
+            if "LastEvaluatedKey" not in response:
+                break
+            scan_attributes["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        logger.info(
+            "Copied %d items from %s to %s, %d already there", copied, source_table_name, cls.table_name, skipped
+        )
+        return copied
+
+    @classmethod
+    def update_request(cls, item: "BaseModel", condition: Optional[dict[str, Any]] = None, **kwargs) -> dict[str, Any]:
+        """
+        Returns the UpdateItem request attributes to update the item with the kwargs, or with all the item attributes
+        if there is no kwargs, incrementing the item version.
+        With `condition`, the update only happens if the item in the table has the attributes with these values.
+        """
+        attribute_values = {k: to_dynamo_value(v) for k, v in kwargs.items()} or item.dynamo_dict()
+        dy_key = cls.item_key(item)
+        for attr in [*dy_key, "version"]:
             attribute_values.pop(attr, None)
         update_expression = []
-        expression_attribute_values = {}
+        expression_attribute_names = {"#version": "version"}
+        expression_attribute_values = {":version_increment": 1}
         for attr_name, attr_value in attribute_values.items():
-            setattr(item, attr_name, attr_value)
-            update_expression.append(f"{attr_name}=:{attr_name}")
-            if isinstance(attr_value, Enum):
-                attr_value = attr_value.value
+            update_expression.append(f"#{attr_name}=:{attr_name}")
+            expression_attribute_names[f"#{attr_name}"] = attr_name
             expression_attribute_values[f":{attr_name}"] = attr_value
-        cls.table.update_item(
-            Key=dy_key,
-            UpdateExpression="set " + ",".join(update_expression),
-            ExpressionAttributeValues=expression_attribute_values,
-            ReturnValues="UPDATED_NEW",
-        )
+        request_attributes = {
+            "Key": dy_key,
+            "UpdateExpression": "set " + ",".join(update_expression) + " add #version :version_increment",
+            "ExpressionAttributeNames": expression_attribute_names,
+            "ExpressionAttributeValues": expression_attribute_values,
+        }
+        if condition:
+            request_attributes["ConditionExpression"] = cls.condition_expression(
+                condition, expression_attribute_names, expression_attribute_values
+            )
+        return request_attributes
+
+    @staticmethod
+    def condition_expression(
+        condition: dict[str, Any],
+        expression_attribute_names: dict[str, str],
+        expression_attribute_values: dict[str, Any],
+    ) -> str:
+        """
+        Returns the ConditionExpression requiring the attributes to have the values in the condition, adding its names
+        and values to the request ones
+        """
+        condition_expression = []
+        for attr_name, attr_value in condition.items():
+            expression = f"#{attr_name}=:expected_{attr_name}"
+            if attr_name == "version" and attr_value == 0:
+                # Items created before the version attribute
+                expression = f"(attribute_not_exists(#version) or {expression})"
+            condition_expression.append(expression)
+            expression_attribute_names[f"#{attr_name}"] = attr_name
+            expression_attribute_values[f":expected_{attr_name}"] = to_dynamo_value(attr_value)
+        return " and ".join(condition_expression)
+
+    @classmethod
+    def updated(cls, item: "BaseModel", **kwargs) -> None:
+        """Apply in memory the update sent to the table"""
+        for attr_name, attr_value in kwargs.items():
+            setattr(item, attr_name, attr_value)
+        item.version += 1
+
+    @classmethod
+    def update(cls, item: "BaseModel", condition: Optional[dict[str, Any]] = None, **kwargs) -> None:
+        """
+        Update an item in the table, incrementing its version.
+
+        With `condition`, the item is only updated if the item in the table has the attributes with these values,
+        otherwise raises the ClientError ConditionalCheckFailedException. Conditional updates are never buffered.
+        """
+        if condition is None and (session := cls.write_behind_session()):
+            cls.buffer_update(session, item, **kwargs)
+            return
+        cls.table.update_item(**cls.update_request(item, condition=condition, **kwargs), ReturnValues="UPDATED_NEW")
+        cls.updated(item, **kwargs)
+        cls.write_through(item, **kwargs)
+
+    @classmethod
+    def increment(cls, item: "BaseModel", **deltas: int) -> None:
+        """
+        Add the deltas to the numeric attributes of the item, in memory and in the table with an ADD update.
+        The attributes must be numbers, or missing, in the table, DynamoDB can't add to NULL.
+
+        Unlike `update`, the version is not incremented, concurrent increments don't conflict and are all applied.
+        In a write-behind session, the increments are merged and sent with the other writes.
+        """
+        if not (deltas := {attr_name: delta for attr_name, delta in deltas.items() if delta}):
+            return
+        for attr_name, delta in deltas.items():
+            setattr(item, attr_name, (getattr(item, attr_name) or 0) + delta)
+        if session := cls.write_behind_session():
+            session.buffer_increment(cls, cls.item_key(item), deltas)
+            return
+        cls.send_increments([(item, deltas)])
+
+    @classmethod
+    def send_increments(cls, increments: list[tuple["BaseModel", dict[str, int]]]) -> None:
+        """
+        Send the increments to the table, skipping the session, setting in memory the values in the table, with the
+        increments of other workers. See `increment`
+        """
+        for item, deltas in increments:
+            response = cls.table.update_item(
+                Key=cls.item_key(item),
+                UpdateExpression="add " + ",".join(f"#{attr_name} :{attr_name}" for attr_name in deltas),
+                ExpressionAttributeNames={f"#{attr_name}": attr_name for attr_name in deltas},
+                ExpressionAttributeValues={f":{attr_name}": delta for attr_name, delta in deltas.items()},
+                ReturnValues="UPDATED_NEW",
+            )
+            for attr_name, attr_value in response.get("Attributes", {}).items():
+                setattr(item, attr_name, cls.field_type(attr_name)(attr_value))
+            cls.write_through(item, **{attr_name: getattr(item, attr_name) for attr_name in deltas})
+
+    @classmethod
+    def update_paths(
+        cls,
+        item: "BaseModel",
+        set_paths: dict[tuple[str, ...], Any],
+        remove_paths: Iterable[tuple[str, ...]] = (),
+        condition: Optional[dict[str, Any]] = None,
+    ) -> None:
+        """
+        Set and remove nested attributes of the item, in the table and in memory, by document path: the attribute name
+        followed by the keys of the maps. The parent maps must exist.
+
+        Unlike `update`, the version is not incremented, updates to different paths of a map don't conflict. The paths
+        are sent in requests of at most UPDATE_MAX_PATHS, never buffered by the session.
+        With `condition`, see `update`, the paths must fit in one request.
+        """
+        actions = [("set", path, to_dynamo_value(value)) for path, value in set_paths.items()]
+        actions += [("remove", path, None) for path in remove_paths]
+        if condition and len(actions) > UPDATE_MAX_PATHS:
+            raise ValueError(f"A conditional update can't change more than {UPDATE_MAX_PATHS} paths")
+        for start in range(0, len(actions), UPDATE_MAX_PATHS):
+            # The placeholders by attribute name (or map key), each one used in the paths is sent once
+            placeholders = {}
+            expression_attribute_values = {}
+            clauses = {"set": [], "remove": []}
+            for action, path, value in actions[start : start + UPDATE_MAX_PATHS]:
+                path_expression = [placeholders.setdefault(attr_name, f"#p{len(placeholders)}") for attr_name in path]
+                if action == "set":
+                    value_placeholder = f":v{len(expression_attribute_values)}"
+                    expression_attribute_values[value_placeholder] = value
+                    clauses["set"].append(f"{'.'.join(path_expression)}={value_placeholder}")
+                else:
+                    clauses["remove"].append(".".join(path_expression))
+            request_attributes = {
+                "Key": cls.item_key(item),
+                "UpdateExpression": " ".join(
+                    f"{action} {','.join(expressions)}" for action, expressions in clauses.items() if expressions
+                ),
+                "ExpressionAttributeNames": {placeholder: attr_name for attr_name, placeholder in placeholders.items()},
+            }
+            if condition:
+                request_attributes["ConditionExpression"] = cls.condition_expression(
+                    condition, request_attributes["ExpressionAttributeNames"], expression_attribute_values
+                )
+            if expression_attribute_values:
+                request_attributes["ExpressionAttributeValues"] = expression_attribute_values
+            cls.table.update_item(**request_attributes)
+        for path, value in set_paths.items():
+            if len(path) == 1:
+                setattr(item, path[0], value)
+            else:
+                set_path(getattr(item, path[0]), list(path[1:]), value)
+        for path in remove_paths:
+            if len(path) == 1:
+                setattr(item, path[0], None)
+            else:
+                remove_path(getattr(item, path[0]), list(path[1:]))
+
+    @classmethod
+    def compare_and_set(cls, item: "BaseModel", expected: dict[str, Any], **kwargs) -> bool:
+        """
+        Update the item only if the item in the table still has the expected values and the same version as the item
+        in memory, returning if it was updated. Only one of concurrent workers doing the same transition wins.
+        """
+        try:
+            cls.update(item, condition={**expected, "version": item.version}, **kwargs)
+        except ClientError as err:
+            if err.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                logger.info("%s %s changed in the table, not updated", cls.clazz.__name__, cls.item_key(item))
+                return False
+            raise
+        return True
+
+    @classmethod
+    def buffer_update(cls, session: Session, item: "BaseModel", **kwargs) -> None:
+        """Update the item in memory and buffer the update in the session"""
+        for attr_name, attr_value in kwargs.items():
+            setattr(item, attr_name, attr_value)
+        cls.write_through(item, **kwargs)
+        session.buffer_update(cls, cls.item_key(item), set(kwargs))
+
+    @classmethod
+    def update_many(cls, items: Iterable["BaseModel"], atomic: bool = False, **kwargs) -> None:
+        """Update the items in the table with the same kwargs. See `bulk_update`"""
+        cls.bulk_update([(item, kwargs) for item in items], atomic=atomic)
+
+    @classmethod
+    def bulk_update(cls, updates: Iterable[tuple["BaseModel", dict[str, Any]]], atomic: bool = False) -> None:
+        """
+        Update each item in the table with its kwargs, as `update` does.
+
+        The updates are sent concurrently, at most UPDATE_MANY_MAX_WORKERS at a time, paced by the write limiter of
+        the table in DynamoDB (see `write_limiter`).
+        If `atomic`, all the updates are sent in one transaction, either all of them are applied or none is,
+        limited to TRANSACT_MAX_ITEMS items. Atomic updates are never buffered by the session.
+        """
+        if not atomic and (session := cls.write_behind_session()):
+            for item, kwargs in updates:
+                cls.buffer_update(session, item, **kwargs)
+            return
+        cls.send_updates(list(updates), atomic=atomic, write_through=True)
+
+    @classmethod
+    def send_updates(
+        cls, updates: list[tuple["BaseModel", dict[str, Any]]], atomic: bool = False, write_through: bool = False
+    ) -> None:
+        """
+        Send the updates to the table, skipping the session unless `write_through`. See `bulk_update`
+
+        If some updates fail, the ones sent are still applied in memory before raising the first error.
+        """
+        requests = [cls.update_request(item, **kwargs) for item, kwargs in updates]
+        if not requests:
+            return
+        client = cls.table.meta.client
+        # Only DynamoDB throttles the writes
+        limiter = write_limiter(cls.table_name) if cls.raw_client() else None
+
+        def send_update(request: dict[str, Any]) -> dict:
+            send = functools.partial(client.update_item, TableName=cls.table_name, **request)
+            return limiter.call(1, send) if limiter else send()
+
+        if atomic:
+            if len(requests) > TRANSACT_MAX_ITEMS:
+                raise ValueError(f"A transaction can't update more than {TRANSACT_MAX_ITEMS} items")
+            try:
+                client.transact_write_items(
+                    TransactItems=[{"Update": {"TableName": cls.table_name, **request}} for request in requests]
+                )
+            except ClientError as err:
+                # None of the updates was applied
+                errors = [err] * len(requests)
+            else:
+                errors = [None] * len(requests)
+        else:
+            with ThreadPoolExecutor(max_workers=UPDATE_MANY_MAX_WORKERS) as executor:
+                futures = [executor.submit(send_update, request) for request in requests]
+            errors = [future.exception() for future in futures]
+        for (item, kwargs), error in zip(updates, errors):
+            if error is None:
+                cls.updated(item, **kwargs)
+                if write_through:
+                    cls.write_through(item, **kwargs)
+        if error := next((error for error in errors if error is not None), None):
+            if isinstance(error, ClientError):
+                logger.error(
+                    "Couldn't update items in table %s. Here's why: %s: %s",
+                    cls.table_name,
+                    error.response["Error"]["Code"],
+                    error.response["Error"]["Message"],
+                )
+            raise error
 
 
 class BaseModel(PydanticBaseModel):
@@ -232,12 +1415,21 @@ class BaseModel(PydanticBaseModel):
     """
 
     key_schema: ClassVar[list[str]] = None
+    table_name: ClassVar[Optional[str]] = None
+    # Key schemas ([hash, range]) of the global secondary indexes, used by the service to query instead of scan
+    secondary_indexes: ClassVar[list[list[str]]] = []
+    # Attribute with the epoch seconds when DynamoDB deletes the item (Time To Live), enabled by `provision`
+    ttl_attribute: ClassVar[Optional[str]] = None
+    # PROVISIONED or PAY_PER_REQUEST, see BaseModelService.billing_mode
+    billing_mode: ClassVar[Optional[str]] = None
 
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    # Incremented in each update, to detect concurrent changes. See BaseModelService.compare_and_set
+    version: int = 0
 
     def dynamo_dict(self) -> dict[str, Any]:
         """Returns a dict that dynamo will understand"""
-        return {k: v.value if isinstance(v, Enum) else v for k, v in self.model_dump().items()}
+        return model_codec(type(self)).to_item(self)
 
     def __hash__(self) -> int:
         """Return the hash of this item"""
@@ -0,0 +1,199 @@
+"""
+GitHub Cache Helper Functions
+
+This module caches the GitHub GET responses with their ETag (or Last-Modified) and makes conditional requests with
+them, so the resources not changed come back as 304 Not Modified, without payload and without consuming rate limit.
+The responses are kept in a LRU cache bounded by size, shared by the requesters of the process, and optionally in a
+SQLite database shared by the processes (GITHUB_CACHE_DATABASE), so the job processes, forked for each issue job, find
+the responses cached by the previous ones.
+The responses are cached by installation, the tokens of an installation change in each webhook.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+from cachetools import LRUCache
+from github.Requester import Requester
+
+from config import after_fork, setting
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    """A GET response with its validators"""
+
+    etag: Optional[str]
+    last_modified: Optional[str]
+    headers: dict[str, Any]
+    body: str
+
+
+class ResponseCache:
+    """
+    LRU cache of the GET responses, bounded by the size of their bodies, thread safe.
+    With a `database`, the responses are also kept in it, bounded by the same size, evicting the least recently used,
+    and deleted when not used for `ttl` seconds.
+    """
+
+    def __init__(self, max_bytes: int, database: Optional[str] = None, ttl: Optional[float] = None) -> None:
+        self.lock = threading.Lock()
+        self.responses: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=lambda response: len(response.body) + 1)
+        self.database = database
+        self.ttl = ttl
+        self.connection: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+    def store(self) -> Optional[sqlite3.Connection]:
+        """Returns the connection to the database, creating its table the first time, None if there is no database"""
+        if self.database and self.connection is None:
+            self.connection = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+                "headers TEXT NOT NULL, body TEXT NOT NULL, size INTEGER NOT NULL, used_at REAL NOT NULL)"
+            )
+        return self.connection
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        """Returns the cached response of the key, from the database if it is not in memory"""
+        with self.lock:
+            if (response := self.responses.get(key)) or not self.database:
+                return response
+            try:
+                store = self.store()
+                row = store.execute(
+                    "SELECT etag, last_modified, headers, body FROM responses WHERE key=? AND used_at>=?",
+                    [_store_key(key), self.expired_before()],
+                ).fetchone()
+                if row is None:
+                    return None
+                store.execute("UPDATE responses SET used_at=? WHERE key=?", [time.time(), _store_key(key)])
+            except sqlite3.Error as error:
+                logger.warning("Couldn't read the cached GitHub response: %s", error)
+                return None
+            response = CachedResponse(row[0], row[1], json.loads(row[2]), row[3])
+            if self.responses.getsizeof(response) <= self.responses.maxsize:
+                self.responses[key] = response
+            return response
+
+    def put(self, key: tuple, response: CachedResponse) -> None:
+        """Cache the response, if it fits in the cache"""
+        with self.lock:
+            size = self.responses.getsizeof(response)
+            if size > self.responses.maxsize:
+                return
+            self.responses[key] = response
+            if not self.database:
+                return
+            try:
+                store = self.store()
+                store.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [_store_key(key), *response[:2], json.dumps(response.headers), response.body, size, time.time()],
+                )
+                store.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER "
+                    "(ORDER BY used_at DESC, key) AS total FROM responses) WHERE total > ?)",
+                    [self.responses.maxsize],
+                )
+                store.execute("DELETE FROM responses WHERE used_at<?", [self.expired_before()])
+            except sqlite3.Error as error:
+                logger.warning("Couldn't cache the GitHub response: %s", error)
+
+    def record(self, hit: bool) -> None:
+        """Count a conditional request answered with the cached response (hit) or with a new one (miss)"""
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def clear(self) -> None:
+        """Forget the responses and the counters"""
+        with self.lock:
+            self.responses.clear()
+            self.hits = 0
+            self.misses = 0
+            if self.database:
+                try:
+                    self.store().execute("DELETE FROM responses")
+                except sqlite3.Error as error:
+                    logger.warning("Couldn't clear the cached GitHub responses: %s", error)
+
+    def expired_before(self) -> float:
+        """Returns the time the responses in the database last used before are expired"""
+        return time.time() - self.ttl if self.ttl is not None else 0.0
+
+
+def _store_key(key: tuple) -> str:
+    """Returns the key of the response in the database"""
+    return json.dumps(key, default=str)
+
+
+response_cache = ResponseCache(
+    setting("GITHUB_CACHE_MAX_BYTES"), setting("GITHUB_CACHE_DATABASE"), setting("GITHUB_CACHE_DATABASE_TTL")
+)
+
+
+class CachingRequester(Requester):
+    """
+    Requester making the GET requests conditional on the cached responses, see `response_cache`.
+    The responses are cached by installation, so an installation never gets the responses of another one: the
+    `installation_id` given, or by token if there is none.
+    """
+
+    def __init__(self, *args: Any, installation_id: Optional[int] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.installation_id = installation_id
+
+    def requestJson(
+        self,
+        verb: str,
+        url: str,
+        parameters: Optional[dict[str, Any]] = None,
+        headers: Optional[dict[str, Any]] = None,
+        input: Optional[Any] = None,  # pylint: disable=redefined-builtin
+        cnx: Optional[Any] = None,
+    ) -> tuple[int, dict[str, Any], str]:
+        if verb != "GET" or input is not None:
+            return super().requestJson(verb, url, parameters, headers, input, cnx)
+        key = (
+            self.installation_id if self.installation_id is not None else getattr(self.auth, "token", None),
+            url,
+            tuple(sorted((parameters or {}).items())),
+            tuple(sorted((headers or {}).items())),
+        )
+        request_headers = dict(headers or {})
+        if cached := response_cache.get(key):
+            if cached.etag:
+                request_headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                request_headers["If-Modified-Since"] = cached.last_modified
+        status, response_headers, body = super().requestJson(verb, url, parameters, request_headers, input, cnx)
+        if status == 304 and cached:
+            response_cache.record(hit=True)
+            return 200, {**cached.headers, **response_headers}, cached.body
+        if cached:
+            response_cache.record(hit=False)
+        if status == 200:
+            response_headers_lower = {name.lower(): value for name, value in response_headers.items()}
+            etag = response_headers_lower.get("etag")
+            last_modified = response_headers_lower.get("last-modified")
+            if etag or last_modified:
+                response_cache.put(key, CachedResponse(etag, last_modified, response_headers, body))
+        return status, response_headers, body
+
+
+@after_fork
+def _reset_after_fork() -> None:
+    """
+    The forked process keeps the responses, with a new lock, it may have been held by another thread, and opens the
+    database again, the connection can't be shared with the parent
+    """
+    response_cache.lock = threading.Lock()
+    response_cache.connection = None
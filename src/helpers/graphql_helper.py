@@ -0,0 +1,150 @@
+"""
+GraphQL Helper Functions
+
+This module reads and creates many GitHub objects with few requests, using aliased GraphQL queries and mutations with
+many objects in each one.
+"""
+
+import json
+from collections import defaultdict
+from typing import Any, Iterable, Optional
+
+from github import GithubException
+from github.Requester import Requester
+
+# Issues read in each GraphQL query
+GRAPHQL_MAX_ALIASES = 50
+# Issues created in each GraphQL mutation. GitHub limits the content creation, bigger mutations are more likely to be
+# rate limited
+GRAPHQL_MAX_MUTATIONS = 20
+ISSUE_STATE_FIELDS = "id state stateReason"
+
+
+def split_issue_url(issue_url: str) -> tuple[str, str, int]:
+    """Returns the owner, the repository name and the number of an issue API url"""
+    *_, owner, name, _, number = issue_url.rstrip("/").split("/")
+    return owner, name, int(number)
+
+
+def split_repository_url(repository_url: str) -> tuple[str, str]:
+    """Returns the owner and the name of a repository API url"""
+    *_, owner, name = repository_url.rstrip("/").split("/")
+    return owner, name
+
+
+def graphql(requester: Requester, query: str, errors_by_alias: Optional[dict[str, dict]] = None) -> dict[str, Any]:
+    """
+    Make the GraphQL query or mutation, returning the data.
+    Objects not found are returned as null. If `errors_by_alias` is given, the errors of an alias are added to it, by
+    the alias, the other errors raise GithubException, with the data returned in its `data`, as the objects of a
+    mutation may have been changed.
+    """
+    headers, response = requester.requestJsonAndCheck("POST", requester.graphql_url, input={"query": query})
+    errors = []
+    for error in response.get("errors", []):
+        if error.get("type") == "NOT_FOUND":
+            continue
+        if errors_by_alias is not None and error.get("path"):
+            errors_by_alias[error["path"][0]] = error
+        else:
+            errors.append(error)
+    if errors:
+        raise GithubException(400, {"errors": errors, "data": response.get("data") or {}}, headers)
+    return response.get("data") or {}
+
+
+def issue_states_query(issue_urls: list[str]) -> tuple[str, dict[str, tuple[str, str]]]:
+    """
+    Returns the query of the states of the issues, with the aliases of the repositories and of the issues in them.
+    The issues of the same repository are in the same repository alias.
+    """
+    issues_by_repository = defaultdict(list)
+    for issue_url in issue_urls:
+        owner, name, number = split_issue_url(issue_url)
+        issues_by_repository[owner, name].append((number, issue_url))
+    aliases = {}
+    repositories = []
+    for repository_index, ((owner, name), issues) in enumerate(issues_by_repository.items()):
+        repository_alias = f"r{repository_index}"
+        issues_query = []
+        for number, issue_url in issues:
+            issue_alias = f"i{number}"
+            aliases[issue_url] = (repository_alias, issue_alias)
+            issues_query.append(f"{issue_alias}: issue(number: {number}) {{ {ISSUE_STATE_FIELDS} }}")
+        repositories.append(
+            f"{repository_alias}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+            f"{{ {' '.join(issues_query)} }}"
+        )
+    return f"query {{ {' '.join(repositories)} }}", aliases
+
+
+def get_issue_states(requester: Requester, issue_urls: Iterable[str]) -> dict[str, dict[str, Any]]:
+    """
+    Read the states of the issues, GRAPHQL_MAX_ALIASES in each query.
+    Returns the `id` (node id), `state` and `state_reason`, in lowercase as in the REST API, by issue url.
+    The issues not found are not returned.
+    """
+    issue_urls = list(dict.fromkeys(issue_urls))
+    states = {}
+    for start in range(0, len(issue_urls), GRAPHQL_MAX_ALIASES):
+        query, aliases = issue_states_query(issue_urls[start : start + GRAPHQL_MAX_ALIASES])
+        data = graphql(requester, query)
+        for issue_url, (repository_alias, issue_alias) in aliases.items():
+            if issue := (data.get(repository_alias) or {}).get(issue_alias):
+                states[issue_url] = {
+                    "id": issue["id"],
+                    "state": issue["state"].lower(),
+                    "state_reason": issue["stateReason"].lower() if issue["stateReason"] else None,
+                }
+    return states
+
+
+def get_repository_ids(requester: Requester, repository_urls: Iterable[str]) -> dict[str, str]:
+    """
+    Read the node ids of the repositories, GRAPHQL_MAX_ALIASES in each query, by repository url.
+    The repositories not found are not returned.
+    """
+    repository_urls = list(dict.fromkeys(repository_urls))
+    repository_ids = {}
+    for start in range(0, len(repository_urls), GRAPHQL_MAX_ALIASES):
+        chunk = repository_urls[start : start + GRAPHQL_MAX_ALIASES]
+        repositories = []
+        for index, repository_url in enumerate(chunk):
+            owner, name = split_repository_url(repository_url)
+            repositories.append(f"r{index}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ id }}")
+        data = graphql(requester, f"query {{ {' '.join(repositories)} }}")
+        for index, repository_url in enumerate(chunk):
+            if repository := data.get(f"r{index}"):
+                repository_ids[repository_url] = repository["id"]
+    return repository_ids
+
+
+def create_issues(
+    requester: Requester, issues: list[tuple[str, str]]
+) -> tuple[list[Optional[str]], Optional[GithubException]]:
+    """
+    Create the issues, (repository node id, title), in one mutation, up to GRAPHQL_MAX_MUTATIONS.
+    Returns the reference {owner}/{repo}#{issue_number} of each issue created, in the same order, None if the
+    creation of the issue failed, and the error of the mutation if it failed as a whole. The issues created before
+    the error are still returned, the other ones are None.
+    """
+    mutations = [
+        f"c{index}: createIssue(input: {{repositoryId: {json.dumps(repository_id)}, title: {json.dumps(title)}}}) "
+        "{ issue { number repository { nameWithOwner } } }"
+        for index, (repository_id, title) in enumerate(issues)
+    ]
+    errors_by_alias: dict[str, dict] = {}
+    mutation_error = None
+    try:
+        data = graphql(requester, f"mutation {{ {' '.join(mutations)} }}", errors_by_alias)
+    except GithubException as error:
+        mutation_error = error
+        data = (error.data.get("data") or {}) if isinstance(error.data, dict) else {}
+    issue_refs: list[Optional[str]] = []
+    for index in range(len(issues)):
+        if f"c{index}" not in errors_by_alias and (created := data.get(f"c{index}")):
+            issue = created["issue"]
+            issue_refs.append(f"{issue['repository']['nameWithOwner']}#{issue['number']}")
+        else:
+            issue_refs.append(None)
+    return issue_refs, mutation_error
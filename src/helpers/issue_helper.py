@@ -7,42 +7,37 @@ from github.Issue import Issue
 from github.IssueComment import IssueComment
 from githubapp import Config
 
+TASK_PATTERN = re.compile(r"- \[(.)] (.*)")
+
 
 def has_tasklist(issue_body: str) -> bool:
     """Return if the issue has a tasklist"""
-    return bool(issue_body) and bool(re.search(r"- \[(.)] (.*)", issue_body))
+    return bool(issue_body) and bool(TASK_PATTERN.search(issue_body))
 
 
 def get_tasklist(issue_body: str) -> list[tuple[str, bool]]:
     """Return the tasks in a tasklist in the issue body, if there is any"""
     tasks = []
     for line in issue_body.split("\n"):
-        if task := re.match(r"- \[(.)] (.*)", line):
+        if task := TASK_PATTERN.match(line):
             checked = task.group(1) == "x"
             task_info: str = task.group(2).strip()
             tasks.append((task_info, checked))
     return tasks
 
 
-def get_issue_ref(issue: Issue) -> str:
-    """Return an issue reference {owner}/{repo}#{issue_number}"""
-    return f"{issue.repository.full_name}#{issue.number}"
-
-
-def handle_issue_state(checked: bool, task_issue: Issue) -> bool:
+def replace_tasks(issue_body: str, replacements: dict[str, str]) -> str:
     """
-    Handle the state of the issue.
-    If the issue is closed and the checkbox is checked, open the issue.
-    If the issue is open and the checkbox is unchecked, close the issue.
+    Replace the tasks in the tasklist of the issue body with their replacements, in one pass over the lines.
+    The tasks are matched as returned by `get_tasklist`, the rest of the line is kept.
     """
-    if checked:
-        if task_issue.state == "open":
-            task_issue.edit(state="closed")
-            return True
-    elif task_issue.state == "closed":
-        task_issue.edit(state="open")
-        return True
-    return False
+    lines = issue_body.split("\n")
+    for index, line in enumerate(lines):
+        if (task := TASK_PATTERN.match(line)) and (replacement := replacements.get(task.group(2).strip())):
+            start = task.start(2) + len(task.group(2)) - len(task.group(2).lstrip())
+            end = start + len(task.group(2).strip())
+            lines[index] = line[:start] + replacement + line[end:]
+    return "\n".join(lines)
 
 
 def update_issue_comment_status(issue: Issue, comment: str, issue_comment_id: Optional[int] = None) -> IssueComment:
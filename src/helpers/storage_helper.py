@@ -0,0 +1,1083 @@
+"""
+Storage Helper Functions
+
+This module contains the storage backends used by the BaseModelService. Besides DynamoDB, there are two local engines,
+one in memory and one in SQLite, for small installations and for running the whole pipeline without DynamoDB.
+The local engines implement the part of the DynamoDB resource API used by the service, including the expressions it
+builds, so the service is the same for every backend.
+"""
+
+# The arguments follow the DynamoDB API names
+# pylint: disable=invalid-name
+
+import functools
+import json
+import operator
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from copy import deepcopy
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+import boto3
+from botocore.config import Config as BotocoreConfig
+from botocore.exceptions import ClientError
+
+from config import after_fork, setting
+from src.helpers.capacity_helper import instrument
+
+# SQLite column types of the DynamoDB attribute types
+SQLITE_TYPES = {"S": "TEXT", "N": "NUMERIC", "B": "BLOB"}
+
+# The backends shared by all the services of the process, by id
+_backends: dict[str, Any] = {}
+_backends_lock = threading.Lock()
+
+_MISSING = object()
+# The tokens of the expressions: value placeholders, names (attributes, paths, keywords and functions), comparison
+# operators and symbols
+_TOKEN = re.compile(
+    r"\s*(?:(?P<value>:\w+)|(?P<name>[#\w]+(?:\.[#\w]+)*)|(?P<operator><>|<=|>=|=|<|>)|(?P<symbol>[(),]))"
+)
+_FUNCTIONS = {"attribute_exists", "attribute_not_exists"}
+_UPDATE_ACTIONS = {"set", "add", "remove"}
+_OPERATORS: dict[str, Callable[[Any, Any], bool]] = {
+    "=": operator.eq,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def storage_backend() -> Any:
+    """
+    Returns the storage backend set in the STORAGE_BACKEND environment variable, shared by all the services of the
+    process:
+    - "dynamodb" (the default): the DynamoDB resource, see `dynamodb_settings`, tracking the consumed capacity
+    - "memory": an in-memory engine, only for the tests and the benchmarks, it lives in the process memory, see
+      `in_process_storage`
+    - "sqlite": a SQLite engine, in the database file set in SQLITE_DATABASE
+    """
+    backend_name = storage_backend_name()
+    if backend_name == "dynamodb":
+        return _shared_backend("dynamodb", _dynamodb_resource)
+    if backend_name == "memory":
+        return _shared_backend("memory", MemoryBackend)
+    if backend_name == "sqlite":
+        database = setting("SQLITE_DATABASE")
+        return _shared_backend(f"sqlite:{database}", lambda: SQLiteBackend(database))
+    raise ValueError(f"Unknown storage backend: {backend_name}")
+
+
+def storage_backend_name() -> str:
+    """Returns the name of the storage backend set in the STORAGE_BACKEND environment variable, see `storage_backend`"""
+    return setting("STORAGE_BACKEND").lower()
+
+
+def in_process_storage() -> bool:
+    """
+    Returns if the storage backend lives in the memory of the process (the memory backend), so the writes of a forked
+    process are lost when it exits. With it, the work must run in the process itself
+    """
+    return storage_backend_name() == "memory"
+
+
+def dynamodb_client() -> Any:
+    """
+    Returns the low-level DynamoDB client, shared by the process, with the same settings as the resource.
+    Unlike the client of the resource, it doesn't convert the values, the items are DynamoDB AttributeValues.
+    """
+    return _shared_backend(
+        "dynamodb-client", lambda: instrument(boto3.session.Session().client("dynamodb", **dynamodb_settings()))
+    )
+
+
+def _dynamodb_resource() -> Any:
+    """Returns a new DynamoDB resource, with its client instrumented, see `instrument`"""
+    # A boto3 session of its own, the default session is not thread-safe
+    resource = boto3.session.Session().resource("dynamodb", **dynamodb_settings())
+    instrument(resource.meta.client)
+    return resource
+
+
+def dynamodb_settings() -> dict[str, Any]:
+    """
+    Returns the arguments to create the DynamoDB resource, from the environment variables:
+    - DYNAMODB_REGION
+    - DYNAMODB_ENDPOINT_URL, e.g. http://localhost:8000 for DynamoDB Local
+    - DYNAMODB_MAX_POOL_CONNECTIONS, the max of connections kept open, for all the threads
+    - DYNAMODB_CONNECT_TIMEOUT and DYNAMODB_READ_TIMEOUT, in seconds
+    - DYNAMODB_MAX_ATTEMPTS and DYNAMODB_RETRY_MODE ("standard", "adaptive" or "legacy")
+    The connections are kept alive between requests.
+    """
+    return {
+        "region_name": setting("DYNAMODB_REGION"),
+        "endpoint_url": setting("DYNAMODB_ENDPOINT_URL"),
+        "config": BotocoreConfig(
+            max_pool_connections=setting("DYNAMODB_MAX_POOL_CONNECTIONS"),
+            tcp_keepalive=True,
+            connect_timeout=setting("DYNAMODB_CONNECT_TIMEOUT"),
+            read_timeout=setting("DYNAMODB_READ_TIMEOUT"),
+            retries={
+                "max_attempts": setting("DYNAMODB_MAX_ATTEMPTS"),
+                "mode": setting("DYNAMODB_RETRY_MODE"),
+            },
+        ),
+    }
+
+
+def _shared_backend(backend_id: str, factory: Callable[[], Any]) -> Any:
+    """Returns the backend with the id, creating it the first time"""
+    with _backends_lock:
+        if backend_id not in _backends:
+            _backends[backend_id] = factory()
+        return _backends[backend_id]
+
+
+@after_fork
+def _reset_after_fork() -> None:
+    """
+    Drop the connections inherited by a forked process, like the job processes, they can't be shared with the parent.
+    The DynamoDB and SQLite backends are created again when used, the memory backend keeps a copy of the tables.
+    """
+    global _backends_lock  # pylint: disable=global-statement
+    # The lock may have been held by another thread of the parent
+    _backends_lock = threading.Lock()
+    for backend_id, backend in list(_backends.items()):
+        if isinstance(backend, MemoryBackend):
+            backend.lock = threading.RLock()
+        else:
+            del _backends[backend_id]
+
+
+def client_error(code: str, message: str, operation_name: str) -> ClientError:
+    """Returns the error that DynamoDB would raise"""
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation_name)
+
+
+def key_schema_names(key_schema: list[dict[str, str]]) -> list[str]:
+    """Returns the attribute names of a key schema in the DynamoDB format, the hash key first"""
+    return [key["AttributeName"] for key in sorted(key_schema, key=lambda key: key["KeyType"] != "HASH")]
+
+
+def dynamo_key_schema(key_names: list[str]) -> list[dict[str, str]]:
+    """Returns the key schema in the DynamoDB format, the first attribute is the hash key and the second the range"""
+    return [
+        {"AttributeName": attr_name, "KeyType": "RANGE" if position else "HASH"}
+        for position, attr_name in enumerate(key_names)
+    ]
+
+
+def item_segment(hash_value: Any, total_segments: int) -> int:
+    """Returns the segment of the parallel scan of the items with the partition key value, the same in any process"""
+    return zlib.crc32(json.dumps(hash_value, default=str).encode()) % total_segments
+
+
+def attribute_path(path_expression: str, names: dict[str, str]) -> list[str]:
+    """Returns the attribute names of a document path (`#a.#b`), replacing the expression attribute names"""
+    return [names.get(part, part) for part in path_expression.split(".")]
+
+
+def get_path(item: dict[str, Any], path: list[str]) -> Any:
+    """Returns the value in the path of the item, or _MISSING"""
+    value = item
+    for attr_name in path:
+        if not isinstance(value, dict) or attr_name not in value:
+            return _MISSING
+        value = value[attr_name]
+    return value
+
+
+def set_path(item: dict[str, Any], path: list[str], value: Any) -> None:
+    """Set the value in the path of the item, the parent maps must exist"""
+    parent = get_path(item, path[:-1])
+    if not isinstance(parent, dict):
+        raise client_error(
+            "ValidationException", "The document path provided in the update expression is invalid", "UpdateItem"
+        )
+    parent[path[-1]] = value
+
+
+def remove_path(item: dict[str, Any], path: list[str]) -> None:
+    """Remove the value in the path of the item, if any"""
+    if isinstance(parent := get_path(item, path[:-1]), dict):
+        parent.pop(path[-1], None)
+
+
+def tokenize(expression: str) -> list[tuple[str, str]]:
+    """Returns the tokens of the expression, (kind, text), raising ValueError on the unsupported characters"""
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        if not (match := _TOKEN.match(expression, position)):
+            raise ValueError(f"Unsupported expression {expression!r} at {position}")
+        tokens.append((match.lastgroup, match[match.lastgroup]))
+        position = match.end()
+    return tokens
+
+
+class ExpressionParser:
+    """
+    Parser of the expressions built by the services, to the tuples evaluated by the local backends, see `parse_condition`
+    and `parse_update`. Anything else raises ValueError.
+    """
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def error(self) -> ValueError:
+        """Returns the error of an unsupported expression"""
+        return ValueError(f"Unsupported expression {self.expression!r}")
+
+    def peek(self, offset: int = 0) -> Optional[tuple[str, str]]:
+        """Returns the next token, None in the end"""
+        position = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else None
+
+    def take(self, kind: str, text: Optional[str] = None) -> str:
+        """Consume the next token, it must be of the kind (and the text, case insensitive), returning its text"""
+        token = self.peek()
+        if token is None or token[0] != kind or (text is not None and token[1].lower() != text):
+            raise self.error()
+        self.position += 1
+        return token[1]
+
+    def keyword(self, keyword: str) -> bool:
+        """Consume the next token if it is the keyword, case insensitive"""
+        if (token := self.peek()) and token[0] == "name" and token[1].lower() == keyword:
+            self.position += 1
+            return True
+        return False
+
+    def end(self) -> None:
+        """The expression must have no more tokens"""
+        if self.peek() is not None:
+            raise self.error()
+
+    def condition(self) -> tuple:
+        """condition := conjunction (OR conjunction)*"""
+        node = self.conjunction()
+        while self.keyword("or"):
+            node = ("or", node, self.conjunction())
+        return node
+
+    def conjunction(self) -> tuple:
+        """conjunction := negation (AND negation)*"""
+        node = self.negation()
+        while self.keyword("and"):
+            node = ("and", node, self.negation())
+        return node
+
+    def negation(self) -> tuple:
+        """negation := NOT negation | "(" condition ")" | function "(" path ")" | operand comparator operand"""
+        if self.keyword("not"):
+            return ("not", self.negation())
+        if self.peek() == ("symbol", "("):
+            self.take("symbol", "(")
+            node = self.condition()
+            self.take("symbol", ")")
+            return node
+        token = self.peek()
+        if token and token[0] == "name" and token[1] in _FUNCTIONS and self.peek(1) == ("symbol", "("):
+            function = self.take("name")
+            self.take("symbol", "(")
+            path = self.take("name")
+            self.take("symbol", ")")
+            return (function, path)
+        left = self.operand()
+        comparator = self.take("operator")
+        return ("compare", comparator, left, self.operand())
+
+    def operand(self) -> tuple[str, str]:
+        """operand := path | value"""
+        token = self.peek()
+        if token is None or token[0] not in ("name", "value") or token[1].lower() in ("and", "or", "not"):
+            raise self.error()
+        self.position += 1
+        return token
+
+    def update(self) -> tuple[tuple[str, str, Optional[str]], ...]:
+        """
+        update := (SET path "=" value ("," path "=" value)* | ADD path value ("," path value)* | REMOVE path
+        ("," path)*)+
+        Returns the actions, (action, path, value)
+        """
+        actions = []
+        while self.peek() is not None:
+            action = self.take("name").lower()
+            if action not in _UPDATE_ACTIONS:
+                raise self.error()
+            while True:
+                path = self.take("name")
+                if action == "set":
+                    self.take("operator", "=")
+                    actions.append((action, path, self.take("value")))
+                elif action == "add":
+                    actions.append((action, path, self.take("value")))
+                else:
+                    actions.append((action, path, None))
+                if self.peek() != ("symbol", ","):
+                    break
+                self.take("symbol", ",")
+        if not actions:
+            raise self.error()
+        return tuple(actions)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_condition(expression: str) -> tuple:
+    """
+    Returns the condition expression parsed, with the DynamoDB precedence (NOT, AND, OR) and parentheses.
+    Only comparisons and attribute_exists/attribute_not_exists are supported, anything else raises ValueError.
+    """
+    parser = ExpressionParser(expression)
+    node = parser.condition()
+    parser.end()
+    return node
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_update(expression: str) -> tuple[tuple[str, str, Optional[str]], ...]:
+    """Returns the actions of the update expression, only SET path = value, ADD and REMOVE, see `ExpressionParser`"""
+    return ExpressionParser(expression).update()
+
+
+def evaluate_condition(expression: str, item: dict[str, Any], names: dict[str, str], values: dict[str, Any]) -> bool:
+    """Returns if the item matches the condition expression, see `parse_condition`"""
+    return _evaluate(parse_condition(expression), item, names, values)
+
+
+def _evaluate(node: tuple, item: dict[str, Any], names: dict[str, str], values: dict[str, Any]) -> bool:
+    """Returns if the item matches the parsed condition"""
+    kind = node[0]
+    if kind == "or":
+        return _evaluate(node[1], item, names, values) or _evaluate(node[2], item, names, values)
+    if kind == "and":
+        return _evaluate(node[1], item, names, values) and _evaluate(node[2], item, names, values)
+    if kind == "not":
+        return not _evaluate(node[1], item, names, values)
+    if kind in _FUNCTIONS:
+        exists = get_path(item, attribute_path(node[1], names)) is not _MISSING
+        return exists if kind == "attribute_exists" else not exists
+    _, comparator, left, right = node
+    left_value, right_value = _operand_value(left, item, names, values), _operand_value(right, item, names, values)
+    if left_value is _MISSING or right_value is _MISSING:
+        return comparator == "<>"
+    try:
+        return _OPERATORS[comparator](left_value, right_value)
+    except TypeError:
+        return False
+
+
+def _operand_value(
+    operand: tuple[str, str], item: dict[str, Any], names: dict[str, str], values: dict[str, Any]
+) -> Any:
+    """Returns the value of a value placeholder or of a path in the item"""
+    kind, text = operand
+    if kind == "value":
+        if text not in values:
+            raise ValueError(f"Missing value {text}")
+        return values[text]
+    return get_path(item, attribute_path(text, names))
+
+
+def key_conditions(expression: str, names: dict[str, str], values: dict[str, Any]) -> dict[str, Any]:
+    """Returns the values of the attributes in a key condition expression, only equalities joined by AND"""
+    conditions = {}
+    nodes = [parse_condition(expression)]
+    while nodes:
+        node = nodes.pop()
+        if node[0] == "and":
+            nodes.extend(node[1:])
+        elif node[0] == "compare" and node[1] == "=" and node[2][0] == "name" and node[3][0] == "value":
+            conditions[attribute_path(node[2][1], names)[0]] = _operand_value(node[3], {}, names, values)
+        else:
+            raise ValueError(f"Unsupported key condition {expression!r}")
+    return conditions
+
+
+def apply_update(item: dict[str, Any], expression: str, names: dict[str, str], values: dict[str, Any]) -> set[str]:
+    """
+    Apply the update expression (set, add and remove clauses) to the item in place, see `parse_update`.
+    Returns the names of the attributes updated.
+    """
+    updated = set()
+    for action, path_expression, value_expression in parse_update(expression):
+        path = attribute_path(path_expression, names)
+        if action == "set":
+            set_path(item, path, deepcopy(_operand_value(("value", value_expression), item, names, values)))
+        elif action == "add":
+            increment = _operand_value(("value", value_expression), item, names, values)
+            if (current := get_path(item, path)) is not _MISSING:
+                increment = current | increment if isinstance(current, set) else current + increment
+            set_path(item, path, increment)
+        else:
+            remove_path(item, path)
+        updated.add(path[0])
+    return updated
+
+
+def project(item: dict[str, Any], expression: str, names: dict[str, str]) -> dict[str, Any]:
+    """Returns only the attributes of the item in the projection expression"""
+    projected = {}
+    for path_expression in expression.split(","):
+        path = attribute_path(path_expression.strip(), names)
+        if (value := get_path(item, path)) is _MISSING:
+            continue
+        parent = projected
+        for attr_name in path[:-1]:
+            parent = parent.setdefault(attr_name, {})
+        parent[path[-1]] = value
+    return projected
+
+
+class LocalTable(ABC):
+    """
+    A table of a local backend, with the operations of the DynamoDB Table resource used by the services.
+
+    The subclasses implement how the items are stored, loaded and selected by key attributes.
+    """
+
+    def __init__(self, backend: "LocalBackend", name: str) -> None:
+        self.backend = backend
+        self.name = name
+        self.meta = SimpleNamespace(client=backend.client)
+
+    @property
+    def definition(self) -> dict[str, Any]:
+        """Returns the key schema, the secondary indexes and the creation date of the table"""
+        return self.backend.describe(self.name)
+
+    @property
+    def key_names(self) -> list[str]:
+        """Returns the attribute names of the primary key"""
+        return self.definition["KeySchema"]
+
+    @property
+    def key_schema(self) -> list[dict[str, str]]:
+        """Returns the primary key in the DynamoDB format"""
+        return dynamo_key_schema(self.key_names)
+
+    @property
+    def creation_date_time(self) -> float:
+        """Returns when the table was created, raises ResourceNotFoundException if it doesn't exist"""
+        return self.definition["CreationDateTime"]
+
+    @property
+    def global_secondary_indexes(self) -> Optional[list[dict[str, Any]]]:
+        """Returns the secondary indexes in the DynamoDB format, local indexes are active right away"""
+        return [
+            {
+                "IndexName": index_name,
+                "KeySchema": dynamo_key_schema(index_key_schema),
+                "IndexStatus": "ACTIVE",
+            }
+            for index_name, index_key_schema in self.definition["Indexes"].items()
+        ] or None
+
+    def load(self) -> None:
+        """Raises ResourceNotFoundException if the table doesn't exist, the definition is always up to date"""
+        self.definition  # pylint: disable=pointless-statement
+
+    reload = load
+
+    def wait_until_exists(self) -> None:
+        """Local tables exist as soon as they are created"""
+        self.load()
+
+    def update(
+        self,
+        AttributeDefinitions: list[dict[str, str]] = (),
+        GlobalSecondaryIndexUpdates: list[dict[str, Any]] = (),
+        **_,
+    ) -> dict:
+        """Create the secondary indexes, only index creation is supported"""
+        attribute_types = {attr["AttributeName"]: attr["AttributeType"] for attr in AttributeDefinitions}
+        for index_update in GlobalSecondaryIndexUpdates:
+            if index := index_update.get("Create"):
+                self.backend.create_index(
+                    self.name, index["IndexName"], key_schema_names(index["KeySchema"]), attribute_types
+                )
+        return {}
+
+    def item_key(self, item: dict[str, Any], operation_name: str) -> tuple:
+        """Returns the primary key values of the item"""
+        try:
+            return tuple(item[attr_name] for attr_name in self.key_names)
+        except KeyError as err:
+            raise client_error(
+                "ValidationException", f"Missing the key {err.args[0]} in the item", operation_name
+            ) from err
+
+    def get_item(self, Key: dict[str, Any], **_) -> dict:
+        """Returns the item with the key, like DynamoDB GetItem"""
+        with self.backend.lock:
+            item = self.load_item(self.item_key(Key, "GetItem"))
+        return {"Item": item} if item is not None else {}
+
+    def put_item(
+        self,
+        Item: dict[str, Any],
+        ConditionExpression: Optional[str] = None,
+        ExpressionAttributeNames: Optional[dict[str, str]] = None,
+        ExpressionAttributeValues: Optional[dict[str, Any]] = None,
+        **_,
+    ) -> dict:
+        """
+        Create or replace the item, like DynamoDB PutItem.
+        Raises ConditionalCheckFailedException if the item in the table doesn't match the condition.
+        """
+        key = self.item_key(Item, "PutItem")
+        with self.backend.lock:
+            if ConditionExpression and not evaluate_condition(
+                ConditionExpression,
+                self.load_item(key) or {},
+                ExpressionAttributeNames or {},
+                ExpressionAttributeValues or {},
+            ):
+                raise client_error("ConditionalCheckFailedException", "The conditional request failed", "PutItem")
+            self.save_item(deepcopy(Item))
+        return {}
+
+    def delete_item(self, Key: dict[str, Any], **_) -> dict:
+        """Delete the item with the key, if it exists, like DynamoDB DeleteItem"""
+        with self.backend.lock:
+            self.remove_item(self.item_key(Key, "DeleteItem"))
+        return {}
+
+    def updated_item(
+        self,
+        Key: dict[str, Any],
+        UpdateExpression: str,
+        ExpressionAttributeNames: Optional[dict[str, str]] = None,
+        ExpressionAttributeValues: Optional[dict[str, Any]] = None,
+        ConditionExpression: Optional[str] = None,
+        **_,
+    ) -> tuple[dict[str, Any], set[str]]:
+        """
+        Returns the item with the update applied, without saving it, and the names of the attributes updated.
+        Raises ConditionalCheckFailedException if the item doesn't match the condition.
+        """
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        item = self.load_item(self.item_key(Key, "UpdateItem"))
+        if ConditionExpression and not evaluate_condition(ConditionExpression, item or {}, names, values):
+            raise client_error("ConditionalCheckFailedException", "The conditional request failed", "UpdateItem")
+        if item is None:
+            item = deepcopy(Key)
+        return item, apply_update(item, UpdateExpression, names, values)
+
+    def update_item(self, ReturnValues: str = "NONE", **kwargs) -> dict:
+        """Update or create the item, like DynamoDB UpdateItem"""
+        with self.backend.lock:
+            item, updated = self.updated_item(**kwargs)
+            self.save_item(item)
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": item}
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": {attr_name: item[attr_name] for attr_name in updated if attr_name in item}}
+        return {}
+
+    def query(self, **kwargs) -> dict:
+        """Returns the items matching the key condition, like DynamoDB Query"""
+        if not kwargs.get("KeyConditionExpression"):
+            raise client_error("ValidationException", "Query requires a KeyConditionExpression", "Query")
+        return self.read("Query", **kwargs)
+
+    def scan(self, **kwargs) -> dict:
+        """Returns the items of the table, like DynamoDB Scan"""
+        return self.read("Scan", **kwargs)
+
+    def read(
+        self,
+        operation_name: str,
+        IndexName: Optional[str] = None,
+        KeyConditionExpression: Optional[str] = None,
+        FilterExpression: Optional[str] = None,
+        ProjectionExpression: Optional[str] = None,
+        ExpressionAttributeNames: Optional[dict[str, str]] = None,
+        ExpressionAttributeValues: Optional[dict[str, Any]] = None,
+        Limit: Optional[int] = None,
+        ExclusiveStartKey: Optional[dict[str, Any]] = None,
+        Select: Optional[str] = None,
+        Segment: Optional[int] = None,
+        TotalSegments: Optional[int] = None,
+        **_,
+    ) -> dict:
+        """
+        Returns one page of the items matching the key condition and the filter, in the order of the key of the index
+        queried, then of the primary key, as in DynamoDB. The items without the index key are not in the index.
+        As in DynamoDB, `Limit` is the number of items evaluated before applying the filter.
+        With `Segment` and `TotalSegments`, only the items of the segment, by the hash of the partition key.
+        """
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        index_key_schema = self.key_names
+        if IndexName:
+            if IndexName not in self.definition["Indexes"]:
+                raise client_error(
+                    "ValidationException", "The table does not have the specified index: " + IndexName, operation_name
+                )
+            index_key_schema = self.definition["Indexes"][IndexName]
+        conditions = key_conditions(KeyConditionExpression, names, values) if KeyConditionExpression else {}
+        if conditions and (index_key_schema[0] not in conditions or not set(conditions) <= set(index_key_schema)):
+            raise client_error("ValidationException", "Query key condition not supported", operation_name)
+        if (Segment is None) != (TotalSegments is None) or (TotalSegments and not 0 <= Segment < TotalSegments):
+            raise client_error("ValidationException", "Invalid Segment and TotalSegments", operation_name)
+        # The LastEvaluatedKey of an index has the index key and the primary key
+        sort_key = list(dict.fromkeys(index_key_schema + self.key_names))
+        start_key = None
+        if ExclusiveStartKey:
+            try:
+                start_key = tuple(ExclusiveStartKey[attr_name] for attr_name in sort_key)
+            except KeyError as err:
+                raise client_error(
+                    "ValidationException", f"Missing the key {err.args[0]} in the ExclusiveStartKey", operation_name
+                ) from err
+        with self.backend.lock:
+            selected = self.select_items(conditions, sort_key, start_key, Limit)
+        evaluated = selected
+        if TotalSegments:
+            evaluated = [item for item in selected if item_segment(item[self.key_names[0]], TotalSegments) == Segment]
+        items = [
+            item
+            for item in evaluated
+            if not FilterExpression or evaluate_condition(FilterExpression, item, names, values)
+        ]
+        response = {"Count": len(items), "ScannedCount": len(evaluated)}
+        if Select != "COUNT":
+            response["Items"] = [
+                project(item, ProjectionExpression, names) if ProjectionExpression else item for item in items
+            ]
+        if Limit and len(selected) == Limit:
+            response["LastEvaluatedKey"] = {attr_name: selected[-1][attr_name] for attr_name in sort_key}
+        return response
+
+    @contextmanager
+    def batch_writer(self, **_) -> Iterator["LocalTable"]:
+        """Write the items in one transaction"""
+        with self.backend.transaction():
+            yield self
+
+    @abstractmethod
+    def load_item(self, key: tuple) -> Optional[dict[str, Any]]:
+        """Returns a copy of the item with the primary key values, or None"""
+
+    @abstractmethod
+    def save_item(self, item: dict[str, Any]) -> None:
+        """Store the item, replacing the one with the same primary key"""
+
+    @abstractmethod
+    def remove_item(self, key: tuple) -> None:
+        """Remove the item with the primary key values, if it exists"""
+
+    @abstractmethod
+    def select_items(
+        self, conditions: dict[str, Any], sort_key: list[str], start_key: Optional[tuple], limit: Optional[int]
+    ) -> list[dict]:
+        """
+        Returns copies of the items with the attribute values in `conditions` (key attributes of the table or of an
+        index), having all the `sort_key` attributes (the key of the index, then the primary key) and sorted by them,
+        after `start_key` (their values), at most `limit`.
+        """
+
+
+class LocalClient:
+    """The operations of the DynamoDB client used by the services, for a local backend"""
+
+    def __init__(self, backend: "LocalBackend") -> None:
+        self.backend = backend
+
+    def update_item(self, TableName: str, **kwargs) -> dict:
+        """Update the item in the table, see `LocalTable.update_item`"""
+        return self.backend.Table(TableName).update_item(**kwargs)
+
+    def transact_write_items(self, TransactItems: list[dict[str, Any]], **_) -> dict:
+        """Apply all the updates or none, only Update items are supported"""
+        with self.backend.transaction():
+            writes = []
+            for transact_item in TransactItems:
+                if set(transact_item) != {"Update"}:
+                    raise client_error(
+                        "ValidationException", "Only Update is supported in transactions", "TransactWriteItems"
+                    )
+                request = dict(transact_item["Update"])
+                table = self.backend.Table(request.pop("TableName"))
+                try:
+                    writes.append((table, table.updated_item(**request)[0]))
+                except ClientError as err:
+                    if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                    raise client_error(
+                        "TransactionCanceledException",
+                        "Transaction cancelled, please refer cancellation reasons for specific reasons "
+                        "[ConditionalCheckFailed]",
+                        "TransactWriteItems",
+                    ) from err
+            for table, item in writes:
+                table.save_item(item)
+        return {}
+
+
+class LocalBackend(ABC):
+    """
+    A backend that stores the tables in the process, with the operations of the DynamoDB resource used by the services.
+
+    The subclasses implement how the tables are described, created and indexed.
+    """
+
+    table_class: type[LocalTable]
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.client = LocalClient(self)
+        self.meta = SimpleNamespace(client=self.client)
+
+    def Table(self, name: str) -> LocalTable:
+        """Returns the table with the name, which may not exist yet"""
+        return self.table_class(self, name)
+
+    def create_table(
+        self,
+        TableName: str,
+        KeySchema: list[dict[str, str]],
+        AttributeDefinitions: list[dict[str, str]],
+        GlobalSecondaryIndexes: list[dict[str, Any]] = (),
+        **_,
+    ) -> LocalTable:
+        """Create the table with the secondary indexes, like DynamoDB CreateTable"""
+        attribute_types = {attr["AttributeName"]: attr["AttributeType"] for attr in AttributeDefinitions}
+        with self.transaction():
+            try:
+                self.describe(TableName)
+            except ClientError:
+                pass
+            else:
+                raise client_error("ResourceInUseException", f"Table already exists: {TableName}", "CreateTable")
+            self.create(TableName, key_schema_names(KeySchema), attribute_types)
+            for index in GlobalSecondaryIndexes:
+                self.create_index(TableName, index["IndexName"], key_schema_names(index["KeySchema"]), attribute_types)
+        return self.Table(TableName)
+
+    def batch_get_item(self, RequestItems: dict[str, dict[str, Any]], **_) -> dict:
+        """Returns the items with the keys in each table, like DynamoDB BatchGetItem"""
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            responses[table_name] = [item for key in request["Keys"] if (item := table.get_item(Key=key).get("Item"))]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    @staticmethod
+    def not_found(table_name: str) -> ClientError:
+        """Returns the error raised when the table doesn't exist"""
+        return client_error(
+            "ResourceNotFoundException", f"Requested resource not found: Table: {table_name} not found", "DescribeTable"
+        )
+
+    @abstractmethod
+    def describe(self, table_name: str) -> dict[str, Any]:
+        """
+        Returns the definition of the table: KeySchema and Indexes (attribute names), AttributeTypes and
+        CreationDateTime. Raises ResourceNotFoundException if the table doesn't exist.
+        """
+
+    @abstractmethod
+    def create(self, table_name: str, key_schema: list[str], attribute_types: dict[str, str]) -> None:
+        """Create the table, without indexes"""
+
+    @abstractmethod
+    def create_index(
+        self, table_name: str, index_name: str, index_key_schema: list[str], attribute_types: dict[str, str]
+    ) -> None:
+        """Create the secondary index in the table, indexing the existing items"""
+
+    @abstractmethod
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Apply all the writes done inside the context or none, blocking the other threads"""
+
+
+class MemoryTable(LocalTable):
+    """A table of the MemoryBackend"""
+
+    @property
+    def data(self) -> dict[str, Any]:
+        """Returns the items by primary key and the primary keys sorted"""
+        self.load()
+        return self.backend.tables[self.name]
+
+    def load_item(self, key: tuple) -> Optional[dict[str, Any]]:
+        item = self.data["items"].get(key)
+        return deepcopy(item) if item is not None else None
+
+    def save_item(self, item: dict[str, Any]) -> None:
+        data = self.data
+        key = self.item_key(item, "PutItem")
+        if key not in data["items"]:
+            insort(data["keys"], key)
+        data["items"][key] = deepcopy(item)
+
+    def remove_item(self, key: tuple) -> None:
+        data = self.data
+        if data["items"].pop(key, None) is not None:
+            del data["keys"][bisect_left(data["keys"], key)]
+
+    def select_items(
+        self, conditions: dict[str, Any], sort_key: list[str], start_key: Optional[tuple], limit: Optional[int]
+    ) -> list[dict]:
+        data = self.data
+        if sort_key != self.key_names:
+            # The items of an index are sorted when queried, scanning the table
+            index_items = []
+            for item in data["items"].values():
+                if any(item.get(attr_name) is None for attr_name in sort_key):
+                    continue
+                index_key = tuple(item[attr_name] for attr_name in sort_key)
+                if (start_key is None or index_key > start_key) and all(
+                    item.get(attr_name) == value for attr_name, value in conditions.items()
+                ):
+                    index_items.append((index_key, item))
+            index_items.sort(key=lambda index_item: index_item[0])
+            return [deepcopy(item) for _, item in index_items[:limit]]
+        keys = data["keys"]
+        start = bisect_right(keys, start_key) if start_key else 0
+        hash_key = self.key_names[0]
+        if hash_key in conditions:
+            # The items of the partition are together in the primary key order
+            start = max(start, bisect_left(keys, (conditions[hash_key],)))
+        selected = []
+        for key in keys[start:]:
+            if hash_key in conditions and key[0] != conditions[hash_key]:
+                break
+            item = data["items"][key]
+            if all(item.get(attr_name) == value for attr_name, value in conditions.items()):
+                selected.append(deepcopy(item))
+                if len(selected) == limit:
+                    break
+        return selected
+
+
+class MemoryBackend(LocalBackend):
+    """Backend that keeps the tables in memory, lost when the process ends"""
+
+    table_class = MemoryTable
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.tables: dict[str, dict[str, Any]] = {}
+
+    def describe(self, table_name: str) -> dict[str, Any]:
+        if table_name not in self.tables:
+            raise self.not_found(table_name)
+        return self.tables[table_name]["definition"]
+
+    def create(self, table_name: str, key_schema: list[str], attribute_types: dict[str, str]) -> None:
+        self.tables[table_name] = {
+            "definition": {
+                "KeySchema": key_schema,
+                "Indexes": {},
+                "AttributeTypes": attribute_types,
+                "CreationDateTime": time.time(),
+            },
+            "items": {},
+            "keys": [],
+        }
+
+    def create_index(
+        self, table_name: str, index_name: str, index_key_schema: list[str], attribute_types: dict[str, str]
+    ) -> None:
+        # The items are selected by the index attributes scanning the table
+        definition = self.describe(table_name)
+        definition["Indexes"][index_name] = index_key_schema
+        definition["AttributeTypes"].update(attribute_types)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        # The writes are only done after all of them are validated, so there is nothing to roll back
+        with self.lock:
+            yield
+
+
+def _quote(identifier: str) -> str:
+    """Returns the identifier quoted for SQLite"""
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _sqlite_value(value: Any) -> Any:
+    """Returns the value in a type that SQLite and json understand"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not supported")
+
+
+def _column_value(value: Any) -> Any:
+    """Returns the value to store in a SQLite column"""
+    return _sqlite_value(value) if isinstance(value, Decimal) else value
+
+
+class SQLiteTable(LocalTable):
+    """
+    A table of the SQLiteBackend.
+
+    Each item is a row with the JSON of the item and a column for each key attribute of the table and of the secondary
+    indexes, with the primary key and a SQLite index for each secondary index.
+    """
+
+    @property
+    def columns(self) -> list[str]:
+        """Returns the key attributes of the table and of the secondary indexes"""
+        definition = self.definition
+        columns = dict.fromkeys(definition["KeySchema"])
+        for index_key_schema in definition["Indexes"].values():
+            columns.update(dict.fromkeys(index_key_schema))
+        return list(columns)
+
+    def execute(self, sql: str, parameters: Iterable[Any] = ()) -> sqlite3.Cursor:
+        """Execute the SQL in the backend connection"""
+        return self.backend.connection.execute(sql, [_column_value(value) for value in parameters])
+
+    def load_item(self, key: tuple) -> Optional[dict[str, Any]]:
+        where = " AND ".join(f"{_quote(attr_name)}=?" for attr_name in self.key_names)
+        row = self.execute(f"SELECT item FROM {_quote(self.name)} WHERE {where}", key).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_item(self, item: dict[str, Any]) -> None:
+        self.item_key(item, "PutItem")
+        columns = self.columns
+        self.execute(
+            f"INSERT OR REPLACE INTO {_quote(self.name)} ({', '.join(map(_quote, columns))}, item) "
+            f"VALUES ({', '.join('?' * (len(columns) + 1))})",
+            [item.get(column) for column in columns] + [json.dumps(item, default=_sqlite_value)],
+        )
+
+    def remove_item(self, key: tuple) -> None:
+        where = " AND ".join(f"{_quote(attr_name)}=?" for attr_name in self.key_names)
+        self.execute(f"DELETE FROM {_quote(self.name)} WHERE {where}", key)
+
+    def select_items(
+        self, conditions: dict[str, Any], sort_key: list[str], start_key: Optional[tuple], limit: Optional[int]
+    ) -> list[dict]:
+        where = [f"{_quote(attr_name)}=?" for attr_name in conditions]
+        where += [f"{_quote(attr_name)} IS NOT NULL" for attr_name in sort_key if attr_name not in self.key_names]
+        parameters = list(conditions.values())
+        key_columns = ", ".join(map(_quote, sort_key))
+        if start_key:
+            where.append(f"({key_columns}) > ({', '.join('?' * len(start_key))})")
+            parameters.extend(start_key)
+        sql = f"SELECT item FROM {_quote(self.name)}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {key_columns}"
+        if limit:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return [json.loads(row[0]) for row in self.execute(sql, parameters)]
+
+
+class SQLiteBackend(LocalBackend):
+    """Backend that keeps the tables in a SQLite database, ":memory:" for a database in memory"""
+
+    table_class = SQLiteTable
+
+    def __init__(self, database: str = ":memory:") -> None:
+        super().__init__()
+        self.connection = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS _tables (name TEXT PRIMARY KEY, definition TEXT NOT NULL)")
+        self.definitions: dict[str, dict[str, Any]] = {}
+
+    def describe(self, table_name: str) -> dict[str, Any]:
+        with self.lock:
+            if table_name not in self.definitions:
+                row = self.connection.execute("SELECT definition FROM _tables WHERE name=?", [table_name]).fetchone()
+                if row is None:
+                    raise self.not_found(table_name)
+                self.definitions[table_name] = json.loads(row[0])
+            return self.definitions[table_name]
+
+    def save_definition(self, table_name: str, definition: dict[str, Any]) -> None:
+        """Store the definition of the table"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO _tables (name, definition) VALUES (?, ?)", [table_name, json.dumps(definition)]
+        )
+        self.definitions[table_name] = definition
+
+    def create(self, table_name: str, key_schema: list[str], attribute_types: dict[str, str]) -> None:
+        columns = [
+            f"{_quote(attr_name)} {SQLITE_TYPES[attribute_types.get(attr_name, 'S')]} NOT NULL"
+            for attr_name in key_schema
+        ]
+        self.connection.execute(
+            f"CREATE TABLE {_quote(table_name)} ({', '.join(columns)}, item TEXT NOT NULL, "
+            f"PRIMARY KEY ({', '.join(map(_quote, key_schema))}))"
+        )
+        self.save_definition(
+            table_name,
+            {
+                "KeySchema": key_schema,
+                "Indexes": {},
+                "AttributeTypes": attribute_types,
+                "CreationDateTime": time.time(),
+            },
+        )
+
+    def create_index(
+        self, table_name: str, index_name: str, index_key_schema: list[str], attribute_types: dict[str, str]
+    ) -> None:
+        with self.transaction():
+            table = self.Table(table_name)
+            definition = deepcopy(table.definition)
+            if index_name in definition["Indexes"]:
+                return
+            new_columns = [attr_name for attr_name in index_key_schema if attr_name not in table.columns]
+            for attr_name in new_columns:
+                column_type = SQLITE_TYPES[attribute_types.get(attr_name, "S")]
+                self.connection.execute(
+                    f"ALTER TABLE {_quote(table_name)} ADD COLUMN {_quote(attr_name)} {column_type}"
+                )
+            if new_columns:
+                # Fill the new columns from the items already stored
+                rows = self.connection.execute(f"SELECT rowid, item FROM {_quote(table_name)}").fetchall()
+                assignments = ", ".join(f"{_quote(attr_name)}=?" for attr_name in new_columns)
+                for rowid, item in rows:
+                    item = json.loads(item)
+                    self.connection.execute(
+                        f"UPDATE {_quote(table_name)} SET {assignments} WHERE rowid=?",
+                        [item.get(attr_name) for attr_name in new_columns] + [rowid],
+                    )
+            self.connection.execute(
+                f"CREATE INDEX {_quote(f'{table_name}.{index_name}')} ON {_quote(table_name)} "
+                f"({', '.join(map(_quote, index_key_schema))})"
+            )
+            definition["Indexes"][index_name] = index_key_schema
+            definition["AttributeTypes"].update(attribute_types)
+            self.save_definition(table_name, definition)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self.lock:
+            if self.connection.in_transaction:
+                yield
+                return
+            self.connection.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                # The definitions may have changed in the transaction
+                self.definitions.clear()
+                raise
+            self.connection.execute("COMMIT")
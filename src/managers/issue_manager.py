@@ -1,12 +1,18 @@
 """This module contains the logic for managing Github Issues."""
 
+import asyncio
+import gzip
 import logging
-import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
 from functools import lru_cache
-from typing import NoReturn, Optional, TypeVar
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, NoReturn, Optional, TypeVar
 
 import github
-from github import Consts, UnknownObjectException
+from github import Consts, GithubException, UnknownObjectException
 from github.Issue import Issue
 from github.Repository import Repository
 from github.Requester import Requester
@@ -19,8 +25,12 @@ from githubapp.events import (
 )
 from githubapp.webhook_handler import _get_auth
 
-from src.helpers import issue_helper
-from src.helpers.issue_helper import get_issue_ref, handle_issue_state
+from config import after_fork, setting
+from src.helpers import graphql_helper, issue_helper
+from src.helpers.async_github_helper import AsyncGithubClient
+from src.helpers.db_helper import BaseModelService
+from src.helpers.github_cache_helper import CachingRequester
+from src.helpers.graphql_helper import create_issues, get_issue_states, get_repository_ids
 from src.helpers.repository_helper import get_repository
 from src.helpers.text_helper import extract_repo_title, is_issue_ref, markdown_progress
 from src.models import IssueJob, IssueJobStatus, Job, JobStatus
@@ -29,11 +39,50 @@ from src.services import IssueJobService, JobService
 logger = logging.getLogger(__name__)
 T = TypeVar("T")
 
+# Jobs with their transitions written together by the pipeline, see JobPipeline
+PIPELINE_BATCH_SIZE = 25
+
+_github_executors: dict[int, ThreadPoolExecutor] = {}
+_github_executors_lock = threading.Lock()
+
+
+def finished_jobs_ttl() -> int:
+    """Returns the seconds to keep the finished jobs, set in the FINISHED_JOBS_TTL_DAYS environment variable"""
+    return int(setting("FINISHED_JOBS_TTL_DAYS") * 24 * 60 * 60)
+
+
+def github_max_workers() -> int:
+    """Returns the max concurrent GitHub calls of each installation, set in the GITHUB_MAX_WORKERS environment variable"""
+    return setting("GITHUB_MAX_WORKERS")
+
+
+def github_engine() -> str:
+    """Returns how the pipeline makes the GitHub calls, set in the GITHUB_ENGINE environment variable"""
+    return setting("GITHUB_ENGINE")
+
+
+def github_executor(installation_id: int) -> ThreadPoolExecutor:
+    """Returns the thread pool of the GitHub calls of the installation, shared by the process"""
+    with _github_executors_lock:
+        if installation_id not in _github_executors:
+            _github_executors[installation_id] = ThreadPoolExecutor(
+                max_workers=github_max_workers(), thread_name_prefix=f"github-{installation_id}"
+            )
+        return _github_executors[installation_id]
+
+
+@after_fork
+def _reset_github_executors_after_fork() -> None:
+    """The forked process doesn't have the threads of the pools, it creates its own"""
+    global _github_executors_lock  # pylint: disable=global-statement
+    _github_executors_lock = threading.Lock()
+    _github_executors.clear()
+
 
 def get_or_create_issue_job(event: IssuesEvent) -> IssueJob:
     """Get or create an issue job."""
     issue = event.issue
-    if not (issue_job := next(iter(IssueJobService.filter(issue_url=issue.url)), None)):
+    if not (issue_job := IssueJobService.get(issue_url=issue.url)):
         issue_comment = issue_helper.update_issue_comment_status(
             issue,
             "I'll manage the issues in the next minutes (sorry, free server :disappointed: )",
@@ -48,6 +97,9 @@ def get_or_create_issue_job(event: IssuesEvent) -> IssueJob:
                 hook_installation_target_id=event.hook_installation_target_id,
                 installation_id=event.installation_id,
                 milestone_url=issue.milestone.url if issue.milestone else None,
+                total_tasks=0,
+                done_tasks=0,
+                **JobService.new_document(),
             )
         )
     return issue_job
@@ -70,35 +122,49 @@ def handle_task_list(event: IssuesEvent) -> Optional[IssueJob]:
     """Handle the task list of an issue."""
     issue = event.issue
     tasklist = issue_helper.get_tasklist(issue.body)
-    existing_jobs = {}
-    created_issues = {}
-    for j in JobService.filter(original_issue_url=issue.url):
-        existing_jobs[j.task] = j
-        if j.issue_ref:
-            created_issues[j.issue_ref] = j
-    jobs = []
-
-    for task, checked in tasklist:
-        if task in existing_jobs:
-            continue
-        # issue created in a previous run
-        if created_issue := created_issues.get(task):
-            JobService.update(created_issue, checked=checked, job_status=JobStatus.PENDING)
-        else:
-            jobs.append(
-                Job(
-                    task=task,
-                    original_issue_url=issue.url,
-                    checked=checked,
+    # The issue job is created first, with the document of the jobs if they are stored in it, and read once
+    with BaseModelService.session():
+        issue_job = get_or_create_issue_job(event)
+        existing_jobs = {}
+        created_issues = {}
+        expiring_jobs = []
+        for j in JobService.filter(
+            original_issue_url=issue.url, fields=["task", "issue_ref", "job_status", "expires_at"]
+        ):
+            existing_jobs[j.task] = j
+            if j.issue_ref:
+                created_issues[j.issue_ref] = j
+            # Jobs saved before the expiration don't have the attribute
+            if getattr(j, "expires_at", None):
+                expiring_jobs.append(j)
+        # The issue is active again, its jobs must not expire
+        JobService.update_many(expiring_jobs, expires_at=None)
+        jobs = []
+        reopened = 0
+
+        for task, checked in tasklist:
+            if task in existing_jobs:
+                continue
+            # issue created in a previous run
+            if created_issue := created_issues.get(task):
+                if created_issue.job_status == JobStatus.DONE:
+                    reopened += 1
+                JobService.update(created_issue, checked=checked, job_status=JobStatus.PENDING)
+            else:
+                jobs.append(
+                    Job(
+                        task=task,
+                        original_issue_url=issue.url,
+                        checked=checked,
+                    )
                 )
-            )
 
-    if jobs:
-        JobService.insert_many(jobs)
+        if jobs:
+            JobService.insert_many(jobs)
+        count_tasks(issue_job, total=len(jobs), done=-reopened)
 
-    issue_job = get_or_create_issue_job(event)
-    if issue_job.issue_job_status == IssueJobStatus.DONE:
-        IssueJobService.update(issue_job, issue_job_status=IssueJobStatus.PENDING)
+        if issue_job.issue_job_status == IssueJobStatus.DONE:
+            IssueJobService.update(issue_job, issue_job_status=IssueJobStatus.PENDING, expires_at=None)
     return issue_job
 
 
@@ -116,8 +182,8 @@ def _get_gh(hook_installation_target_id: int, installation_id: int) -> github.Gi
 
 @lru_cache
 def _get_requester(hook_installation_target_id: int, installation_id: int) -> Requester:
-    """Get the Requester object for the given installation, cached"""
-    return Requester(
+    """Get the Requester object for the given installation, cached, with its GET responses cached by ETag"""
+    return CachingRequester(
         auth=_cached_get_auth(hook_installation_target_id, installation_id),
         base_url=Consts.DEFAULT_BASE_URL,
         timeout=Consts.DEFAULT_TIMEOUT,
@@ -125,7 +191,9 @@ def _get_requester(hook_installation_target_id: int, installation_id: int) -> Re
         per_page=Consts.DEFAULT_PER_PAGE,
         verify=True,
         retry=github.GithubRetry(),
-        pool_size=None,
+        # One connection for each concurrent call, see github_executor
+        pool_size=github_max_workers(),
+        installation_id=installation_id,
     )
 
 
@@ -153,29 +221,51 @@ def _instantiate_github_class(clazz: type[T], hook_installation_target_id: int,
     )
 
 
+def count_tasks(issue_job: IssueJob, total: int = 0, done: int = 0) -> None:
+    """
+    Add to the progress counters of the issue job, concurrently with other workers, unless it was created before
+    them, see `process_update_progress`
+    """
+    if issue_job.total_tasks is not None and issue_job.done_tasks is not None:
+        IssueJobService.increment(issue_job, total_tasks=total, done_tasks=done)
+
+
 def set_jobs_to_done(jobs: list[Job], issue_job: IssueJob) -> None:
     """Set the jobs to done."""
-    for job in jobs:
-        JobService.update(job, job_status=JobStatus.DONE)
+    done = sum(1 for job in jobs if job.job_status != JobStatus.DONE)
+    JobService.update_many(jobs, job_status=JobStatus.DONE)
+    count_tasks(issue_job, done=done)
     process_update_progress(issue_job)
 
 
+def set_issue_job_to_done(issue_job: IssueJob) -> None:
+    """Set the issue job to done, expiring it and its jobs after the FINISHED_JOBS_TTL_DAYS"""
+    expires_at = int(time.time()) + finished_jobs_ttl()
+    IssueJobService.update(issue_job, issue_job_status=IssueJobStatus.DONE, expires_at=expires_at)
+    JobService.update_many(JobService.filter(original_issue_url=issue_job.issue_url), expires_at=expires_at)
+
+
 def process_jobs(issue_url: str) -> Optional[IssueJobStatus]:
     """Process the jobs."""
-    if issue_job := next(iter(IssueJobService.filter(issue_url=issue_url)), None):
-        if issue_job.issue_job_status == IssueJobStatus.PENDING:
-            IssueJobService.update(issue_job, issue_job_status=IssueJobStatus.RUNNING)
-            # Update not updated jobs
-            process_update_issue_body(issue_job)
-            process_pending_jobs(issue_job)
-            process_update_issue_status(issue_job)
-            process_create_issue(issue_job)
-            process_update_issue_body(issue_job)
-            close_issue_if_all_checked(issue_job)
-            IssueJobService.update(issue_job, issue_job_status=IssueJobStatus.DONE)
-            process_update_progress(issue_job)
-            return IssueJobStatus.DONE
-        return issue_job.issue_job_status
+    # The jobs are loaded once and kept in memory between the steps and the changes to them are merged and
+    # written when committed and in the end
+    with BaseModelService.session(write_behind=True):
+        if issue_job := IssueJobService.get(issue_url=issue_url):
+            if issue_job.issue_job_status == IssueJobStatus.PENDING:
+                if not IssueJobService.compare_and_set(
+                    issue_job,
+                    {"issue_job_status": IssueJobStatus.PENDING},
+                    issue_job_status=IssueJobStatus.RUNNING,
+                ):
+                    # Another worker took the job
+                    return IssueJobStatus.RUNNING
+                job_pipeline_class()(issue_job).run()
+                close_issue_if_all_checked(issue_job)
+                set_issue_job_to_done(issue_job)
+                process_update_progress(issue_job)
+                logger.info("Capacity used processing %s: %s", issue_url, BaseModelService.capacity_usage())
+                return IssueJobStatus.DONE
+            return issue_job.issue_job_status
     return None
 
 
@@ -204,9 +294,142 @@ def _get_repository_url_and_title(issue_job: IssueJob, task: str) -> tuple[str,
     return repository_url, title
 
 
-def process_pending_jobs(issue_job: IssueJob) -> None:
-    """Process the pending jobs separating what is a job to create an issue from a job to update an issue"""
-    for job in JobService.filter(original_issue_url=issue_job.issue_url, job_status=JobStatus.PENDING):
+class JobPipeline:
+    """
+    Drives the jobs of an issue job through their states in one pass, in memory.
+
+    The jobs are loaded once and each one goes from its status to DONE (or ERROR), calling the GitHub action of each
+    state: PENDING jobs are classified, UPDATE_ISSUE_STATUS jobs open or close their issue (only if its state, read
+    for all of them in batches, is different), CREATE_ISSUE jobs create it (in batched mutations) and the
+    UPDATE_ISSUE_BODY jobs replace their task in the issue body, all in one edit in the end.
+    The GitHub calls of the jobs run concurrently in the pool of the installation (see `github_executor`), their
+    results are applied in the calling thread. The transitions are written in batches of `batch_size` jobs, the issue
+    creation right away.
+    """
+
+    def __init__(
+        self,
+        issue_job: IssueJob,
+        statuses: Optional[set[JobStatus]] = None,
+        batch_size: int = PIPELINE_BATCH_SIZE,
+    ) -> None:
+        self.issue_job = issue_job
+        # Only these states are advanced, all if None
+        self.statuses = statuses
+        self.batch_size = batch_size
+        # The transitions not written yet, merged by job
+        self.transitions: dict[str, tuple[Job, dict]] = {}
+        self.done = 0
+        self.update_issue_body_jobs: list[Job] = []
+        # The UPDATE_ISSUE_STATUS jobs waiting for the states of their issues, see `load_issue_states`
+        self.update_issue_status_jobs: list[Job] = []
+        # The CREATE_ISSUE jobs waiting for the creation of their issues, see `create_issues`
+        self.create_issue_jobs: list[Job] = []
+        # The GitHub calls running, with their job
+        self.running: dict[Future, Job] = {}
+        # The GitHub call of each state, run in the pool, and the function applying its result to the job
+        self.github_calls: dict[JobStatus, tuple[Callable[[Job], Any], Callable[[Job, Any], None]]] = {
+            JobStatus.UPDATE_ISSUE_STATUS: (self.update_issue_status, self.issue_status_updated),
+        }
+
+    def run(self) -> None:
+        """
+        Advance the jobs of the issue job and write the transitions.
+        If some GitHub call fails, the other ones are finished and written before raising the first error.
+        """
+        errors: list[BaseException] = []
+        self.prepare(errors)
+        while self.running:
+            finished, _ = wait(self.running, return_when=FIRST_COMPLETED)
+            self.finish_all(finished, errors)
+        self.end(errors)
+
+    def prepare(self, errors: list[BaseException]) -> None:
+        """Load and advance the jobs, reading the issue states and creating the issues, see `run`"""
+        for job in self.jobs():
+            self.advance(job)
+        self.load_issue_states()
+        self.create_issues(errors)
+
+    def jobs(self) -> Iterator[Job]:
+        """Load the jobs of the issue job, only with the status if there is only one"""
+        filters = {"original_issue_url": self.issue_job.issue_url}
+        if self.statuses and len(self.statuses) == 1:
+            filters["job_status"] = next(iter(self.statuses))
+        return JobService.filter(**filters)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """The thread pool of the GitHub calls of the installation, see `github_executor`"""
+        return github_executor(self.issue_job.installation_id)
+
+    def start(self, job: Job) -> None:
+        """Start the GitHub call of the job status"""
+        self.running[self.executor.submit(self.github_calls[job.job_status][0], job)] = job
+
+    def finish(self, future: Future | asyncio.Future, errors: list[BaseException]) -> None:
+        """Apply the result of a GitHub call to its job and advance it, collecting the error if it failed"""
+        job = self.running.pop(future)
+        if error := future.exception():
+            logger.error("Couldn't process the task %s of %s: %s", job.task, self.issue_job.issue_url, error)
+            errors.append(error)
+            return
+        self.github_calls[job.job_status][1](job, future.result())
+        self.advance(job)
+
+    def finish_all(self, finished: Iterable[Future | asyncio.Future], errors: list[BaseException]) -> None:
+        """Finish the GitHub calls finished, see `finish`"""
+        for future in finished:
+            self.finish(future, errors)
+
+    def end(self, errors: list[BaseException]) -> None:
+        """Write the transitions left and update the issue body, raising the first error of the GitHub calls"""
+        self.write()
+        if errors:
+            raise errors[0]
+        if self.update_issue_body_jobs:
+            self.update_issue_body()
+
+    def advance(self, job: Job) -> None:
+        """
+        Take the job through its states, until DONE, ERROR, waiting for the issue body update or for a GitHub call,
+        see `run`
+        """
+        while self.statuses is None or job.job_status in self.statuses:
+            if job.job_status == JobStatus.UPDATE_ISSUE_BODY:
+                self.update_issue_body_jobs.append(job)
+                return
+            if job.job_status == JobStatus.UPDATE_ISSUE_STATUS:
+                self.update_issue_status_jobs.append(job)
+                return
+            if job.job_status == JobStatus.CREATE_ISSUE:
+                self.create_issue_jobs.append(job)
+                return
+            if job.job_status != JobStatus.PENDING:
+                return
+            self.classify(job)
+
+    def transition(self, job: Job, **kwargs) -> None:
+        """Change the job in memory, writing the transitions when the batch is full"""
+        if kwargs.get("job_status") == JobStatus.DONE and job.job_status != JobStatus.DONE:
+            self.done += 1
+        for attr_name, attr_value in kwargs.items():
+            setattr(job, attr_name, attr_value)
+        self.transitions.setdefault(job.task, (job, {}))[1].update(kwargs)
+        if len(self.transitions) >= self.batch_size:
+            self.write()
+
+    def write(self) -> None:
+        """Write the transitions not written yet, with the progress"""
+        if self.transitions:
+            JobService.bulk_update(list(self.transitions.values()))
+            count_tasks(self.issue_job, done=self.done)
+            self.transitions = {}
+            self.done = 0
+            BaseModelService.commit()
+
+    def classify(self, job: Job) -> None:
+        """Separate what is a job to create an issue from a job to update an issue"""
         task = job.task
         if job.issue_ref or is_issue_ref(task):
             issue_ref = job.issue_ref or task
@@ -214,103 +437,218 @@ def process_pending_jobs(issue_job: IssueJob) -> None:
             if repository:
                 repository_url = _repository_url(repository)
             else:
-                repository_url = issue_job.repository_url
+                repository_url = self.issue_job.repository_url
             issue_url = f"{repository_url}/issues/{issue_number}"
-            JobService.update(
-                job,
-                job_status=JobStatus.UPDATE_ISSUE_STATUS,
-                issue_url=issue_url,
-            )
+            self.transition(job, job_status=JobStatus.UPDATE_ISSUE_STATUS, issue_url=issue_url)
         else:
-            repository_url, title = _get_repository_url_and_title(issue_job, task)
-
-            JobService.update(
-                job,
-                job_status=JobStatus.CREATE_ISSUE,
-                repository_url=repository_url,
-                title=title,
-            )
-
+            repository_url, title = _get_repository_url_and_title(self.issue_job, task)
+            self.transition(job, job_status=JobStatus.CREATE_ISSUE, repository_url=repository_url, title=title)
+
+    def load_issue_states(self) -> None:
+        """
+        Read the states of the issues of the UPDATE_ISSUE_STATUS jobs, in batches, and start the update of the issues
+        whose state doesn't follow the checkbox. The other jobs are DONE, or ERROR if the issue doesn't exist.
+        """
+        jobs, self.update_issue_status_jobs = self.update_issue_status_jobs, []
+        if not jobs:
+            return
+        issue_states = {}
+        if Config.issue_manager.handle_checkbox:
+            requester = _get_requester(self.issue_job.hook_installation_target_id, self.issue_job.installation_id)
+            issue_states = get_issue_states(requester, [job.issue_url for job in jobs])
+        for job in jobs:
+            if not Config.issue_manager.handle_checkbox:
+                self.transition(job, job_status=JobStatus.DONE)
+            elif not (issue_state := issue_states.get(job.issue_url)):
+                logger.warning("Issue %s not found", job.issue_url)
+                self.transition(job, job_status=JobStatus.ERROR)
+            elif issue_state["state"] == _checkbox_state(job.checked):
+                self.transition(job, job_status=JobStatus.DONE)
+            else:
+                self.start(job)
 
-def process_update_issue_status(issue_job: IssueJob) -> None:
-    """Process the update issue status jobs."""
-    for job in JobService.filter(original_issue_url=issue_job.issue_url, job_status=JobStatus.UPDATE_ISSUE_STATUS):
+    def update_issue_status(self, job: Job) -> JobStatus:
+        """Open or close the issue of the job, following the checkbox, returning the new status of the job"""
         issue = _instantiate_github_class(
             Issue,
-            issue_job.hook_installation_target_id,
-            issue_job.installation_id,
+            self.issue_job.hook_installation_target_id,
+            self.issue_job.installation_id,
             job.issue_url,
         )
         try:
-            _handle_checkbox(issue, job.checked)
-            JobService.update(
-                job,
-                job_status=JobStatus.DONE,
+            issue.edit(state=_checkbox_state(job.checked))
+            return JobStatus.DONE
+        except UnknownObjectException:
+            logger.warning("Issue %s not found", job.issue_url)
+            return JobStatus.ERROR
+
+    def issue_status_updated(self, job: Job, job_status: JobStatus) -> None:
+        """Apply the result of `update_issue_status`"""
+        self.transition(job, job_status=job_status)
+
+    def create_issues(self, errors: list[BaseException]) -> None:
+        """
+        Create the issues of the CREATE_ISSUE jobs, if enabled, resolving their repositories once and creating
+        GRAPHQL_MAX_MUTATIONS issues in each mutation. The jobs of the issues created go to UPDATE_ISSUE_BODY, written
+        after each mutation to not create the issues again if the process is interrupted, the other ones to ERROR.
+        If a whole mutation fails, the jobs of the issues created anyway go to UPDATE_ISSUE_BODY, the other ones stay
+        in CREATE_ISSUE, to be created again, and the error is added to `errors`.
+        """
+        jobs, self.create_issue_jobs = self.create_issue_jobs, []
+        if not jobs:
+            return
+        if not Config.issue_manager.create_issues_from_tasklist:
+            for job in jobs:
+                self.transition(job, job_status=JobStatus.DONE)
+            return
+        requester = _get_requester(self.issue_job.hook_installation_target_id, self.issue_job.installation_id)
+        try:
+            repository_ids = get_repository_ids(requester, [job.repository_url for job in jobs])
+        except GithubException as error:
+            errors.append(error)
+            return
+        creatable_jobs = []
+        for job in jobs:
+            if job.repository_url in repository_ids:
+                creatable_jobs.append(job)
+            else:
+                logger.warning("Repository %s not found", job.repository_url)
+                self.transition(job, job_status=JobStatus.ERROR)
+        for start in range(0, len(creatable_jobs), graphql_helper.GRAPHQL_MAX_MUTATIONS):
+            chunk = creatable_jobs[start : start + graphql_helper.GRAPHQL_MAX_MUTATIONS]
+            issue_refs, error = create_issues(
+                requester, [(repository_ids[job.repository_url], job.title) for job in chunk]
             )
+            for job, issue_ref in zip(chunk, issue_refs):
+                if issue_ref:
+                    self.transition(job, job_status=JobStatus.UPDATE_ISSUE_BODY, issue_ref=issue_ref)
+                elif error is None:
+                    logger.warning("Couldn't create the issue of the task %s of %s", job.task, self.issue_job.issue_url)
+                    self.transition(job, job_status=JobStatus.ERROR)
+            self.write()
+            for job in chunk:
+                self.advance(job)
+            if error:
+                errors.append(error)
+                return
+
+    def update_issue_body(self) -> None:
+        """Replace the tasks of the jobs with their issues in the issue body, in one edit, if it changes"""
+        issue = _instantiate_github_class(
+            Issue,
+            self.issue_job.hook_installation_target_id,
+            self.issue_job.installation_id,
+            self.issue_job.issue_url,
+        )
+        body = issue_helper.replace_tasks(
+            issue.body, {job.task: job.issue_ref for job in self.update_issue_body_jobs if job.issue_ref}
+        )
+        if body != issue.body:
+            issue.edit(body=body)
+        set_jobs_to_done(self.update_issue_body_jobs, self.issue_job)
+        self.update_issue_body_jobs = []
+
+
+class AsyncJobPipeline(JobPipeline):
+    """
+    JobPipeline making the GitHub calls of the jobs concurrently in one event loop, with `AsyncGithubClient`,
+    limited by installation (GITHUB_MAX_WORKERS) and by repository.
+    The batched GraphQL requests, the issue body update and the progress are made with PyGithub, as in JobPipeline,
+    and these calls and the table writes run in a thread (`asyncio.to_thread`), not blocking the calls in the loop.
+    The calls started from the thread are queued and started in the loop, see `start_queued`.
+    """
+
+    def __init__(
+        self,
+        issue_job: IssueJob,
+        statuses: Optional[set[JobStatus]] = None,
+        batch_size: int = PIPELINE_BATCH_SIZE,
+    ) -> None:
+        super().__init__(issue_job, statuses, batch_size)
+        self.client: Optional[AsyncGithubClient] = None
+        # The Authorization header of the installation, set when running
+        self.authorization = ""
+        # The jobs whose GitHub call must be started in the event loop
+        self.queued: list[Job] = []
+        self.github_calls = {
+            JobStatus.UPDATE_ISSUE_STATUS: (self.update_issue_status_async, self.issue_status_updated),
+        }
+
+    def run(self) -> None:
+        """Advance the jobs of the issue job in an event loop, see `JobPipeline.run`"""
+        asyncio.run(self.run_async())
+
+    async def run_async(self) -> None:
+        """Advance the jobs of the issue job and write the transitions, see `JobPipeline.run`"""
+        self.authorization = await asyncio.to_thread(self.installation_authorization)
+        errors: list[BaseException] = []
+        async with AsyncGithubClient(github_max_workers()) as self.client:
+            await asyncio.to_thread(self.prepare, errors)
+            self.start_queued()
+            while self.running:
+                finished, _ = await asyncio.wait(self.running, return_when=asyncio.FIRST_COMPLETED)
+                await asyncio.to_thread(self.finish_all, finished, errors)
+                self.start_queued()
+        await asyncio.to_thread(self.end, errors)
+
+    def installation_authorization(self) -> str:
+        """Returns the Authorization header of the installation, getting its token if needed"""
+        auth = _cached_get_auth(self.issue_job.hook_installation_target_id, self.issue_job.installation_id)
+        return f"{auth.token_type} {auth.token}"
+
+    def start(self, job: Job) -> None:
+        """Queue the GitHub call of the job status, it may be called in a thread, see `start_queued`"""
+        self.queued.append(job)
+
+    def start_queued(self) -> None:
+        """Start the GitHub calls queued in the event loop"""
+        jobs, self.queued = self.queued, []
+        for job in jobs:
+            self.running[asyncio.ensure_future(self.github_calls[job.job_status][0](job))] = job
+
+    async def update_issue_status_async(self, job: Job) -> JobStatus:
+        """Open or close the issue of the job, following the checkbox, returning the new status of the job"""
+        try:
+            await self.client.edit_issue(
+                self.issue_job.installation_id, self.authorization, job.issue_url, state=_checkbox_state(job.checked)
+            )
+            return JobStatus.DONE
         except UnknownObjectException:
-            logger.warning("Issue %s not found", issue.url)
-            JobService.update(job, job_status=JobStatus.ERROR)
+            logger.warning("Issue %s not found", job.issue_url)
+            return JobStatus.ERROR
+
+
+def job_pipeline_class() -> type[JobPipeline]:
+    """Returns the pipeline of the GitHub engine, see `github_engine`"""
+    return AsyncJobPipeline if github_engine() == "async" else JobPipeline
+
+
+def process_pending_jobs(issue_job: IssueJob) -> None:
+    """Process the pending jobs separating what is a job to create an issue from a job to update an issue"""
+    JobPipeline(issue_job, {JobStatus.PENDING}).run()
+
+
+def process_update_issue_status(issue_job: IssueJob) -> None:
+    """Process the update issue status jobs."""
+    JobPipeline(issue_job, {JobStatus.UPDATE_ISSUE_STATUS}).run()
 
 
-@Config.call_if("issue_manager.handle_checkbox")
-def _handle_checkbox(issue: Issue, checked: bool) -> None:
+def _checkbox_state(checked: bool) -> str:
     """
-    Handle the state of the issue.
-    If the issue is closed and the checkbox is checked, open the issue.
-    If the issue is open and the checkbox is unchecked, close the issue.
+    Returns the state the issue of a task must have.
+    If the checkbox is checked, the issue is closed, otherwise it's open.
     """
-    handle_issue_state(checked, issue)
+    return "closed" if checked else "open"
 
 
 def process_create_issue(issue_job: IssueJob) -> None:
     """Process the create_issue status jobs."""
-    for job in JobService.filter(original_issue_url=issue_job.issue_url, job_status=JobStatus.CREATE_ISSUE):
-        if created_issue := _create_issue(issue_job, job):
-            JobService.update(
-                job,
-                job_status=JobStatus.UPDATE_ISSUE_BODY,
-                issue_ref=get_issue_ref(created_issue),
-            )
-        else:
-            JobService.update(
-                job,
-                job_status=JobStatus.DONE,
-            )
-
-
-@Config.call_if("issue_manager.create_issues_from_tasklist")
-def _create_issue(issue_job: IssueJob, job: Job) -> Issue:
-    """Create a new issue."""
-    repository = _instantiate_github_class(
-        Repository,
-        issue_job.hook_installation_target_id,
-        issue_job.installation_id,
-        job.repository_url,
-    )
-    created_issue = repository.create_issue(title=job.title)
-    return created_issue
+    JobPipeline(issue_job, {JobStatus.CREATE_ISSUE}).run()
 
 
 def process_update_issue_body(issue_job: IssueJob) -> None:
     """Process the update issue body jobs."""
-    issue = _instantiate_github_class(
-        Issue,
-        issue_job.hook_installation_target_id,
-        issue_job.installation_id,
-        issue_job.issue_url,
-    )
-    body = issue.body
-    update_issue_body_jobs = JobService.filter(
-        original_issue_url=issue_job.issue_url, job_status=JobStatus.UPDATE_ISSUE_BODY
-    )
-    for job in update_issue_body_jobs:
-        body = re.sub(
-            r"(\[[ x]]) " + job.task + r"(?=\s|$)",
-            f"\\1 {job.issue_ref}",
-            body,
-        )
-    issue.edit(body=body)
-    set_jobs_to_done(update_issue_body_jobs, issue_job)
+    JobPipeline(issue_job, {JobStatus.UPDATE_ISSUE_BODY}).run()
 
 
 @Config.call_if("issue_manager.close_parent")
@@ -334,8 +672,14 @@ def process_update_progress(issue_job: IssueJob) -> None:
     if issue_job.issue_job_status == IssueJobStatus.DONE:
         comment = "Job's done"
     else:
-        done = len(JobService.filter(original_issue_url=issue_job.issue_url, job_status=JobStatus.DONE))
-        total = len(JobService.filter(original_issue_url=issue_job.issue_url))
+        if issue_job.total_tasks is None or issue_job.done_tasks is None:
+            # Issue jobs created before the progress counters, counted once
+            IssueJobService.update(
+                issue_job,
+                total_tasks=JobService.count(original_issue_url=issue_job.issue_url),
+                done_tasks=JobService.count(original_issue_url=issue_job.issue_url, job_status=JobStatus.DONE),
+            )
+        done, total = issue_job.done_tasks, issue_job.total_tasks
         comment = f"Analyzing the tasklist [{done}/{total}]\n{markdown_progress(done, total)}"
     issue = _instantiate_github_class(
         Issue,
@@ -356,6 +700,7 @@ def close_sub_tasks(event: IssuesEvent) -> None:
     repository = event.repository
     issue = event.issue
     issue_body = issue.body
+    issue_urls = []
     for task, _ in issue_helper.get_tasklist(issue_body):
         if is_issue_ref(task):
             issue_repository, issue_number = task.split("#")
@@ -363,15 +708,72 @@ def close_sub_tasks(event: IssuesEvent) -> None:
                 repository_url = _repository_url(issue_repository)
             else:
                 repository_url = repository.url
-            issue_url = f"{repository_url}/issues/{issue_number}"
-            task_issue = _instantiate_github_class(
-                Issue,
-                event.hook_installation_target_id,
-                event.installation_id,
-                issue_url,
+            issue_urls.append(f"{repository_url}/issues/{issue_number}")
+
+    # The states of all the issues are read in batches, only the issues not closed are edited
+    issue_states = get_issue_states(
+        _get_requester(event.hook_installation_target_id, event.installation_id), issue_urls
+    )
+    task_issues = []
+    for issue_url in issue_urls:
+        if not (issue_state := issue_states.get(issue_url)):
+            logger.warning("Issue %s not found", issue_url)
+        elif issue_state["state"] != "closed":
+            task_issues.append(
+                _instantiate_github_class(
+                    Issue,
+                    event.hook_installation_target_id,
+                    event.installation_id,
+                    issue_url,
+                )
             )
-            try:
-                if task_issue.state != "closed":
-                    task_issue.edit(state="closed", state_reason=issue.state_reason)
-            except UnknownObjectException:
-                logger.warning("Issue %s not found", issue.url)
+
+    def close_task_issue(task_issue: Issue) -> None:
+        try:
+            task_issue.edit(state="closed", state_reason=issue.state_reason)
+        except UnknownObjectException:
+            logger.warning("Issue %s not found", task_issue.url)
+
+    # The issues are closed concurrently, raising the first error, if any, after all of them
+    futures = [
+        github_executor(event.installation_id).submit(close_task_issue, task_issue) for task_issue in task_issues
+    ]
+    wait(futures)
+    for future in futures:
+        future.result()
+
+
+def archive_finished_jobs(output_dir: str, older_than_days: float = 0) -> tuple[int, int]:
+    """
+    Move the IssueJobs done at least `older_than_days` ago, with their Jobs, from the tables to gzipped JSON lines
+    files in the output dir, one for each table. Returns how many IssueJobs and Jobs were archived.
+    """
+    finished_before = time.time() - older_than_days * 24 * 60 * 60
+    expires_before = finished_before + finished_jobs_ttl()
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    issue_jobs_path = output_path / f"{IssueJobService.table_name}-{timestamp}.jsonl.gz"
+    jobs_path = output_path / f"{JobService.table_name}-{timestamp}.jsonl.gz"
+    archived_jobs = 0
+    with gzip.open(issue_jobs_path, "wt") as issue_jobs_file, gzip.open(jobs_path, "wt") as jobs_file:
+        finished_issue_jobs = (
+            issue_job
+            for issue_job in IssueJobService.iter_filter(issue_job_status=IssueJobStatus.DONE)
+            if issue_job.expires_at and issue_job.expires_at <= expires_before
+        )
+
+        def with_jobs_archived(issue_jobs: Iterable[IssueJob]) -> Iterator[IssueJob]:
+            # The jobs are archived before the issue job, so an interrupted archival can be run again
+            nonlocal archived_jobs
+            for issue_job in issue_jobs:
+                archived_jobs += JobService.archive(
+                    JobService.iter_filter(original_issue_url=issue_job.issue_url), jobs_file
+                )
+                yield issue_job
+
+        archived_issue_jobs = IssueJobService.archive(with_jobs_archived(finished_issue_jobs), issue_jobs_file)
+    logger.info(
+        "Archived %d issue jobs in %s and %d jobs in %s", archived_issue_jobs, issue_jobs_path, archived_jobs, jobs_path
+    )
+    return archived_issue_jobs, archived_jobs
@@ -1,6 +1,7 @@
 """IssueJob model"""
 
 from enum import Enum
+from typing import Any, Optional
 
 from src.helpers.db_helper import BaseModel
 
@@ -18,6 +19,9 @@ class IssueJob(BaseModel):
     """IssueJob model"""
 
     key_schema = ["issue_url"]
+    secondary_indexes = [["issue_job_status", "created_at"]]
+    # Set when the job is done, cleared if the issue is edited again
+    ttl_attribute = "expires_at"
     issue_url: str
     repository_url: str
     title: str
@@ -25,3 +29,11 @@ class IssueJob(BaseModel):
     issue_comment_id: int
     hook_installation_target_id: int
     installation_id: int
+    expires_at: Optional[int] = None
+    # Progress of the jobs, incremented when they are added and done. None in the IssueJobs created before them
+    total_tasks: Optional[int] = None
+    done_tasks: Optional[int] = None
+    # The Jobs of the issue by task, when stored in the IssueJob instead of Job rows, see JobService
+    tasks: Optional[dict[str, dict[str, Any]]] = None
+    # The same, as compressed JSON
+    compressed_tasks: Optional[str] = None
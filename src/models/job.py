@@ -20,7 +20,12 @@ class JobStatus(Enum):
 class Job(BaseModel):
     """Job model"""
 
-    key_schema = ["task", "original_issue_url"]
+    key_schema = ["original_issue_url", "task"]
+    # The previous table ("job") was partitioned by task, migrated with `flask migrate-jobs-table`
+    table_name = "job_v2"
+    secondary_indexes = [["original_issue_url", "job_status"]]
+    # Expires with the IssueJob
+    ttl_attribute = "expires_at"
     task: str
     original_issue_url: str
     checked: bool
@@ -30,3 +35,4 @@ class Job(BaseModel):
     milestone: Optional[str] = None
     issue_ref: Optional[str] = None
     issue_url: Optional[str] = None
+    expires_at: Optional[int] = None
@@ -1,12 +1,349 @@
 """DB services for the models"""
 
-from src.helpers.db_helper import BaseModelService
+import base64
+import json
+import logging
+import threading
+import zlib
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+from botocore.exceptions import ClientError
+from cachetools import TTLCache
+
+from config import after_fork, setting
+from src.helpers.db_helper import BaseModelService, to_dynamo_value
+from src.helpers.storage_helper import remove_path, set_path
 from src.models import IssueJob, Job
 
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+# Attempts to write a compressed document changed concurrently
+COMPRESSED_DOCUMENT_MAX_ATTEMPTS = 5
+# Seconds an IssueJob with its Jobs in rows is remembered, see `JobService.document`. The Jobs of an IssueJob only move
+# from the document to rows, never back, while the IssueJob exists
+ROWS_STORAGE_TTL = 3600
+ROWS_STORAGE_MAX_SIZE = 10000
+# Job attributes not stored in the document: the key and the ones taken from the IssueJob
+DOCUMENT_OMITTED_ATTRIBUTES = {"original_issue_url", "task", "created_at", "version"}
+# Job attributes not stored in the document when they have the default value
+DOCUMENT_DEFAULTS = {
+    attr_name: to_dynamo_value(field_info.default)
+    for attr_name, field_info in Job.model_fields.items()
+    if not field_info.is_required() and field_info.default_factory is None and field_info.default is not None
+}
+
+
+# The issue urls of the IssueJobs with their Jobs in rows, so their Jobs are used without reading the IssueJob again
+_rows_storage: TTLCache = TTLCache(maxsize=ROWS_STORAGE_MAX_SIZE, ttl=ROWS_STORAGE_TTL)
+_rows_storage_lock = threading.Lock()
+
+
+def tasks_storage() -> str:
+    """Returns how the Jobs of the new IssueJobs are stored, set in the TASKS_STORAGE environment variable"""
+    return setting("TASKS_STORAGE")
+
+
+def document_max_tasks() -> int:
+    """Returns the max tasks in a document, set in the TASKS_DOCUMENT_MAX_TASKS environment variable"""
+    return setting("TASKS_DOCUMENT_MAX_TASKS")
+
+
+def encode_tasks(tasks: dict[str, dict[str, Any]]) -> str:
+    """Returns the document compressed, as the base64 of the zlib compressed JSON"""
+    return base64.b64encode(zlib.compress(json.dumps(tasks, separators=(",", ":")).encode())).decode()
+
+
+def decode_tasks(compressed_tasks: str) -> dict[str, dict[str, Any]]:
+    """Returns the document of the compressed one"""
+    return json.loads(zlib.decompress(base64.b64decode(compressed_tasks)))
+
+
+def remember_rows_storage(issue_url: str, rows: bool = True) -> None:
+    """Remember the IssueJob as keeping its Jobs in rows, or forget it"""
+    with _rows_storage_lock:
+        if rows:
+            _rows_storage[issue_url] = True
+        else:
+            _rows_storage.pop(issue_url, None)
+
+
+def has_rows_storage(issue_url: str) -> bool:
+    """Returns if the IssueJob is remembered as keeping its Jobs in rows"""
+    with _rows_storage_lock:
+        return issue_url in _rows_storage
+
+
+@after_fork
+def _reset_after_fork() -> None:
+    """The forked process keeps the IssueJobs remembered, with a new lock, it may have been held by another thread"""
+    global _rows_storage_lock  # pylint: disable=global-statement
+    _rows_storage_lock = threading.Lock()
+
 
 class IssueJobService(BaseModelService[IssueJob]):
     """DB Service for IssueJob model"""
 
+    @classmethod
+    def insert_one(cls, item: IssueJob) -> IssueJob:
+        """Insert one IssueJob in the table, forgetting the storage of the Jobs of a previous one of the issue"""
+        remember_rows_storage(item.issue_url, rows=False)
+        return super().insert_one(item)
+
 
 class JobService(BaseModelService[Job]):
-    """DB Service for Job model"""
+    """
+    DB Service for Job model
+
+    The Jobs of an IssueJob created with the document storage (see `tasks_storage`) are not Job rows, they are kept in
+    the IssueJob, in a map by task (the document): the jobs of the issue are read with the IssueJob, and each change is
+    a nested update of the map. The filters by `original_issue_url` and the writes find the jobs in the document, the
+    filters without it only see the rows.
+    """
+
+    @staticmethod
+    def new_document() -> dict[str, Any]:
+        """Returns the attributes of a new IssueJob to store its Jobs as set in TASKS_STORAGE"""
+        storage = tasks_storage()
+        if storage == "document":
+            return {"tasks": {}}
+        if storage == "compressed":
+            return {"compressed_tasks": encode_tasks({})}
+        return {}
+
+    @staticmethod
+    def document(original_issue_url: str) -> Optional[IssueJob]:
+        """
+        Returns the IssueJob of the issue if it keeps the Jobs in the document, None if they are Job rows.
+        With the rows storage, the IssueJob is not read, the documents must be done before changing to it. The
+        IssueJobs with Job rows are remembered, not read again, see `remember_rows_storage`.
+        """
+        if tasks_storage() == "rows" or has_rows_storage(original_issue_url):
+            return None
+        issue_job = IssueJobService.get(issue_url=original_issue_url)
+        if issue_job and (issue_job.tasks is not None or issue_job.compressed_tasks is not None):
+            return issue_job
+        if issue_job:
+            remember_rows_storage(original_issue_url)
+        return None
+
+    @staticmethod
+    def read_document(issue_job: IssueJob) -> dict[str, dict[str, Any]]:
+        """Returns the document of the IssueJob, the attributes of each Job by task"""
+        if issue_job.tasks is not None:
+            return issue_job.tasks
+        return decode_tasks(issue_job.compressed_tasks)
+
+    @classmethod
+    def document_jobs(cls, issue_job: IssueJob) -> list[Job]:
+        """Returns the Jobs in the document of the IssueJob, sorted by task like the rows"""
+        return [
+            cls.codec.from_item(
+                {**entry, "task": task, "original_issue_url": issue_job.issue_url, "created_at": issue_job.created_at}
+            )
+            for task, entry in sorted(cls.read_document(issue_job).items())
+        ]
+
+    @classmethod
+    def document_entry(cls, job: Job) -> dict[str, Any]:
+        """Returns the attributes of the Job kept in the document, without the key, the empty ones and the defaults"""
+        return {
+            attr_name: value
+            for attr_name, value in job.dynamo_dict().items()
+            if attr_name not in DOCUMENT_OMITTED_ATTRIBUTES
+            and value is not None
+            and value != DOCUMENT_DEFAULTS.get(attr_name)
+        }
+
+    @classmethod
+    def split_by_document(
+        cls, values: Iterable[T], original_issue_url: Callable[[T], str]
+    ) -> tuple[list[tuple[IssueJob, list[T]]], list[T]]:
+        """Returns the values of the jobs in documents, grouped by IssueJob, and the values of the Job rows"""
+        documents = {}
+        by_url = {}
+        rows = []
+        for value in values:
+            url = original_issue_url(value)
+            if url not in documents:
+                documents[url] = cls.document(url)
+            if documents[url]:
+                by_url.setdefault(url, []).append(value)
+            else:
+                rows.append(value)
+        return [(documents[url], url_values) for url, url_values in by_url.items()], rows
+
+    @staticmethod
+    def matches(job: Job, **kwargs) -> bool:
+        """Returns if the job has the attributes with the values"""
+        return all(to_dynamo_value(getattr(job, k, None)) == to_dynamo_value(v) for k, v in kwargs.items())
+
+    @classmethod
+    def write_document(
+        cls,
+        issue_job: IssueJob,
+        set_paths: dict[tuple[str, ...], Any],
+        remove_paths: Iterable[tuple[str, ...]] = (),
+    ) -> None:
+        """
+        Set and remove paths (the task, optionally followed by the attribute name) of the document of the IssueJob.
+
+        The map is changed by nested updates, see `update_paths`. The compressed document is written entirely, only if
+        it wasn't changed concurrently, otherwise it is read again and the changes applied again.
+        """
+        remove_paths = list(remove_paths)
+        if issue_job.tasks is not None:
+            IssueJobService.update_paths(
+                issue_job,
+                {("tasks", *path): value for path, value in set_paths.items()},
+                [("tasks", *path) for path in remove_paths],
+            )
+            return
+        for attempt in range(1, COMPRESSED_DOCUMENT_MAX_ATTEMPTS + 1):
+            tasks = decode_tasks(issue_job.compressed_tasks)
+            for path, value in set_paths.items():
+                set_path(tasks, list(path), value)
+            for path in remove_paths:
+                remove_path(tasks, list(path))
+            try:
+                IssueJobService.update_paths(
+                    issue_job,
+                    {("compressed_tasks",): encode_tasks(tasks)},
+                    condition={"compressed_tasks": issue_job.compressed_tasks},
+                )
+                return
+            except ClientError as err:
+                if err.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                # Read again, skipping the session
+                current = next(IssueJobService.iter_table(issue_url=issue_job.issue_url), None)
+                if attempt == COMPRESSED_DOCUMENT_MAX_ATTEMPTS or not current or current.compressed_tasks is None:
+                    raise
+                logger.info("The tasks of %s changed concurrently, writing again", issue_job.issue_url)
+                issue_job.compressed_tasks = current.compressed_tasks
+
+    @classmethod
+    def update_document(cls, issue_job: IssueJob, updates: list[tuple[Job, dict[str, Any]]]) -> None:
+        """Update the Jobs in the document of the IssueJob with their kwargs, removing the empty and default values"""
+        set_paths = {}
+        remove_paths = {}
+        for job, kwargs in updates:
+            for attr_name, attr_value in kwargs.items():
+                path = (job.task, attr_name)
+                value = to_dynamo_value(attr_value)
+                if value is None or value == DOCUMENT_DEFAULTS.get(attr_name):
+                    set_paths.pop(path, None)
+                    remove_paths[path] = None
+                else:
+                    remove_paths.pop(path, None)
+                    set_paths[path] = value
+        cls.write_document(issue_job, set_paths, remove_paths)
+        for job, kwargs in updates:
+            for attr_name, attr_value in kwargs.items():
+                setattr(job, attr_name, attr_value)
+
+    @classmethod
+    def insert_document(cls, issue_job: IssueJob, jobs: list[Job]) -> None:
+        """
+        Insert the Jobs in the document of the IssueJob, or, if the document would have more than
+        TASKS_DOCUMENT_MAX_TASKS, move all its Jobs to Job rows
+        """
+        tasks = cls.read_document(issue_job)
+        if len(tasks.keys() | {job.task for job in jobs}) <= document_max_tasks():
+            cls.write_document(issue_job, {(job.task,): cls.document_entry(job) for job in jobs})
+            return
+        rows = {job.task: job for job in cls.document_jobs(issue_job)}
+        rows.update({job.task: job for job in jobs})
+        logger.info("Moving the %d tasks of %s to Job rows", len(rows), issue_job.issue_url)
+        # The rows are written before the document is removed, even in a session
+        cls.put_items(list(rows.values()))
+        for job in rows.values():
+            cls.write_through(job)
+        IssueJobService.update_paths(issue_job, {}, [("tasks",), ("compressed_tasks",)])
+        remember_rows_storage(issue_job.issue_url)
+
+    @classmethod
+    def get(cls, **kwargs) -> Optional[Job]:
+        """Return the Job with the given primary key or None if it doesn't exist, from the document if any"""
+        cls.get_key(**kwargs)
+        if issue_job := cls.document(kwargs["original_issue_url"]):
+            return next((job for job in cls.document_jobs(issue_job) if job.task == kwargs["task"]), None)
+        return super().get(**kwargs)
+
+    @classmethod
+    def iter_filter(
+        cls,
+        limit: Optional[int] = None,
+        page_size: Optional[int] = None,
+        fields: Optional[list[str]] = None,
+        **kwargs,
+    ) -> Iterator[Job]:
+        """Yield the Jobs matching the filter, from the document if the filter has its `original_issue_url`"""
+        if "original_issue_url" not in kwargs or not (issue_job := cls.document(kwargs["original_issue_url"])):
+            yield from super().iter_filter(limit=limit, page_size=page_size, fields=fields, **kwargs)
+            return
+        if limit is not None and limit <= 0:
+            return
+        matching = islice((job for job in cls.document_jobs(issue_job) if cls.matches(job, **kwargs)), limit)
+        if fields:
+            yield from (cls.project(job, fields) for job in matching)
+        else:
+            yield from matching
+
+    @classmethod
+    def count(cls, **kwargs) -> int:
+        """Return how many Jobs match the filter, counting the document if the filter has its `original_issue_url`"""
+        if "original_issue_url" in kwargs and (issue_job := cls.document(kwargs["original_issue_url"])):
+            return sum(1 for job in cls.document_jobs(issue_job) if cls.matches(job, **kwargs))
+        return super().count(**kwargs)
+
+    @classmethod
+    def insert_one(cls, item: Job) -> Job:
+        """Insert one Job in the table, or in the document of its IssueJob"""
+        if issue_job := cls.document(item.original_issue_url):
+            cls.insert_document(issue_job, [item])
+            return item
+        return super().insert_one(item)
+
+    @classmethod
+    def insert_many(cls, items: list[Job]) -> None:
+        """Insert the Jobs in the table, or in the documents of their IssueJobs"""
+        documents, rows = cls.split_by_document(items, lambda job: job.original_issue_url)
+        for issue_job, jobs in documents:
+            cls.insert_document(issue_job, jobs)
+        super().insert_many(rows)
+
+    @classmethod
+    def update(cls, item: Job, condition: Optional[dict[str, Any]] = None, **kwargs) -> None:
+        """
+        Update a Job in the table, or in the document of its IssueJob, where it can't have a condition and the version
+        is not incremented
+        """
+        if issue_job := cls.document(item.original_issue_url):
+            if condition:
+                raise ValueError("The jobs in a document can't be updated with a condition")
+            cls.update_document(issue_job, [(item, kwargs)])
+            return
+        super().update(item, condition=condition, **kwargs)
+
+    @classmethod
+    def bulk_update(cls, updates: Iterable[tuple[Job, dict[str, Any]]], atomic: bool = False) -> None:
+        """
+        Update each Job with its kwargs, the ones in a document with one request for each IssueJob (each
+        UPDATE_MAX_PATHS changes). The Jobs in a document can't be updated `atomic`, raising ValueError
+        """
+        documents, rows = cls.split_by_document(updates, lambda update: update[0].original_issue_url)
+        if atomic and documents:
+            raise ValueError("The jobs in a document can't be updated atomically")
+        for issue_job, document_updates in documents:
+            cls.update_document(issue_job, document_updates)
+        super().bulk_update(rows, atomic=atomic)
+
+    @classmethod
+    def delete_many(cls, items: Iterable[Job]) -> None:
+        """Delete the Jobs from the table, or from the documents of their IssueJobs"""
+        documents, rows = cls.split_by_document(items, lambda job: job.original_issue_url)
+        for issue_job, jobs in documents:
+            cls.write_document(issue_job, {}, [(job.task,) for job in jobs])
+        super().delete_many(rows)
@@ -4,10 +4,13 @@ from typing import Any
 from unittest.mock import MagicMock, Mock, patch
 
 import pytest
+from botocore.exceptions import ClientError
 from github.Repository import Repository
 
 from config import default_configs
+from src import services
 from src.helpers.db_helper import BaseModelService
+from src.helpers.storage_helper import apply_update, evaluate_condition, project
 from src.models import IssueJob, IssueJobStatus
 
 default_configs()
@@ -66,6 +69,12 @@ def issue_job():
     )
 
 
+@pytest.fixture(autouse=True)
+def rows_storage():
+    yield
+    services._rows_storage.clear()
+
+
 @pytest.fixture(autouse=True)
 def fixed_datetime_now():
     with patch("src.helpers.db_helper.datetime") as mock:
@@ -80,35 +89,140 @@ def base_model_service_stub():
             super().__init__(*args, **kw)
             self.table_name = args[0]
             self.creation_date_time = 385959600.0
+            self.global_secondary_indexes = []
+            self.key_schema = None
             self.items = []
 
-        def scan(self, *args, ExpressionAttributeValues=None, **kwargs):
-            ExpressionAttributeValues = ExpressionAttributeValues or {}
+        def scan(
+            self,
+            *args,
+            KeyConditionExpression=None,
+            FilterExpression=None,
+            ExpressionAttributeNames=None,
+            ExpressionAttributeValues=None,
+            Limit=None,
+            ExclusiveStartKey=None,
+            ProjectionExpression=None,
+            Select=None,
+            **kwargs,
+        ):
+            names = ExpressionAttributeNames or {}
+            values = ExpressionAttributeValues or {}
+            conditions = [condition for condition in (KeyConditionExpression, FilterExpression) if condition]
+            start = ExclusiveStartKey["index"] if ExclusiveStartKey else 0
+            end = start + Limit if Limit else len(self.items)
             items = []
-            for item in self.items:
-                if all(item.get(k[1:]) == v for k, v in ExpressionAttributeValues.items()):
+            for item in self.items[start:end]:
+                if all(evaluate_condition(condition, item, names, values) for condition in conditions):
+                    if ProjectionExpression:
+                        item = project(item, ProjectionExpression, names)
                     items.append(item)
 
-            return {"Items": items}
+            response = {"Count": len(items)} if Select == "COUNT" else {"Items": items}
+            if end < len(self.items):
+                response["LastEvaluatedKey"] = {"index": end}
+            return response
+
+        query = scan
+
+        def load(self):
+            pass
+
+        reload = load
+
+        def update(self, GlobalSecondaryIndexUpdates, **kwargs):
+            for index_update in GlobalSecondaryIndexUpdates:
+                self.global_secondary_indexes.append({**index_update["Create"], "IndexStatus": "ACTIVE"})
 
-        def put_item(self, Item):
+        def get_item(self, Key):
+            for item in self.items:
+                if all(item.get(k) == v for k, v in Key.items()):
+                    return {"Item": item}
+            return {}
+
+        def put_item(
+            self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None
+        ):
+            if ConditionExpression:
+                # The stub has no key schema, the key is the attributes named in the condition
+                names = ExpressionAttributeNames or {}
+                item = next(
+                    (item for item in self.items if all(item.get(name) == Item.get(name) for name in names.values())),
+                    {},
+                )
+                self._check_condition(ConditionExpression, item, names, ExpressionAttributeValues or {}, "PutItem")
             self.items.append(Item)
 
-        def update_item(self, Key, ExpressionAttributeValues, **kw):
+        def update_item(
+            self,
+            Key,
+            UpdateExpression,
+            ExpressionAttributeValues,
+            ExpressionAttributeNames=None,
+            ConditionExpression=None,
+            **kw,
+        ):
+            names = ExpressionAttributeNames or {}
             for item in self.items:
                 if all(item.get(k) == v for k, v in Key.items()):
-                    item.update({k[1:]: v for k, v in ExpressionAttributeValues.items()})
-                    return
+                    break
+            else:
+                item = dict(Key)
+                self.items.append(item)
+            if ConditionExpression:
+                self._check_condition(ConditionExpression, item, names, ExpressionAttributeValues, "UpdateItem")
+            apply_update(item, UpdateExpression, names, ExpressionAttributeValues)
+            return {}
+
+        @staticmethod
+        def _check_condition(condition, item, names, values, operation_name):
+            if not evaluate_condition(condition, item, names, values):
+                raise ClientError(
+                    {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+                    operation_name,
+                )
 
         @contextmanager
         def batch_writer(self):
             yield self
 
+    class ClientStub:
+        def __init__(self, resource):
+            self.resource = resource
+
+        def update_item(self, TableName, **kwargs):
+            return self.resource.Table(TableName).update_item(**kwargs)
+
+        def transact_write_items(self, TransactItems):
+            for transact_item in TransactItems:
+                self.update_item(**transact_item["Update"])
+
+    class ResourceStub(Mock):
+        def __init__(self, *args: Any, **kw: Any):
+            super().__init__(*args, **kw)
+            self.tables = {}
+            self.meta = Mock(client=ClientStub(self))
+
+        def Table(self, table_name):
+            if table_name not in self.tables:
+                self.tables[table_name] = TableStub(table_name, meta=self.meta)
+            return self.tables[table_name]
+
+        def batch_get_item(self, RequestItems):
+            responses = {}
+            for table_name, request in RequestItems.items():
+                table = self.Table(table_name)
+                responses[table_name] = [
+                    item for key in request["Keys"] if (item := table.get_item(Key=key).get("Item"))
+                ]
+            return {"Responses": responses, "UnprocessedKeys": {}}
+
     class BaseModelServiceStub(BaseModelService):
-        resource = Mock(Table=TableStub)
+        resource = ResourceStub()
 
     with (
         patch("src.helpers.db_helper.BaseModelService", new_callable=BaseModelServiceStub) as base_model_service_stub,
+        patch.dict("src.helpers.db_helper._described_tables", clear=True),
     ):
         yield base_model_service_stub
         for sub_service in BaseModelService.__subclasses__():
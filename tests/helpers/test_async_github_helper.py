@@ -0,0 +1,97 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from github import GithubException, UnknownObjectException
+
+from src.helpers.async_github_helper import AsyncGithubClient, repository_of
+
+
+def run_with_server(routes, coroutine_function):
+    """Run the coroutine function with the url of a local server with the routes"""
+
+    async def run():
+        app = web.Application()
+        app.add_routes(routes)
+        async with TestServer(app) as server:
+            return await coroutine_function(str(server.make_url("/repos/owner/repo")))
+
+    return asyncio.run(run())
+
+
+def test_repository_of():
+    assert repository_of("https://api.github.com/repos/owner/repo/issues/1") == "owner/repo"
+
+
+def test_request():
+    requests = []
+
+    async def edit_issue(request):
+        requests.append(request.headers["Authorization"])
+        return web.json_response({"number": 1, **await request.json()})
+
+    async def call(url):
+        async with AsyncGithubClient(2) as client:
+            return await client.edit_issue(1, "token abc", f"{url}/issues/1", state="closed")
+
+    assert run_with_server([web.patch("/repos/owner/repo/issues/1", edit_issue)], call) == {
+        "number": 1,
+        "state": "closed",
+    }
+    assert requests == ["token abc"]
+
+
+@pytest.mark.parametrize(
+    "status, exception",
+    [(404, UnknownObjectException), (422, GithubException)],
+)
+def test_request_error(status, exception):
+    async def edit_issue(_request):
+        return web.json_response({"message": "error"}, status=status)
+
+    async def call(url):
+        async with AsyncGithubClient(2) as client:
+            return await client.edit_issue(1, "token abc", f"{url}/issues/1", state="closed")
+
+    with pytest.raises(exception) as error:
+        run_with_server([web.patch("/repos/owner/repo/issues/1", edit_issue)], call)
+    assert error.value.status == status
+    assert error.value.data == {"message": "error"}
+
+
+def test_request_retry():
+    responses = [web.json_response({}, status=502), web.json_response({}, status=429, headers={"Retry-After": "0"})]
+
+    async def edit_issue(_request):
+        return responses.pop(0) if responses else web.json_response({"number": 1})
+
+    async def call(url):
+        async with AsyncGithubClient(2) as client:
+            return await client.edit_issue(1, "token abc", f"{url}/issues/1", state="closed")
+
+    with patch("src.helpers.async_github_helper.asyncio.sleep") as sleep:
+        assert run_with_server([web.patch("/repos/owner/repo/issues/1", edit_issue)], call) == {"number": 1}
+    assert [c.args for c in sleep.call_args_list[:2]] == [(1,), (0.0,)]
+
+
+def test_request_limits(monkeypatch):
+    monkeypatch.setenv("GITHUB_MAX_REPOSITORY_REQUESTS", "2")
+    running = {"now": 0, "max": 0}
+
+    async def edit_issue(_request):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return web.json_response({})
+
+    async def call(url):
+        async with AsyncGithubClient(3) as client:
+            await asyncio.gather(
+                *(client.edit_issue(1, "token abc", f"{url}/issues/1", state="closed") for _ in range(10))
+            )
+
+    run_with_server([web.patch("/repos/owner/repo/issues/1", edit_issue)], call)
+    assert running["max"] == 2
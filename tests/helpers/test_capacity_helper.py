@@ -0,0 +1,158 @@
+from unittest.mock import Mock, patch
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from config import SETTINGS
+from src.helpers import capacity_helper
+from src.helpers.capacity_helper import AdaptiveTokenBucket, CapacityTracker, instrument, write_limiter
+
+
+@pytest.fixture(autouse=True)
+def tracker(monkeypatch):
+    tracker = CapacityTracker()
+    monkeypatch.setattr(capacity_helper, "capacity_tracker", tracker)
+    monkeypatch.setattr(capacity_helper, "_write_limiters", {})
+    return tracker
+
+
+@pytest.fixture
+def clock():
+    clock = Mock(now=0.0)
+
+    def sleep(seconds):
+        clock.now += seconds
+
+    with (
+        patch("src.helpers.capacity_helper.time.monotonic", side_effect=lambda: clock.now),
+        patch("src.helpers.capacity_helper.time.sleep", side_effect=sleep) as sleep_mock,
+    ):
+        clock.sleep = sleep_mock
+        yield clock
+
+
+@pytest.fixture
+def client():
+    client = boto3.session.Session().client(
+        "dynamodb", region_name="us-east-1", aws_access_key_id="key", aws_secret_access_key="secret"
+    )
+    with Stubber(instrument(client)) as stubber:
+        yield client, stubber
+
+
+def test_record(tracker):
+    tracker.record("Query", {"TableName": "job", "CapacityUnits": 1.5})
+    tracker.record(
+        "BatchWriteItem", [{"TableName": "job", "CapacityUnits": 2}, {"TableName": "issue", "CapacityUnits": 1}]
+    )
+    tracker.record("TransactWriteItems", {"TableName": "job", "CapacityUnits": 4, "WriteCapacityUnits": 4})
+    assert tracker.snapshot() == {
+        "job": {"read_units": 1.5, "write_units": 6.0, "throttles": 0},
+        "issue": {"read_units": 0.0, "write_units": 1.0, "throttles": 0},
+    }
+    tracker.reset()
+    assert tracker.snapshot() == {}
+
+
+def test_record_throttle(tracker):
+    limiter = write_limiter("job")
+    tracker.record_throttle("job", write=False)
+    assert limiter.rate == SETTINGS["DYNAMODB_MAX_WRITE_RATE"]
+    tracker.record_throttle("job", write=True)
+    assert limiter.rate == SETTINGS["DYNAMODB_MAX_WRITE_RATE"] / 2
+    assert tracker.snapshot()["job"]["throttles"] == 2
+
+
+def test_token_bucket(clock):
+    bucket = AdaptiveTokenBucket(10)
+    assert bucket.acquire(10) == 0
+    assert bucket.acquire(5) == 0.5
+    # The tokens of the waiting time were already taken
+    assert bucket.acquire(1) == 0.1
+    clock.now += 10
+    bucket.throttled()
+    assert (bucket.rate, bucket.tokens) == (5, 0)
+    assert bucket.acquire(5) == 1
+    for _ in range(3):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_token_bucket_min_rate():
+    bucket = AdaptiveTokenBucket(2)
+    for _ in range(5):
+        bucket.throttled()
+    assert bucket.rate == capacity_helper.MIN_WRITE_RATE
+
+
+def test_token_bucket_call(clock):
+    bucket = AdaptiveTokenBucket(10)
+    bucket.rate = 5
+    response = bucket.call(2, lambda: {"ConsumedCapacity": [{"TableName": "job", "CapacityUnits": 8}]})
+    assert response["ConsumedCapacity"]
+    assert (bucket.tokens, bucket.rate) == (-3, 10)
+    bucket.call(1, lambda: {"UnprocessedItems": {"job": []}})
+    assert bucket.rate == 10
+    assert clock.sleep.call_count == 1
+
+
+def test_write_limiter_rate(monkeypatch):
+    monkeypatch.setenv("DYNAMODB_MAX_WRITE_RATE", "50")
+    assert write_limiter("job") is write_limiter("job")
+    assert write_limiter("job").rate == 50
+
+
+def test_instrument(client, tracker):
+    client, stubber = client
+    key = {"issue_url": {"S": "issue.url"}}
+    stubber.add_response(
+        "get_item",
+        {"ConsumedCapacity": {"TableName": "issue", "CapacityUnits": 0.5}},
+        {"TableName": "issue", "Key": key, "ReturnConsumedCapacity": "TOTAL"},
+    )
+    request_items = {"job": [{"DeleteRequest": {"Key": key}}]}
+    stubber.add_response(
+        "batch_write_item",
+        {"UnprocessedItems": request_items, "ConsumedCapacity": [{"TableName": "job", "CapacityUnits": 0}]},
+        {"RequestItems": request_items, "ReturnConsumedCapacity": "TOTAL"},
+    )
+    stubber.add_response("describe_time_to_live", {}, {"TableName": "job"})
+    client.get_item(TableName="issue", Key=key)
+    client.batch_write_item(RequestItems=request_items)
+    client.describe_time_to_live(TableName="job")
+    assert tracker.snapshot() == {
+        "issue": {"read_units": 0.5, "write_units": 0.0, "throttles": 0},
+        "job": {"read_units": 0.0, "write_units": 0.0, "throttles": 1},
+    }
+    assert write_limiter("job").rate < SETTINGS["DYNAMODB_MAX_WRITE_RATE"]
+
+
+@pytest.mark.parametrize(
+    "operation_name, error_code, throttles, write_rate",
+    [
+        ("UpdateItem", "ProvisionedThroughputExceededException", 1, SETTINGS["DYNAMODB_MAX_WRITE_RATE"] / 2),
+        ("Query", "ThrottlingException", 1, SETTINGS["DYNAMODB_MAX_WRITE_RATE"]),
+        ("UpdateItem", "ConditionalCheckFailedException", 0, SETTINGS["DYNAMODB_MAX_WRITE_RATE"]),
+    ],
+    ids=["write throttled", "read throttled", "other error"],
+)
+def test_needs_retry(operation_name, error_code, throttles, write_rate, tracker):
+    operation = Mock()
+    operation.name = operation_name
+    capacity_helper._needs_retry(
+        response=(Mock(), {"Error": {"Code": error_code}}),
+        operation=operation,
+        request_dict={"context": {"table_names": ["job"]}},
+    )
+    # Connection errors don't have response
+    capacity_helper._needs_retry(response=None, operation=operation, request_dict={"context": {}})
+    assert tracker.snapshot().get("job", {"throttles": 0})["throttles"] == throttles
+    assert write_limiter("job").rate == write_rate
+
+
+def test_request_table_names():
+    assert capacity_helper.request_table_names({"TableName": "job"}) == ["job"]
+    assert capacity_helper.request_table_names({"RequestItems": {"job": [], "issue": []}}) == ["job", "issue"]
+    transact_items = [{"Update": {"TableName": "job"}}, {"Put": {"TableName": "job"}}, {"Delete": {"TableName": "i"}}]
+    assert capacity_helper.request_table_names({"TransactItems": transact_items}) == ["job", "i"]
@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from pydantic import BaseModel, Field
+
+from src.helpers.codec_helper import from_attribute_value, model_codec, to_attribute_value
+from src.models import IssueJob, IssueJobStatus, Job, JobStatus
+
+
+@pytest.fixture
+def job():
+    return Job(
+        original_issue_url="issue.url",
+        task="task",
+        checked=True,
+        job_status=JobStatus.CREATE_ISSUE,
+        title="title",
+        version=3,
+    )
+
+
+@pytest.mark.parametrize("model_fixture", ["job", "issue_job"])
+def test_same_as_boto3(model_fixture, request):
+    model = request.getfixturevalue(model_fixture)
+    codec = model_codec(type(model))
+    serializer = TypeSerializer()
+    item = {k: (v.value if isinstance(v, (JobStatus, IssueJobStatus)) else v) for k, v in model.model_dump().items()}
+    attribute_values = {k: serializer.serialize(v) for k, v in item.items()}
+    assert codec.to_item(model) == item
+    assert codec.to_attribute_values(model) == attribute_values
+
+    deserializer = TypeDeserializer()
+    resource_item = {k: deserializer.deserialize(v) for k, v in attribute_values.items()}
+    assert codec.from_item(resource_item) == model
+    assert codec.from_attribute_values(attribute_values) == model
+
+
+def test_from_item_trusted(issue_job):
+    item = model_codec(IssueJob).to_item(issue_job)
+    del item["version"]
+    item["issue_comment_id"] = Decimal(1)
+    model = model_codec(IssueJob).from_item(item)
+    assert (model.version, model.issue_comment_id, model.issue_job_status) == (0, 1, IssueJobStatus.PENDING)
+    assert type(model.issue_comment_id) is int
+
+
+def test_from_attribute_values_missing_and_null():
+    model = model_codec(Job).from_attribute_values(
+        {
+            "original_issue_url": {"S": "issue.url"},
+            "task": {"S": "task"},
+            "checked": {"BOOL": False},
+            "title": {"NULL": True},
+        }
+    )
+    assert (model.job_status, model.title, model.version) == (JobStatus.PENDING, None, 0)
+
+
+def test_from_item_model_with_alias():
+    class AliasModel(BaseModel):
+        name: str = Field(alias="title")
+
+    model = model_codec(AliasModel).from_item({"name": "name"})
+    assert model.name == "name"
+    assert not model_codec(AliasModel).plain
+
+
+@pytest.mark.parametrize(
+    "value",
+    [None, "a", True, 1, Decimal("1.5"), b"bytes", {"a": [1, "b", None]}, {"a", "b"}, {1, 2}],
+)
+def test_attribute_value(value):
+    assert to_attribute_value(value) == TypeSerializer().serialize(value)
+    assert from_attribute_value(to_attribute_value(value)) == value
+
+
+def test_attribute_value_unsupported():
+    with pytest.raises(TypeError):
+        to_attribute_value(object())
@@ -0,0 +1,687 @@
+import io
+import json
+from contextlib import nullcontext
+from itertools import islice
+from unittest.mock import Mock, patch
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from src.helpers.db_helper import BaseModelService
+from src.helpers.storage_helper import MemoryBackend
+from src.models import IssueJob, IssueJobStatus, Job, JobStatus
+from src.services import IssueJobService, JobService
+
+
+@pytest.fixture
+def jobs(issue_job):
+    jobs = [
+        Job(
+            original_issue_url=issue_job.issue_url,
+            task=f"task_{i}",
+            checked=False,
+            job_status=JobStatus.DONE if i % 2 else JobStatus.PENDING,
+        )
+        for i in range(5)
+    ]
+    JobService.provision()
+    JobService.insert_many(jobs)
+    return jobs
+
+
+def test_get(issue_job):
+    IssueJobService.insert_one(issue_job)
+    assert IssueJobService.get(issue_url=issue_job.issue_url) == issue_job
+    assert IssueJobService.get(issue_url="other.url") is None
+
+
+@pytest.mark.parametrize(
+    "key",
+    [{}, {"issue_url": "issue.url", "title": "title"}],
+    ids=["Missing key attribute", "Attribute not in key schema"],
+)
+def test_get_invalid_key(key):
+    with pytest.raises(ValueError):
+        IssueJobService.get(**key)
+
+
+def test_batch_get(jobs):
+    keys = [{"original_issue_url": job.original_issue_url, "task": job.task} for job in reversed(jobs)]
+    keys.insert(1, {"original_issue_url": "other.url", "task": "task_0"})
+    with patch("src.helpers.db_helper.BATCH_GET_MAX_KEYS", 2):
+        assert JobService.batch_get(keys) == list(reversed(jobs))
+
+
+@pytest.mark.parametrize(
+    "filter_kwargs, operation, index_name, filter_expression",
+    [
+        ({"original_issue_url": "issue.url"}, "query", None, None),
+        (
+            {"original_issue_url": "issue.url", "job_status": JobStatus.DONE},
+            "query",
+            "original_issue_url-job_status-index",
+            None,
+        ),
+        (
+            {"original_issue_url": "issue.url", "task": "task_1", "job_status": JobStatus.DONE},
+            "query",
+            None,
+            "#job_status=:job_status",
+        ),
+        ({"job_status": JobStatus.DONE}, "scan", None, "#job_status=:job_status"),
+        ({}, "scan", None, None),
+    ],
+)
+def test_filter_query_or_scan(filter_kwargs, operation, index_name, filter_expression, jobs):
+    with patch.object(JobService.table, operation, wraps=getattr(JobService.table, operation)) as operation_mock:
+        result = JobService.filter(**filter_kwargs)
+        operation_mock.assert_called()
+    expected = [job for job in jobs if all(getattr(job, k) == v for k, v in filter_kwargs.items())]
+    assert result == expected
+    request = operation_mock.call_args.kwargs
+    assert request.get("IndexName") == index_name
+    assert request.get("FilterExpression") == filter_expression
+    assert request.get("ScanIndexForward") is (True if operation == "query" else None)
+    if "job_status" in filter_kwargs:
+        assert request["ExpressionAttributeValues"][":job_status"] == JobStatus.DONE.value
+
+
+def test_filter_index_not_active(jobs):
+    JobService.table.global_secondary_indexes[0]["IndexStatus"] = "CREATING"
+    with patch.object(JobService.table, "query", wraps=JobService.table.query) as query_mock:
+        assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE) == jobs[1::2]
+    request = query_mock.call_args.kwargs
+    assert "IndexName" not in request
+    assert request["FilterExpression"] == "#job_status=:job_status"
+
+
+@pytest.mark.parametrize("page_size", [None, 1, 2, 10])
+def test_iter_filter_pagination(page_size, jobs):
+    assert list(JobService.iter_filter(page_size=page_size)) == jobs
+    assert list(JobService.iter_filter(page_size=page_size, job_status=JobStatus.DONE)) == jobs[1::2]
+
+
+@pytest.mark.parametrize("limit", [0, 1, 3, 10])
+def test_iter_filter_limit(limit, jobs):
+    with patch.object(JobService.table, "scan", wraps=JobService.table.scan) as scan_mock:
+        assert list(JobService.iter_filter(limit=limit, page_size=1)) == jobs[:limit]
+    assert scan_mock.call_count == min(limit, len(jobs))
+
+
+def test_copy_from(issue_job, base_model_service_stub):
+    source_table = base_model_service_stub.resource.Table("old_issue_job")
+    source_table.items = [issue_job.dynamo_dict()]
+    assert IssueJobService.copy_from("old_issue_job") == 1
+    assert IssueJobService.all() == [IssueJob(**issue_job.dynamo_dict())]
+
+
+def test_copy_from_again(issue_job, base_model_service_stub):
+    source_table = base_model_service_stub.resource.Table("old_issue_job")
+    source_table.items = [issue_job.dynamo_dict()]
+    IssueJobService.copy_from("old_issue_job")
+    IssueJobService.update(IssueJobService.all()[0], issue_job_status=IssueJobStatus.DONE)
+    new_issue_job = IssueJob(**{**issue_job.dynamo_dict(), "issue_url": "other.url"})
+    source_table.items.append(new_issue_job.dynamo_dict())
+    assert IssueJobService.copy_from("old_issue_job") == 1
+    assert [i.issue_job_status for i in IssueJobService.all()] == [IssueJobStatus.DONE, IssueJobStatus.PENDING]
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+def test_update_many(atomic, jobs):
+    client = JobService.table.meta.client
+    with (
+        patch.object(client, "update_item", wraps=client.update_item) as update_item_mock,
+        patch.object(client, "transact_write_items", wraps=client.transact_write_items) as transact_mock,
+    ):
+        JobService.update_many(jobs[:3], atomic=atomic, job_status=JobStatus.ERROR)
+        assert transact_mock.call_count == int(atomic)
+        if not atomic:
+            assert update_item_mock.call_count == 3
+    for job in jobs[:3]:
+        assert job.job_status == JobStatus.ERROR
+    assert [job.job_status for job in JobService.all()] == [JobStatus.ERROR] * 3 + [
+        JobStatus.DONE,
+        JobStatus.PENDING,
+    ]
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+def test_update_many_error(atomic, jobs):
+    client = JobService.table.meta.client
+    error = ClientError({"Error": {"Code": "InternalServerError", "Message": "Internal error"}}, "UpdateItem")
+    send_update_item = client.update_item
+
+    def update_item(TableName, **request):
+        if request["Key"]["task"] == "task_1":
+            raise error
+        return send_update_item(TableName=TableName, **request)
+
+    with (
+        patch.object(client, "update_item", side_effect=update_item),
+        patch.object(client, "transact_write_items", side_effect=error),
+        pytest.raises(ClientError),
+    ):
+        JobService.update_many(jobs[:3], atomic=atomic, job_status=JobStatus.ERROR)
+    expected = (
+        [JobStatus.PENDING, JobStatus.DONE, JobStatus.PENDING]
+        if atomic
+        else [JobStatus.ERROR, JobStatus.DONE, JobStatus.ERROR]
+    )
+    # The items in memory have the updates applied in the table, and only them
+    assert [job.job_status for job in jobs[:3]] == expected
+    assert [job.version for job in jobs[:3]] == [int(status == JobStatus.ERROR) for status in expected]
+    assert [job.job_status for job in JobService.all()[:3]] == expected
+
+
+def test_update_many_atomic_limit(jobs):
+    with patch("src.helpers.db_helper.TRANSACT_MAX_ITEMS", 2), pytest.raises(ValueError):
+        JobService.update_many(jobs, atomic=True, job_status=JobStatus.ERROR)
+
+
+def test_bulk_update(jobs):
+    JobService.bulk_update([(jobs[0], {"title": "title 0"}), (jobs[1], {"title": "title 1", "checked": True})])
+    result = JobService.all()
+    assert (result[0].title, result[0].checked) == ("title 0", False)
+    assert (result[1].title, result[1].checked) == ("title 1", True)
+
+
+def test_session_get(issue_job):
+    IssueJobService.insert_one(issue_job)
+    with patch.object(IssueJobService.table, "get_item", wraps=IssueJobService.table.get_item) as get_item_mock:
+        with BaseModelService.session():
+            loaded = IssueJobService.get(issue_url=issue_job.issue_url)
+            assert IssueJobService.get(issue_url=issue_job.issue_url) is loaded
+            assert IssueJobService.batch_get([{"issue_url": issue_job.issue_url}]) == [loaded]
+        assert get_item_mock.call_count == 1
+        IssueJobService.get(issue_url=issue_job.issue_url)
+        assert get_item_mock.call_count == 2
+
+
+def test_session_filter(jobs):
+    with patch.object(JobService.table, "query", wraps=JobService.table.query) as query_mock:
+        with BaseModelService.session():
+            assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE) == jobs[1::2]
+            pending = JobService.filter(original_issue_url="issue.url", job_status=JobStatus.PENDING)
+            assert pending == jobs[::2]
+            JobService.update_many(pending, job_status=JobStatus.DONE)
+            new_job = JobService.insert_one(Job(original_issue_url="issue.url", task="new", checked=False))
+            with BaseModelService.session():
+                done = JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE)
+                assert [job.task for job in done] == [job.task for job in jobs]
+                assert JobService.filter(original_issue_url="issue.url", limit=1) == pending[:1]
+            assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.PENDING) == [new_job]
+        query_mock.assert_called_once()
+        assert "IndexName" not in query_mock.call_args.kwargs
+        assert len(JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE)) == 5
+        assert query_mock.call_count == 2
+
+
+def test_session_write_behind_error(jobs):
+    client = JobService.table.meta.client
+    with (
+        patch.object(client, "update_item", wraps=client.update_item) as client_update_item_mock,
+        patch.object(JobService.table, "put_item", wraps=JobService.table.put_item) as put_item_mock,
+        pytest.raises(ValueError),
+    ):
+        with BaseModelService.session(write_behind=True):
+            job = JobService.filter(original_issue_url="issue.url", task="task_0")[0]
+            JobService.update(job, job_status=JobStatus.CREATE_ISSUE)
+            JobService.insert_one(Job(original_issue_url="issue.url", task="new", checked=False))
+            raise ValueError("error")
+    client_update_item_mock.assert_not_called()
+    put_item_mock.assert_not_called()
+    assert JobService.get(original_issue_url="issue.url", task="task_0").job_status == JobStatus.PENDING
+    assert JobService.get(original_issue_url="issue.url", task="new") is None
+
+
+def test_session_write_through_other_instance(jobs):
+    with BaseModelService.session():
+        loaded = JobService.filter(original_issue_url="issue.url", task="task_0")[0]
+        other_instance = Job(**jobs[0].dynamo_dict())
+        JobService.update(other_instance, title="new title")
+        assert loaded.title == "new title"
+
+
+def test_session_write_behind(jobs, issue_job):
+    client = JobService.table.meta.client
+    with (
+        patch.object(JobService.table, "update_item", wraps=JobService.table.update_item) as update_item_mock,
+        patch.object(client, "update_item", wraps=client.update_item) as client_update_item_mock,
+        patch.object(JobService.table, "put_item", wraps=JobService.table.put_item) as put_item_mock,
+    ):
+        with BaseModelService.session(write_behind=True):
+            job = JobService.filter(original_issue_url="issue.url", task="task_0")[0]
+            JobService.update(job, job_status=JobStatus.CREATE_ISSUE, title="title")
+            JobService.update(job, job_status=JobStatus.UPDATE_ISSUE_BODY)
+            JobService.update_many([job], issue_ref="#1")
+            new_job = JobService.insert_one(Job(original_issue_url="issue.url", task="new", checked=False))
+            JobService.update(new_job, checked=True)
+            assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.UPDATE_ISSUE_BODY) == [job]
+            update_item_mock.assert_not_called()
+            client_update_item_mock.assert_not_called()
+            put_item_mock.assert_not_called()
+
+            BaseModelService.commit()
+            client_update_item_mock.assert_called_once()
+            request = client_update_item_mock.call_args.kwargs
+            assert request["Key"] == {"original_issue_url": "issue.url", "task": "task_0"}
+            assert request["ExpressionAttributeValues"] == {
+                ":job_status": JobStatus.UPDATE_ISSUE_BODY.value,
+                ":title": "title",
+                ":issue_ref": "#1",
+                ":version_increment": 1,
+            }
+            put_item_mock.assert_called_once()
+            assert put_item_mock.call_args.kwargs["Item"]["checked"] is True
+
+            JobService.update(job, job_status=JobStatus.DONE)
+            IssueJobService.insert_one(issue_job)
+            # Filters that scan the table send the buffered writes first
+            assert IssueJobService.all() == [issue_job]
+            assert client_update_item_mock.call_count == 2
+            JobService.update(job, checked=True)
+        assert client_update_item_mock.call_count == 3
+    stored_job = JobService.get(original_issue_url="issue.url", task="task_0")
+    assert (stored_job.job_status, stored_job.checked) == (JobStatus.DONE, True)
+
+
+def test_filter_fields(jobs):
+    with patch.object(JobService.table, "query", wraps=JobService.table.query) as query_mock:
+        result = JobService.filter(original_issue_url="issue.url", fields=["job_status"])
+    assert query_mock.call_args.kwargs["ProjectionExpression"] == "#original_issue_url,#task,#job_status,#version"
+    assert [vars(record) for record in result] == [
+        {"original_issue_url": "issue.url", "task": job.task, "job_status": job.job_status, "version": 0}
+        for job in jobs
+    ]
+    JobService.update(result[0], title="title")
+    assert JobService.get(original_issue_url="issue.url", task="task_0").title == "title"
+
+
+def test_filter_fields_in_session(jobs):
+    with BaseModelService.session():
+        result = JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE, fields=["checked"])
+        assert [vars(record) for record in result] == [
+            {"original_issue_url": "issue.url", "task": job.task, "checked": False, "version": 0} for job in jobs[1::2]
+        ]
+        JobService.update(result[0], checked=True)
+        assert [job.task for job in JobService.filter(original_issue_url="issue.url", checked=True)] == ["task_1"]
+
+
+def test_filter_fields_in_session_projection(jobs):
+    with patch.object(JobService.table, "query", wraps=JobService.table.query) as query_mock:
+        with BaseModelService.session():
+            result = JobService.filter(original_issue_url="issue.url", fields=["checked"])
+            JobService.update(result[1], checked=True)
+            assert [job.task for job in JobService.filter(original_issue_url="issue.url", checked=True)] == ["task_1"]
+            assert isinstance(JobService.filter(original_issue_url="issue.url", checked=True)[0], Job)
+    assert "ProjectionExpression" in query_mock.call_args_list[0].kwargs
+    assert "ProjectionExpression" not in query_mock.call_args_list[1].kwargs
+    assert query_mock.call_count == 2
+
+
+@pytest.mark.parametrize("in_session", [False, True])
+def test_count(in_session, jobs):
+    with patch.object(JobService.table, "query", wraps=JobService.table.query) as query_mock:
+        with BaseModelService.session() if in_session else nullcontext():
+            assert JobService.count(original_issue_url="issue.url") == 5
+            assert JobService.count(original_issue_url="issue.url", job_status=JobStatus.DONE) == 2
+            assert JobService.count(job_status=JobStatus.PENDING) == 3
+    # The partitions not loaded are counted in the table
+    assert query_mock.call_count == 2
+    assert query_mock.call_args.kwargs["Select"] == "COUNT"
+
+
+def test_count_loaded_partition(jobs):
+    with BaseModelService.session():
+        JobService.filter(original_issue_url="issue.url")
+        with patch.object(JobService.table, "query", wraps=JobService.table.query) as query_mock:
+            assert JobService.count(original_issue_url="issue.url") == 5
+            assert JobService.count(original_issue_url="issue.url", job_status=JobStatus.DONE) == 2
+    query_mock.assert_not_called()
+
+
+def test_compare_and_set(issue_job):
+    IssueJobService.table.items.append({k: v for k, v in issue_job.dynamo_dict().items() if k != "version"})
+    worker_1 = IssueJobService.get(issue_url=issue_job.issue_url)
+    worker_2 = IssueJobService.get(issue_url=issue_job.issue_url)
+    expected = {"issue_job_status": IssueJobStatus.PENDING}
+    assert IssueJobService.compare_and_set(worker_1, expected, issue_job_status=IssueJobStatus.RUNNING)
+    assert not IssueJobService.compare_and_set(worker_2, expected, issue_job_status=IssueJobStatus.RUNNING)
+    assert (worker_1.version, worker_2.version) == (1, 0)
+    assert worker_2.issue_job_status == IssueJobStatus.PENDING
+    with pytest.raises(ClientError):
+        IssueJobService.update(worker_2, condition={"version": 0}, title="other title")
+    assert IssueJobService.get(issue_url=issue_job.issue_url).title == issue_job.title
+
+
+@pytest.fixture
+def memory_backend(base_model_service_stub, monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(base_model_service_stub, "resource", backend)
+    return backend
+
+
+def test_increment(memory_backend, issue_job):
+    issue_job.total_tasks = 2
+    issue_job.done_tasks = 0
+    IssueJobService.insert_one(issue_job)
+    other_worker_issue_job = IssueJobService.get(issue_url=issue_job.issue_url)
+    IssueJobService.increment(other_worker_issue_job, total_tasks=1, done_tasks=1)
+    IssueJobService.increment(issue_job, total_tasks=3, done_tasks=0)
+    # With the increments of the other worker
+    assert (issue_job.total_tasks, issue_job.done_tasks, issue_job.version) == (6, 0, 0)
+    stored = IssueJobService.get(issue_url=issue_job.issue_url)
+    assert (stored.total_tasks, stored.done_tasks) == (6, 1)
+
+
+def test_increment_write_behind(memory_backend, issue_job):
+    issue_job.total_tasks = 0
+    issue_job.done_tasks = 0
+    IssueJobService.insert_one(issue_job)
+    table = IssueJobService.table
+    with patch.object(table, "update_item", wraps=table.update_item) as update_item_mock:
+        with BaseModelService.session(write_behind=True):
+            loaded = IssueJobService.get(issue_url=issue_job.issue_url)
+            IssueJobService.increment(loaded, total_tasks=2, done_tasks=1)
+            IssueJobService.increment(loaded, done_tasks=1)
+            assert (loaded.total_tasks, loaded.done_tasks) == (2, 2)
+            update_item_mock.assert_not_called()
+            BaseModelService.commit()
+            update_item_mock.assert_called_once()
+            assert update_item_mock.call_args.kwargs["ExpressionAttributeValues"] == {
+                ":total_tasks": 2,
+                ":done_tasks": 2,
+            }
+
+            # The update writes the value with the increment
+            IssueJobService.increment(loaded, done_tasks=1)
+            IssueJobService.update(loaded, done_tasks=loaded.done_tasks, title="new title")
+            IssueJobService.increment(loaded, total_tasks=1)
+            new_issue_job = IssueJobService.insert_one(issue_job.model_copy(update={"issue_url": "new.url"}))
+            IssueJobService.increment(new_issue_job, total_tasks=1)
+        # Only the total_tasks increment, the update is sent by the client
+        assert update_item_mock.call_count == 2
+        assert update_item_mock.call_args.kwargs["ExpressionAttributeValues"] == {":total_tasks": 1}
+    stored = IssueJobService.get(issue_url=issue_job.issue_url)
+    assert (stored.total_tasks, stored.done_tasks, stored.title) == (3, 3, "new title")
+    assert IssueJobService.get(issue_url="new.url").total_tasks == 1
+
+
+def test_increment_write_behind_whole_item_update(memory_backend, issue_job):
+    issue_job.total_tasks = 1
+    issue_job.done_tasks = 0
+    IssueJobService.insert_one(issue_job)
+    other_worker_issue_job = IssueJobService.get(issue_url=issue_job.issue_url)
+    IssueJobService.increment(other_worker_issue_job, total_tasks=1, done_tasks=1)
+    with BaseModelService.session(write_behind=True):
+        IssueJobService.increment(issue_job, total_tasks=2)
+        issue_job.title = "new title"
+        IssueJobService.update(issue_job)
+    stored = IssueJobService.get(issue_url=issue_job.issue_url)
+    # The increment of the other worker is kept, the attributes not incremented are written with the values in memory
+    assert (stored.total_tasks, stored.done_tasks, stored.title) == (4, 0, "new title")
+
+
+def test_provision(memory_backend):
+    memory_backend.create_table(
+        TableName=JobService.table_name,
+        KeySchema=[
+            {"AttributeName": "original_issue_url", "KeyType": "HASH"},
+            {"AttributeName": "task", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[],
+    )
+    assert JobService.provision() == []
+    assert JobService.active_indexes() == {"original_issue_url-job_status-index": ["original_issue_url", "job_status"]}
+    assert IssueJobService.provision() == []
+    assert IssueJobService.table.creation_date_time
+
+
+def test_provision_wrong_key_schema(memory_backend):
+    memory_backend.create_table(
+        TableName=JobService.table_name,
+        KeySchema=[{"AttributeName": "task", "KeyType": "HASH"}],
+        AttributeDefinitions=[],
+    )
+    assert JobService.provision() == [
+        "Table job_v2 key schema is [{'AttributeName': 'task', 'KeyType': 'HASH'}], expected "
+        "[{'AttributeName': 'original_issue_url', 'KeyType': 'HASH'}, {'AttributeName': 'task', 'KeyType': 'RANGE'}]"
+    ]
+
+
+def test_table_described_once(memory_backend, base_model_service_stub, monkeypatch):
+    with patch.object(memory_backend, "describe", wraps=memory_backend.describe) as describe_mock:
+        assert JobService.active_indexes()
+        describe_calls = describe_mock.call_count
+        # As in a forked process, with a new resource
+        monkeypatch.setattr(base_model_service_stub, "resource", MemoryBackend())
+        assert JobService.active_indexes()
+        assert describe_mock.call_count == describe_calls
+
+
+def test_trust_table_schema(memory_backend, monkeypatch):
+    monkeypatch.setenv("TRUST_TABLE_SCHEMA", "true")
+    with patch.object(memory_backend, "describe") as describe_mock:
+        assert JobService.active_indexes() == {
+            "original_issue_url-job_status-index": ["original_issue_url", "job_status"]
+        }
+    describe_mock.assert_not_called()
+
+
+@pytest.fixture
+def raw_client():
+    client = boto3.session.Session().client(
+        "dynamodb", region_name="us-east-1", aws_access_key_id="key", aws_secret_access_key="secret"
+    )
+    with Stubber(client) as stubber, patch.object(BaseModelService, "raw_client", return_value=client):
+        yield stubber
+
+
+def test_raw_client(jobs, raw_client):
+    codec = JobService.codec
+    attribute_values = [codec.to_attribute_values(job) for job in jobs]
+    key = {"original_issue_url": {"S": "issue.url"}, "task": {"S": "task_1"}}
+    raw_client.add_response("get_item", {"Item": attribute_values[1]}, {"TableName": "job_v2", "Key": key})
+    raw_client.add_response(
+        "query",
+        {"Items": attribute_values[1::2]},
+        {
+            "TableName": "job_v2",
+            "IndexName": "original_issue_url-job_status-index",
+            "KeyConditionExpression": "#original_issue_url=:original_issue_url and #job_status=:job_status",
+            "ExpressionAttributeNames": {"#original_issue_url": "original_issue_url", "#job_status": "job_status"},
+            "ExpressionAttributeValues": {":original_issue_url": {"S": "issue.url"}, ":job_status": {"S": "done"}},
+            "ScanIndexForward": True,
+        },
+    )
+    raw_client.add_response(
+        "batch_get_item",
+        {"Responses": {"job_v2": attribute_values[1:2]}},
+        {"RequestItems": {"job_v2": {"Keys": [key]}}},
+    )
+    raw_client.add_response(
+        "batch_write_item",
+        {"UnprocessedItems": {"job_v2": [{"PutRequest": {"Item": attribute_values[1]}}]}},
+        {"RequestItems": {"job_v2": [{"PutRequest": {"Item": item}} for item in attribute_values]}},
+    )
+    raw_client.add_response(
+        "batch_write_item", {}, {"RequestItems": {"job_v2": [{"PutRequest": {"Item": attribute_values[1]}}]}}
+    )
+
+    assert JobService.get(original_issue_url="issue.url", task="task_1") == jobs[1]
+    assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE) == jobs[1::2]
+    assert JobService.batch_get([{"original_issue_url": "issue.url", "task": "task_1"}]) == [jobs[1]]
+    with patch("src.helpers.db_helper.time.sleep") as sleep_mock:
+        JobService.insert_many(jobs)
+    sleep_mock.assert_called_once()
+    raw_client.assert_no_pending_responses()
+
+
+def test_archive(memory_backend, jobs):
+    file = io.StringIO()
+    with BaseModelService.session():
+        assert JobService.get(original_issue_url="issue.url", task="task_0") == jobs[0]
+        with patch("src.helpers.db_helper.BATCH_WRITE_MAX_ITEMS", 2):
+            assert JobService.archive(JobService.iter_filter(job_status=JobStatus.PENDING), file) == 3
+        assert JobService.get(original_issue_url="issue.url", task="task_0") is None
+    assert [Job(**json.loads(line)) for line in file.getvalue().splitlines()] == jobs[::2]
+    assert JobService.all() == jobs[1::2]
+
+
+@pytest.mark.parametrize(
+    "description, problem, updated",
+    [
+        ({"TimeToLiveStatus": "DISABLED"}, None, True),
+        ({"TimeToLiveStatus": "ENABLED", "AttributeName": "expires_at"}, None, False),
+        (
+            {"TimeToLiveStatus": "ENABLING", "AttributeName": "ttl"},
+            "Table job_v2 TTL attribute is ttl, expected expires_at",
+            False,
+        ),
+        ({"TimeToLiveStatus": "DISABLING"}, "Table job_v2 TTL is being disabled", False),
+    ],
+    ids=["disabled", "enabled", "other attribute", "disabling"],
+)
+def test_enable_ttl(description, problem, updated, raw_client):
+    raw_client.add_response("describe_time_to_live", {"TimeToLiveDescription": description}, {"TableName": "job_v2"})
+    if updated:
+        raw_client.add_response(
+            "update_time_to_live",
+            {},
+            {"TableName": "job_v2", "TimeToLiveSpecification": {"Enabled": True, "AttributeName": "expires_at"}},
+        )
+    assert JobService.enable_ttl() == problem
+    raw_client.assert_no_pending_responses()
+
+
+def test_delete_many_raw_client(jobs, raw_client):
+    raw_client.add_response(
+        "batch_write_item",
+        {},
+        {
+            "RequestItems": {
+                "job_v2": [
+                    {"DeleteRequest": {"Key": {"original_issue_url": {"S": "issue.url"}, "task": {"S": job.task}}}}
+                    for job in jobs[:2]
+                ]
+            }
+        },
+    )
+    JobService.delete_many(jobs[:2])
+    raw_client.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize("billing_mode", ["PROVISIONED", "pay_per_request"])
+def test_create_table_billing_mode(billing_mode, memory_backend, monkeypatch):
+    monkeypatch.setenv("DYNAMODB_BILLING_MODE", billing_mode)
+    with patch.object(memory_backend, "create_table", wraps=memory_backend.create_table) as create_table_mock:
+        JobService.create_table()
+    kwargs = create_table_mock.call_args.kwargs
+    on_demand = billing_mode == "pay_per_request"
+    assert kwargs["BillingMode"] == billing_mode.upper()
+    assert ("ProvisionedThroughput" in kwargs) is not on_demand
+    assert ("ProvisionedThroughput" in kwargs["GlobalSecondaryIndexes"][0]) is not on_demand
+
+
+@pytest.mark.parametrize(
+    "billing_mode, table_billing_mode, expected_update",
+    [
+        ("PAY_PER_REQUEST", None, {"BillingMode": "PAY_PER_REQUEST"}),
+        (
+            "PROVISIONED",
+            "PAY_PER_REQUEST",
+            {
+                "BillingMode": "PROVISIONED",
+                "ProvisionedThroughput": {"ReadCapacityUnits": 10, "WriteCapacityUnits": 10},
+                "GlobalSecondaryIndexUpdates": [
+                    {
+                        "Update": {
+                            "IndexName": "index",
+                            "ProvisionedThroughput": {"ReadCapacityUnits": 10, "WriteCapacityUnits": 10},
+                        }
+                    }
+                ],
+            },
+        ),
+        ("PROVISIONED", None, None),
+    ],
+    ids=["to on-demand", "to provisioned", "same"],
+)
+def test_update_billing_mode(billing_mode, table_billing_mode, expected_update, raw_client, monkeypatch):
+    monkeypatch.setenv("DYNAMODB_BILLING_MODE", billing_mode)
+    table = Mock(
+        billing_mode_summary=table_billing_mode and {"BillingMode": table_billing_mode},
+        global_secondary_indexes=[{"IndexName": "index"}],
+    )
+    assert JobService.update_billing_mode(table) is None
+    if expected_update:
+        table.update.assert_called_once_with(**expected_update)
+    else:
+        table.update.assert_not_called()
+
+
+def test_update_billing_mode_error(raw_client, monkeypatch):
+    monkeypatch.setenv("DYNAMODB_BILLING_MODE", "PAY_PER_REQUEST")
+    table = Mock(billing_mode_summary=None, global_secondary_indexes=None)
+    table.update.side_effect = ClientError({"Error": {"Code": "LimitExceededException", "Message": "Limit"}}, "Update")
+    assert JobService.update_billing_mode(table).startswith("Couldn't change the billing mode of job_v2")
+
+
+def test_update_billing_mode_local_backend(memory_backend, monkeypatch):
+    monkeypatch.setenv("DYNAMODB_BILLING_MODE", "PAY_PER_REQUEST")
+    assert JobService.provision() == []
+
+
+def test_update_many_paced(jobs, raw_client):
+    with patch("src.helpers.db_helper.write_limiter") as write_limiter_mock:
+        write_limiter_mock.return_value.call.side_effect = lambda units, send: send()
+        JobService.update_many(jobs, checked=True)
+    assert write_limiter_mock.return_value.call.call_count == len(jobs)
+    assert all(job.checked for job in jobs)
+
+
+@pytest.fixture
+def many_jobs(memory_backend):
+    jobs = [Job(original_issue_url=f"issue_{i % 5}.url", task=f"task_{i:02}", checked=False) for i in range(40)]
+    JobService.insert_many(jobs)
+    return jobs
+
+
+@pytest.mark.parametrize("segments", [None, 1, 4])
+def test_all_segments(segments, many_jobs):
+    assert sorted(JobService.all(segments=segments), key=lambda job: job.task) == many_jobs
+    assert sorted(JobService.iter_all(segments=segments, page_size=3), key=lambda job: job.task) == many_jobs
+
+
+def test_iter_all_segments_in_session(many_jobs):
+    with BaseModelService.session(write_behind=True):
+        JobService.update(many_jobs[0], checked=True)
+        models = {job.task: job for job in JobService.iter_all(segments=4)}
+        assert models["task_00"].checked
+        assert JobService.get(original_issue_url="issue_1.url", task="task_01") is models["task_01"]
+
+
+def test_iter_all_segments_stop_early(many_jobs):
+    table = JobService.table
+    with patch.object(table, "scan", wraps=table.scan) as scan_mock:
+        models = JobService.iter_all(segments=4, page_size=1)
+        assert len(list(islice(models, 3))) == 3
+        models.close()
+    # The segments stopped without scanning the whole table
+    assert scan_mock.call_count < len(many_jobs)
+
+
+def test_iter_all_segments_error(many_jobs, memory_backend):
+    error = ClientError({"Error": {"Code": "InternalServerError", "Message": "Error"}}, "Scan")
+    scan = memory_backend.Table(JobService.table_name).scan
+
+    def failing_scan(**kwargs):
+        if kwargs["Segment"] == 2:
+            raise error
+        return scan(**kwargs)
+
+    with patch.object(JobService, "filter_request", return_value=(failing_scan, {})):
+        with pytest.raises(ClientError, match="InternalServerError"):
+            list(JobService.iter_all(segments=4))
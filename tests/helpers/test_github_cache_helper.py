@@ -0,0 +1,146 @@
+import time
+from unittest.mock import call, patch
+
+import pytest
+from github import Consts
+from github.Auth import Token
+from github.Requester import Requester
+
+from src.helpers import github_cache_helper
+from src.helpers.github_cache_helper import (
+    CachedResponse,
+    CachingRequester,
+    ResponseCache,
+)
+
+
+@pytest.fixture(autouse=True)
+def response_cache(monkeypatch):
+    response_cache = ResponseCache(1000)
+    monkeypatch.setattr(github_cache_helper, "response_cache", response_cache)
+    return response_cache
+
+
+def caching_requester(token="token", installation_id=None):
+    return CachingRequester(
+        auth=Token(token),
+        base_url=Consts.DEFAULT_BASE_URL,
+        timeout=Consts.DEFAULT_TIMEOUT,
+        user_agent=Consts.DEFAULT_USER_AGENT,
+        per_page=Consts.DEFAULT_PER_PAGE,
+        verify=True,
+        retry=None,
+        pool_size=None,
+        installation_id=installation_id,
+    )
+
+
+def test_conditional_request(response_cache):
+    with patch.object(Requester, "requestJson") as request_json:
+        request_json.side_effect = [
+            (200, {"etag": '"v1"', "x-ratelimit-remaining": "10"}, '{"body": 1}'),
+            (304, {"x-ratelimit-remaining": "9"}, ""),
+            (200, {"etag": '"v2"'}, '{"body": 2}'),
+        ]
+        requester = caching_requester()
+        assert requester.requestJsonAndCheck("GET", "/repos/owner/repo/issues/1") == (
+            {"etag": '"v1"', "x-ratelimit-remaining": "10"},
+            {"body": 1},
+        )
+        assert requester.requestJsonAndCheck("GET", "/repos/owner/repo/issues/1") == (
+            {"etag": '"v1"', "x-ratelimit-remaining": "9"},
+            {"body": 1},
+        )
+        assert requester.requestJsonAndCheck("GET", "/repos/owner/repo/issues/1") == ({"etag": '"v2"'}, {"body": 2})
+    assert request_json.call_args_list == [
+        call("GET", "/repos/owner/repo/issues/1", None, {}, None, None),
+        call("GET", "/repos/owner/repo/issues/1", None, {"If-None-Match": '"v1"'}, None, None),
+        call("GET", "/repos/owner/repo/issues/1", None, {"If-None-Match": '"v1"'}, None, None),
+    ]
+    assert (response_cache.hits, response_cache.misses) == (1, 1)
+
+
+def test_not_cached_requests():
+    with patch.object(Requester, "requestJson") as request_json:
+        request_json.side_effect = [
+            (200, {"etag": '"v1"'}, "{}"),
+            (200, {"etag": '"v1"'}, "{}"),
+            (200, {}, "{}"),
+            (200, {}, "{}"),
+        ]
+        caching_requester().requestJsonAndCheck("GET", "/url")
+        # Other installation
+        caching_requester("other").requestJsonAndCheck("GET", "/url")
+        caching_requester().requestJsonAndCheck("PATCH", "/url", input={"state": "closed"})
+        caching_requester().requestJsonAndCheck("GET", "/other_url")
+    assert [c.args[3] for c in request_json.call_args_list] == [{}, {}, None, {}]
+
+
+def test_cached_by_installation(response_cache):
+    with patch.object(Requester, "requestJson") as request_json:
+        request_json.side_effect = [
+            (200, {"etag": '"v1"'}, '{"body": 1}'),
+            (304, {}, ""),
+            (304, {}, ""),
+            (200, {"etag": '"v1"'}, '{"body": 1}'),
+        ]
+        # A new token in each webhook
+        caching_requester("token 1", installation_id=1).requestJsonAndCheck("GET", "/url")
+        assert caching_requester("token 2", installation_id=1).requestJsonAndCheck("GET", "/url") == (
+            {"etag": '"v1"'},
+            {"body": 1},
+        )
+        caching_requester("token 3", installation_id=1).requestJsonAndCheck("GET", "/url")
+        caching_requester("token 4", installation_id=2).requestJsonAndCheck("GET", "/url")
+    assert [c.args[3] for c in request_json.call_args_list] == [
+        {},
+        {"If-None-Match": '"v1"'},
+        {"If-None-Match": '"v1"'},
+        {},
+    ]
+    assert (response_cache.hits, response_cache.misses) == (2, 0)
+
+
+def test_last_modified(response_cache):
+    key = ("token", "/url", (), ())
+    response_cache.put(key, CachedResponse(None, "Mon, 01 Apr 2022 00:00:00 GMT", {}, '{"body": 1}'))
+    with patch.object(Requester, "requestJson", return_value=(304, {}, "")) as request_json:
+        assert caching_requester().requestJsonAndCheck("GET", "/url") == ({}, {"body": 1})
+    assert request_json.call_args.args[3] == {"If-Modified-Since": "Mon, 01 Apr 2022 00:00:00 GMT"}
+
+
+def test_response_cache_size():
+    response_cache = ResponseCache(10)
+    response_cache.put("big", CachedResponse("e", None, {}, "x" * 10))
+    response_cache.put("a", CachedResponse("e", None, {}, "x" * 4))
+    response_cache.put("b", CachedResponse("e", None, {}, "x" * 4))
+    assert response_cache.get("a")
+    response_cache.put("c", CachedResponse("e", None, {}, "x" * 4))
+    assert response_cache.get("big") is None
+    assert response_cache.get("b") is None
+    assert response_cache.get("a") and response_cache.get("c")
+
+
+def test_response_cache_database(tmp_path):
+    database = str(tmp_path / "cache.sqlite3")
+    response_cache = ResponseCache(10, database)
+    response_cache.put(("token", "/url"), CachedResponse("e", None, {"etag": "e"}, "x" * 4))
+    # Another process
+    assert ResponseCache(10, database).get(("token", "/url")) == CachedResponse("e", None, {"etag": "e"}, "x" * 4)
+    response_cache.put("b", CachedResponse("e", None, {}, "x" * 4))
+    response_cache.put("c", CachedResponse("e", None, {}, "x" * 4))
+    other_response_cache = ResponseCache(10, database)
+    assert other_response_cache.get(("token", "/url")) is None
+    assert other_response_cache.get("b") and other_response_cache.get("c")
+    response_cache.clear()
+    assert ResponseCache(10, database).get("b") is None
+
+
+def test_response_cache_database_ttl(tmp_path):
+    database = str(tmp_path / "cache.sqlite3")
+    ResponseCache(10, database).put("a", CachedResponse("e", None, {}, "x"))
+    with patch("src.helpers.github_cache_helper.time.time", return_value=time.time() + 61):
+        assert ResponseCache(10, database, ttl=60).get("a") is None
+        ResponseCache(10, database, ttl=60).put("b", CachedResponse("e", None, {}, "x"))
+    assert ResponseCache(10, database).get("a") is None
+    assert ResponseCache(10, database).get("b")
@@ -0,0 +1,149 @@
+from unittest.mock import Mock, patch
+
+import pytest
+from github import GithubException
+
+from src.helpers.graphql_helper import (
+    create_issues,
+    get_issue_states,
+    get_repository_ids,
+    issue_states_query,
+    split_issue_url,
+)
+
+
+def test_split_issue_url():
+    assert split_issue_url("https://api.github.com/repos/owner/repo/issues/12") == ("owner", "repo", 12)
+
+
+def test_issue_states_query():
+    query, aliases = issue_states_query(
+        [
+            "https://api.github.com/repos/owner/repo/issues/1",
+            "https://api.github.com/repos/other/repo/issues/1",
+            "https://api.github.com/repos/owner/repo/issues/2",
+        ]
+    )
+    assert query == (
+        'query { r0: repository(owner: "owner", name: "repo") { '
+        "i1: issue(number: 1) { id state stateReason } i2: issue(number: 2) { id state stateReason } } "
+        'r1: repository(owner: "other", name: "repo") { i1: issue(number: 1) { id state stateReason } } }'
+    )
+    assert aliases == {
+        "https://api.github.com/repos/owner/repo/issues/1": ("r0", "i1"),
+        "https://api.github.com/repos/other/repo/issues/1": ("r1", "i1"),
+        "https://api.github.com/repos/owner/repo/issues/2": ("r0", "i2"),
+    }
+
+
+def test_get_issue_states():
+    requester = Mock(graphql_url="graphql.url")
+    requester.requestJsonAndCheck.side_effect = [
+        (
+            {},
+            {
+                "data": {
+                    "r0": {
+                        "i1": {"id": "I_1", "state": "OPEN", "stateReason": None},
+                        "i2": {"id": "I_2", "state": "CLOSED", "stateReason": "NOT_PLANNED"},
+                    }
+                }
+            },
+        ),
+        (
+            {},
+            {"data": {"r0": None}, "errors": [{"type": "NOT_FOUND", "message": "Could not resolve to a Repository"}]},
+        ),
+    ]
+    issue_urls = [
+        "https://api.github.com/repos/owner/repo/issues/1",
+        "https://api.github.com/repos/owner/repo/issues/2",
+        "https://api.github.com/repos/owner/repo/issues/1",
+        "https://api.github.com/repos/owner/missing/issues/3",
+    ]
+    with patch("src.helpers.graphql_helper.GRAPHQL_MAX_ALIASES", 2):
+        assert get_issue_states(requester, issue_urls) == {
+            "https://api.github.com/repos/owner/repo/issues/1": {"id": "I_1", "state": "open", "state_reason": None},
+            "https://api.github.com/repos/owner/repo/issues/2": {
+                "id": "I_2",
+                "state": "closed",
+                "state_reason": "not_planned",
+            },
+        }
+    assert requester.requestJsonAndCheck.call_count == 2
+    requester.requestJsonAndCheck.assert_called_with(
+        "POST",
+        "graphql.url",
+        input={"query": issue_states_query(["https://api.github.com/repos/owner/missing/issues/3"])[0]},
+    )
+
+
+def test_get_issue_states_error():
+    requester = Mock(graphql_url="graphql.url")
+    requester.requestJsonAndCheck.return_value = ({}, {"data": None, "errors": [{"type": "RATE_LIMITED"}]})
+    with pytest.raises(GithubException):
+        get_issue_states(requester, ["https://api.github.com/repos/owner/repo/issues/1"])
+
+
+def test_get_repository_ids():
+    requester = Mock(graphql_url="graphql.url")
+    requester.requestJsonAndCheck.return_value = (
+        {},
+        {"data": {"r0": {"id": "R_1"}, "r1": None}, "errors": [{"type": "NOT_FOUND"}]},
+    )
+    assert get_repository_ids(
+        requester,
+        [
+            "https://api.github.com/repos/owner/repo",
+            "https://api.github.com/repos/owner/repo",
+            "https://api.github.com/repos/owner/missing",
+        ],
+    ) == {"https://api.github.com/repos/owner/repo": "R_1"}
+    requester.requestJsonAndCheck.assert_called_once_with(
+        "POST",
+        "graphql.url",
+        input={
+            "query": 'query { r0: repository(owner: "owner", name: "repo") { id } '
+            'r1: repository(owner: "owner", name: "missing") { id } }'
+        },
+    )
+
+
+def test_create_issues():
+    requester = Mock(graphql_url="graphql.url")
+    requester.requestJsonAndCheck.return_value = (
+        {},
+        {
+            "data": {
+                "c0": {"issue": {"number": 9, "repository": {"nameWithOwner": "owner/repo"}}},
+                "c1": None,
+            },
+            "errors": [{"type": "FORBIDDEN", "path": ["c1"], "message": "Issues are disabled"}],
+        },
+    )
+    assert create_issues(requester, [("R_1", 'a "title"'), ("R_2", "title")]) == (["owner/repo#9", None], None)
+    requester.requestJsonAndCheck.assert_called_once_with(
+        "POST",
+        "graphql.url",
+        input={
+            "query": 'mutation { c0: createIssue(input: {repositoryId: "R_1", title: "a \\"title\\""}) '
+            "{ issue { number repository { nameWithOwner } } } "
+            'c1: createIssue(input: {repositoryId: "R_2", title: "title"}) '
+            "{ issue { number repository { nameWithOwner } } } }"
+        },
+    )
+
+
+def test_create_issues_mutation_error():
+    requester = Mock(graphql_url="graphql.url")
+    requester.requestJsonAndCheck.return_value = (
+        {},
+        {
+            "data": {"c0": {"issue": {"number": 9, "repository": {"nameWithOwner": "owner/repo"}}}, "c1": None},
+            "errors": [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}],
+        },
+    )
+    issue_refs, error = create_issues(requester, [("R_1", "title"), ("R_2", "title")])
+    assert issue_refs == ["owner/repo#9", None]
+    assert isinstance(error, GithubException)
+    assert error.data["errors"] == [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}]
@@ -4,10 +4,9 @@ import pytest
 from githubapp import Config
 
 from src.helpers.issue_helper import (
-    get_issue_ref,
     get_tasklist,
-    handle_issue_state,
     has_tasklist,
+    replace_tasks,
     update_issue_comment_status,
 )
 
@@ -68,43 +67,25 @@ def test_get_tasklist(issue_body, expected_tasks, assert_fail_message):
 
 
 @pytest.mark.parametrize(
-    "repository_full_name, number, expected_ref",
+    "issue_body, expected_body",
     [
-        ("owner/repo", 123, "owner/repo#123"),
-        ("another-owner/different-repo", 456, "another-owner/different-repo#456"),
-        ("very/long/repo/name", 789, "very/long/repo/name#789"),
+        (
+            "Text task\n- [ ] task\n- [x] other  \n- [ ] task with more words",
+            "Text task\n- [ ] #1\n- [x] owner/repo#2  \n- [ ] task with more words",
+        ),
+        ("- [ ] fix (a+b)*\r\n- [ ] task", "- [ ] #3\r\n- [ ] #1"),
+        ("- [ ] unknown\n", "- [ ] unknown\n"),
     ],
 )
-def test_get_issue_ref(repository_full_name, number, expected_ref, issue, repository_mock):
-    """Test get_issue_ref with various inputs using parametrize"""
-    repository_mock.full_name = repository_full_name
-    issue.number = number
-    result = get_issue_ref(issue)
-    assert result == expected_ref
+def test_replace_tasks(issue_body, expected_body):
+    replacements = {"task": "#1", "other": "owner/repo#2", "fix (a+b)*": "#3"}
+    assert replace_tasks(issue_body, replacements) == expected_body
 
 
-@pytest.mark.parametrize(
-    "checked, initial_state, expected_state",
-    [
-        (True, "open", "closed"),  # Checked, open issue -> close
-        (True, "closed", "closed"),  # Checked, closed issue -> open
-        (False, "open", "open"),  # Unchecked, open issue -> no change
-        (False, "closed", "open"),  # Unchecked, closed issue -> no change
-    ],
-    ids=lambda value: ((("not " if value is False else "") + "checked") if isinstance(value, bool) else value),
-)
-def test_handle_issue_state(checked, initial_state, expected_state, issue):
-    """Test handle_issue_state with various inputs using parametrize"""
-    issue.state = initial_state
-    result = handle_issue_state(checked, issue)
-
-    # Assert function call and state change (avoid relying on prints)
-    if initial_state != expected_state:
-        issue.edit.assert_called_once_with(state=expected_state)
-        assert result is True
-    else:
-        issue.edit.assert_not_called()
-        assert result is False
+def test_replace_tasks_in_many_lines():
+    issue_body = "\n".join(f"- [ ] task {i}" for i in range(5000))
+    replacements = {f"task {i}": f"#{i}" for i in range(5000)}
+    assert replace_tasks(issue_body, replacements) == "\n".join(f"- [ ] #{i}" for i in range(5000))
 
 
 @pytest.mark.parametrize(
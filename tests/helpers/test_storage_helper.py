@@ -0,0 +1,444 @@
+import datetime
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src.helpers import storage_helper
+from src.helpers.db_helper import BaseModelService
+from src.helpers.storage_helper import MemoryBackend, SQLiteBackend, in_process_storage, storage_backend
+from src.models import IssueJobStatus, Job, JobStatus
+from src.services import IssueJobService, JobService
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, base_model_service_stub, monkeypatch):
+    backend = MemoryBackend() if request.param == "memory" else SQLiteBackend()
+    monkeypatch.setattr(base_model_service_stub, "resource", backend)
+    return backend
+
+
+@pytest.fixture
+def jobs(backend, issue_job):
+    jobs = [
+        Job(
+            original_issue_url=issue_job.issue_url,
+            task=f"task_{i}",
+            checked=False,
+            job_status=JobStatus.DONE if i % 2 else JobStatus.PENDING,
+        )
+        for i in range(5)
+    ]
+    JobService.insert_many(jobs)
+    return jobs
+
+
+def test_create_table(backend):
+    assert JobService.table.creation_date_time
+    assert JobService.active_indexes() == {"original_issue_url-job_status-index": ["original_issue_url", "job_status"]}
+    with pytest.raises(ClientError, match="ResourceInUseException"):
+        JobService.create_table()
+
+
+def test_get_and_filter(jobs, issue_job):
+    IssueJobService.insert_one(issue_job)
+    assert IssueJobService.get(issue_url=issue_job.issue_url) == issue_job
+    assert IssueJobService.get(issue_url="other.url") is None
+    assert JobService.filter(original_issue_url="issue.url") == jobs
+    assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE) == jobs[1::2]
+    assert JobService.filter(original_issue_url="issue.url", task="task_2") == [jobs[2]]
+    assert JobService.filter(job_status=JobStatus.PENDING) == jobs[::2]
+    assert JobService.filter(original_issue_url="other.url") == []
+    assert JobService.count(original_issue_url="issue.url", job_status=JobStatus.PENDING) == 3
+    keys = [{"original_issue_url": "issue.url", "task": task} for task in ["task_3", "other", "task_0"]]
+    assert JobService.batch_get(keys) == [jobs[3], jobs[0]]
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 10])
+def test_pagination(page_size, jobs):
+    assert list(JobService.iter_filter(page_size=page_size)) == jobs
+    assert list(JobService.iter_filter(page_size=page_size, original_issue_url="issue.url", checked=False)) == jobs
+    records = JobService.filter(page_size=page_size, job_status=JobStatus.DONE, fields=["checked"])
+    assert [vars(record) for record in records] == [
+        {"original_issue_url": "issue.url", "task": job.task, "checked": False, "version": 0} for job in jobs[1::2]
+    ]
+
+
+def test_update(jobs):
+    JobService.update(jobs[0], job_status=JobStatus.DONE, title="title")
+    JobService.update_many(jobs[1:3], checked=True)
+    JobService.update_many(jobs[3:], atomic=True, issue_ref="#1")
+    stored = JobService.all()
+    assert [(job.job_status, job.title, job.checked, job.issue_ref, job.version) for job in stored] == [
+        (JobStatus.DONE, "title", False, None, 1),
+        (JobStatus.DONE, None, True, None, 1),
+        (JobStatus.PENDING, None, True, None, 1),
+        (JobStatus.DONE, None, False, "#1", 1),
+        (JobStatus.PENDING, None, False, "#1", 1),
+    ]
+    assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE) == stored[:2] + stored[3:4]
+
+
+@pytest.mark.parametrize("page_size", [None, 2])
+def test_segmented_scan(page_size, backend):
+    items = [{"original_issue_url": f"issue_{i % 7}.url", "task": f"task_{i}"} for i in range(30)]
+    with JobService.table.batch_writer() as writer:
+        for item in items:
+            writer.put_item(Item=item)
+    segments = []
+    for segment in range(3):
+        request = {"Segment": segment, "TotalSegments": 3, "Limit": page_size}
+        segments.append(
+            [
+                item
+                for response in JobService.iter_responses(JobService.table.scan, request)
+                for item in response["Items"]
+            ]
+        )
+    assert sorted(item["task"] for segment_items in segments for item in segment_items) == sorted(
+        item["task"] for item in items
+    )
+    # The items of a partition are in the same segment
+    assert all(
+        len({item["original_issue_url"] for item in segments[0]} & {item["original_issue_url"] for item in other}) == 0
+        for other in segments[1:]
+    )
+    with pytest.raises(ClientError, match="ValidationException"):
+        JobService.table.scan(Segment=3, TotalSegments=3)
+
+
+def test_delete(jobs):
+    # Deleting while paginating, as the archival does
+    for job in JobService.iter_filter(page_size=1):
+        if job.job_status == JobStatus.PENDING:
+            JobService.delete_many([job])
+    assert JobService.all() == jobs[1::2]
+    JobService.table.delete_item(Key={"original_issue_url": "issue.url", "task": "other"})
+    assert JobService.count(original_issue_url="issue.url") == 2
+
+
+def test_filter_creation_order(backend, fixed_datetime_now):
+    for index, task in enumerate(["b", "c", "a"]):
+        fixed_datetime_now.return_value = datetime.datetime(2022, 4, 1, 0, 0, index)
+        JobService.insert_one(Job(original_issue_url="issue.url", task=task, checked=False))
+    assert [job.task for job in JobService.iter_filter(original_issue_url="issue.url")] == ["a", "b", "c"]
+    assert [job.task for job in JobService.filter(original_issue_url="issue.url")] == ["b", "c", "a"]
+    with BaseModelService.session():
+        assert [job.task for job in JobService.filter(original_issue_url="issue.url")] == ["b", "c", "a"]
+
+
+@pytest.mark.parametrize("page_size", [None, 1, 2])
+def test_index_order(backend, issue_job, page_size):
+    issue_jobs = [
+        issue_job.model_copy(update={"issue_url": issue_url, "created_at": created_at})
+        for issue_url, created_at in [("a.url", "2022-04-03"), ("b.url", "2022-04-01"), ("c.url", "2022-04-02")]
+    ]
+    IssueJobService.insert_many(issue_jobs)
+    IssueJobService.update(issue_jobs[2], issue_job_status=IssueJobStatus.DONE)
+    # Sorted by the range key of the index, like DynamoDB
+    assert list(IssueJobService.iter_filter(issue_job_status=IssueJobStatus.PENDING, page_size=page_size)) == [
+        issue_jobs[1],
+        issue_jobs[0],
+    ]
+    response = IssueJobService.table.query(
+        IndexName="issue_job_status-created_at-index",
+        KeyConditionExpression="#issue_job_status=:issue_job_status",
+        ExpressionAttributeNames={"#issue_job_status": "issue_job_status"},
+        ExpressionAttributeValues={":issue_job_status": "pending"},
+        Limit=1,
+    )
+    assert response["LastEvaluatedKey"] == {
+        "issue_job_status": "pending",
+        "created_at": "2022-04-01",
+        "issue_url": "b.url",
+    }
+    # The query of the created_at index is not sorted again, unlike the scans and the other key schemas
+    assert IssueJobService.creation_ordered({"issue_job_status": IssueJobStatus.PENDING})
+    assert not IssueJobService.creation_ordered({})
+    assert not JobService.creation_ordered({"original_issue_url": "issue.url"})
+    with patch("src.helpers.db_helper.sorted", create=True) as sorted_mock:
+        assert IssueJobService.filter(issue_job_status=IssueJobStatus.PENDING) == [issue_jobs[1], issue_jobs[0]]
+    sorted_mock.assert_not_called()
+
+
+def test_copy_from(backend, jobs):
+    JobService.update(jobs[0], job_status=JobStatus.ERROR)
+    source_table = backend.create_table(
+        TableName="job",
+        KeySchema=[{"AttributeName": "task", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "task", "AttributeType": "S"}],
+    )
+    for task in ["task_0", "new"]:
+        source_table.put_item(Item=Job(original_issue_url="issue.url", task=task, checked=False).dynamo_dict())
+    assert JobService.copy_from("job") == 1
+    assert JobService.get(original_issue_url="issue.url", task="task_0").job_status == JobStatus.ERROR
+    assert JobService.count(original_issue_url="issue.url") == 6
+
+
+def test_compare_and_set(backend, issue_job):
+    IssueJobService.insert_one(issue_job)
+    worker_1 = IssueJobService.get(issue_url=issue_job.issue_url)
+    worker_2 = IssueJobService.get(issue_url=issue_job.issue_url)
+    expected = {"issue_job_status": IssueJobStatus.PENDING}
+    assert IssueJobService.compare_and_set(worker_1, expected, issue_job_status=IssueJobStatus.RUNNING)
+    assert not IssueJobService.compare_and_set(worker_2, expected, issue_job_status=IssueJobStatus.RUNNING)
+    assert IssueJobService.get(issue_url=issue_job.issue_url).version == 1
+
+
+def test_transaction_is_atomic(jobs):
+    requests = [JobService.update_request(job, job_status=JobStatus.ERROR) for job in jobs[:2]]
+    requests[1] = JobService.update_request(jobs[1], condition={"version": 5}, job_status=JobStatus.ERROR)
+    with pytest.raises(ClientError, match="TransactionCanceledException"):
+        JobService.table.meta.client.transact_write_items(
+            TransactItems=[{"Update": {"TableName": JobService.table_name, **request}} for request in requests]
+        )
+    assert [job.job_status for job in JobService.all()[:2]] == [JobStatus.PENDING, JobStatus.DONE]
+
+
+def test_index_created_after_items(backend, jobs, caplog):
+    backend.create_table(
+        TableName="old_job",
+        KeySchema=[
+            {"AttributeName": "original_issue_url", "KeyType": "HASH"},
+            {"AttributeName": "task", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "original_issue_url", "AttributeType": "S"},
+            {"AttributeName": "task", "AttributeType": "S"},
+        ],
+    )
+    old_table = backend.Table("old_job")
+    with old_table.batch_writer() as writer:
+        for job in jobs:
+            writer.put_item(Item=job.dynamo_dict())
+    assert old_table.global_secondary_indexes is None
+    with patch.object(JobService.clazz, "table_name", "old_job"), patch.object(JobService, "_table", None):
+        # Not created in the requests
+        assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE) == jobs[1::2]
+        assert "IndexName" not in JobService.filter_request(original_issue_url="issue.url", job_status="DONE")[1]
+        assert old_table.global_secondary_indexes is None
+        assert "Index original_issue_url-job_status-index missing in old_job" in caplog.text
+        assert JobService.provision() == []
+        assert JobService.filter(original_issue_url="issue.url", job_status=JobStatus.DONE) == jobs[1::2]
+        assert "IndexName" in JobService.filter_request(original_issue_url="issue.url", job_status="DONE")[1]
+
+
+def test_sqlite_persistence(tmp_path):
+    database = str(tmp_path / "bartholomew.sqlite3")
+    SQLiteBackend(database).create_table(
+        TableName="job",
+        KeySchema=[{"AttributeName": "task", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "task", "AttributeType": "S"}],
+    ).put_item(Item={"task": "task_0", "checked": True})
+    assert SQLiteBackend(database).Table("job").get_item(Key={"task": "task_0"}) == {
+        "Item": {"task": "task_0", "checked": True}
+    }
+
+
+@pytest.fixture
+def shared_backends(monkeypatch):
+    monkeypatch.delenv("STORAGE_BACKEND", raising=False)
+    monkeypatch.setattr(storage_helper, "_backends", {})
+    with patch("src.helpers.storage_helper.boto3") as boto3_mock:
+        yield boto3_mock
+
+
+@pytest.mark.parametrize(
+    "env, backend_class",
+    [
+        ({"STORAGE_BACKEND": "memory"}, MemoryBackend),
+        ({"STORAGE_BACKEND": "sqlite", "SQLITE_DATABASE": ":memory:"}, SQLiteBackend),
+    ],
+    ids=["memory", "sqlite"],
+)
+def test_storage_backend(env, backend_class, shared_backends, monkeypatch):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    backend = storage_backend()
+    assert isinstance(backend, backend_class)
+    assert storage_backend() is backend
+    assert in_process_storage() == (backend_class is MemoryBackend)
+
+
+def test_storage_backend_dynamodb(shared_backends, monkeypatch):
+    monkeypatch.setenv("DYNAMODB_ENDPOINT_URL", "http://localhost:8000")
+    monkeypatch.setenv("DYNAMODB_MAX_POOL_CONNECTIONS", "50")
+    monkeypatch.setenv("DYNAMODB_RETRY_MODE", "adaptive")
+    resource = storage_backend()
+    assert storage_backend() is resource
+    session_mock = shared_backends.session.Session
+    session_mock.assert_called_once()
+    assert resource is session_mock.return_value.resource.return_value
+    kwargs = session_mock.return_value.resource.call_args.kwargs
+    assert (kwargs["region_name"], kwargs["endpoint_url"]) == ("us-east-1", "http://localhost:8000")
+    config = kwargs["config"]
+    assert (config.max_pool_connections, config.tcp_keepalive, config.connect_timeout) == (50, True, 2)
+    assert config.retries == {"max_attempts": 3, "mode": "adaptive"}
+
+
+def test_reset_after_fork(shared_backends, monkeypatch):
+    storage_backend()
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    memory_backend = storage_backend()
+    monkeypatch.setenv("STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_DATABASE", ":memory:")
+    sqlite_backend = storage_backend()
+    storage_helper._reset_after_fork()
+    assert storage_backend() is not sqlite_backend
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    assert storage_backend() is memory_backend
+    monkeypatch.delenv("STORAGE_BACKEND")
+    storage_backend()
+    assert shared_backends.session.Session.call_count == 2
+
+
+def test_storage_backend_unknown(monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "mongodb")
+    with pytest.raises(ValueError):
+        storage_backend()
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("#a=:one or #b=:one and #c=:one", True),
+        ("(#a=:one or #b=:one) and #c=:one", False),
+        ("NOT #a=:two and #b=:two", True),
+        ("NOT #a=:one and #b=:two", False),
+        ("not (#a=:two or attribute_exists(#d))", True),
+        ("attribute_not_exists(#d) and #c<>:one", True),
+        ("#d<>:one and #d=:one", False),
+        ("#b > #a AND :two >= #b", True),
+    ],
+)
+def test_evaluate_condition(expression, expected):
+    names = {"#a": "a", "#b": "b", "#c": "c", "#d": "d"}
+    assert (
+        storage_helper.evaluate_condition(expression, {"a": 1, "b": 2, "c": 3}, names, {":one": 1, ":two": 2})
+        is expected
+    )
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["#a=:one and", "(#a=:one", "#a in (:one)", "begins_with(#a, :one)", "#a=:one #b=:one", "#a=:one; drop", ""],
+)
+def test_evaluate_condition_unsupported(expression):
+    with pytest.raises(ValueError):
+        storage_helper.evaluate_condition(expression, {}, {"#a": "a", "#b": "b"}, {":one": 1})
+
+
+def test_key_conditions():
+    names = {"#a": "a", "#b": "b"}
+    assert storage_helper.key_conditions("#a=:one and #b=:two", names, {":one": 1, ":two": 2}) == {"a": 1, "b": 2}
+    for expression in ("#a=:one or #b=:two", "#a>:one", ":one=#a"):
+        with pytest.raises(ValueError):
+            storage_helper.key_conditions(expression, names, {":one": 1, ":two": 2})
+
+
+def test_apply_update():
+    item = {"a": 1, "b": {"c": 2}, "d": {"x"}, "e": 5}
+    names = {"#a": "a", "#b": "b", "#c": "c", "#d": "d", "#e": "e", "#f": "f"}
+    updated = storage_helper.apply_update(
+        item, "SET #a=:one, #b.#c = :one ADD #d :set, #f :one REMOVE #e", names, {":one": 1, ":set": {"y"}}
+    )
+    assert item == {"a": 1, "b": {"c": 1}, "d": {"x", "y"}, "f": 1}
+    assert updated == {"a", "b", "d", "e", "f"}
+    for expression in ("SET #a", "SET #a=:one ADD", "DELETE #a :one", "#a=:one"):
+        with pytest.raises(ValueError):
+            storage_helper.apply_update(item, expression, names, {":one": 1})
+
+
+@pytest.fixture(params=["document", "compressed"])
+def document_issue_job(request, backend, issue_job, monkeypatch):
+    monkeypatch.setenv("TASKS_STORAGE", request.param)
+    issue_job = issue_job.model_copy(update=JobService.new_document())
+    IssueJobService.insert_one(issue_job)
+    return issue_job
+
+
+def test_update_paths(backend, issue_job):
+    issue_job.tasks = {"task_1": {"checked": False, "title": "title"}}
+    IssueJobService.insert_one(issue_job)
+    with patch("src.helpers.db_helper.UPDATE_MAX_PATHS", 2):
+        IssueJobService.update_paths(
+            issue_job,
+            {("tasks", "task_1", "checked"): True, ("tasks", "task.2"): {"checked": False}},
+            [("tasks", "task_1", "title"), ("tasks", "task_1", "missing")],
+        )
+        with pytest.raises(ValueError):
+            IssueJobService.update_paths(
+                issue_job, {("title",): "other title"}, [("tasks",), ("expires_at",)], condition={"title": "title"}
+            )
+    expected = {"task_1": {"checked": True}, "task.2": {"checked": False}}
+    assert issue_job.tasks == expected
+    assert IssueJobService.get(issue_url=issue_job.issue_url).tasks == expected
+    assert issue_job.version == 0
+    with pytest.raises(ClientError, match="ConditionalCheckFailedException"):
+        IssueJobService.update_paths(issue_job, {("title",): "other title"}, condition={"title": "wrong"})
+    assert IssueJobService.get(issue_url=issue_job.issue_url).title == "title"
+
+
+def test_tasks_document(document_issue_job):
+    jobs = [
+        Job(original_issue_url=document_issue_job.issue_url, task=f"task_{i}", checked=bool(i % 2)) for i in range(4)
+    ]
+    JobService.insert_many(jobs[:3])
+    JobService.insert_one(jobs[3])
+    assert JobService.all() == []
+    assert JobService.filter(original_issue_url=document_issue_job.issue_url) == jobs
+    assert JobService.get(original_issue_url=document_issue_job.issue_url, task="task_1") == jobs[1]
+
+    JobService.update_many(jobs[:2], job_status=JobStatus.DONE, expires_at=1000)
+    JobService.update(jobs[0], job_status=JobStatus.PENDING, expires_at=None)
+    stored = IssueJobService.get(issue_url=document_issue_job.issue_url)
+    assert JobService.read_document(stored)["task_0"] == {"checked": False}
+    assert JobService.filter(original_issue_url=stored.issue_url, job_status=JobStatus.DONE) == [jobs[1]]
+    assert JobService.count(original_issue_url=stored.issue_url, checked=True) == 2
+    records = JobService.filter(original_issue_url=stored.issue_url, checked=False, fields=["job_status"], limit=1)
+    assert [(record.task, record.job_status) for record in records] == [("task_0", JobStatus.PENDING)]
+    with pytest.raises(ValueError):
+        JobService.update(jobs[0], condition={"version": 0}, checked=True)
+    with pytest.raises(ValueError):
+        JobService.update_many(jobs[:2], atomic=True, checked=True)
+
+    JobService.delete_many(jobs[:3])
+    assert JobService.filter(original_issue_url=stored.issue_url) == [jobs[3]]
+
+
+def test_tasks_document_moved_to_rows(document_issue_job, monkeypatch):
+    monkeypatch.setenv("TASKS_DOCUMENT_MAX_TASKS", "3")
+    jobs = [Job(original_issue_url=document_issue_job.issue_url, task=f"task_{i}", checked=False) for i in range(4)]
+    JobService.insert_many(jobs[:2])
+    JobService.update(jobs[0], job_status=JobStatus.DONE)
+    JobService.insert_many(jobs[2:])
+    stored = IssueJobService.get(issue_url=document_issue_job.issue_url)
+    assert (stored.tasks, stored.compressed_tasks) == (None, None)
+    assert JobService.all() == jobs
+    assert JobService.filter(original_issue_url=stored.issue_url, job_status=JobStatus.DONE) == [jobs[0]]
+
+
+def test_rows_storage_remembered(backend, issue_job, monkeypatch):
+    monkeypatch.setenv("TASKS_STORAGE", "document")
+    IssueJobService.insert_one(issue_job)
+    with patch.object(IssueJobService, "get", wraps=IssueJobService.get) as get_mock:
+        JobService.insert_one(Job(original_issue_url=issue_job.issue_url, task="task", checked=False))
+        assert JobService.count(original_issue_url=issue_job.issue_url) == 1
+        assert len(JobService.filter(original_issue_url=issue_job.issue_url)) == 1
+    get_mock.assert_called_once()
+    # A new IssueJob of the issue may have a document
+    IssueJobService.insert_one(issue_job.model_copy(update=JobService.new_document()))
+    JobService.insert_one(Job(original_issue_url=issue_job.issue_url, task="other", checked=False))
+    assert len(JobService.all()) == 1
+
+
+def test_compressed_tasks_document_changed_concurrently(backend, issue_job, monkeypatch):
+    monkeypatch.setenv("TASKS_STORAGE", "compressed")
+    IssueJobService.insert_one(issue_job.model_copy(update=JobService.new_document()))
+    worker_1 = IssueJobService.get(issue_url=issue_job.issue_url)
+    worker_2 = IssueJobService.get(issue_url=issue_job.issue_url)
+    JobService.write_document(worker_1, {("task_1",): {"checked": True}})
+    JobService.write_document(worker_2, {("task_2",): {"checked": False}})
+    stored = IssueJobService.get(issue_url=issue_job.issue_url)
+    assert JobService.read_document(stored) == {"task_1": {"checked": True}, "task_2": {"checked": False}}
+    assert stored.compressed_tasks == worker_2.compressed_tasks
@@ -1,21 +1,32 @@
+import gzip
+import json
 import random
-from unittest.mock import ANY, Mock, call, patch
+import threading
+from unittest.mock import ANY, AsyncMock, Mock, call, patch
 
 import pytest
-from github import Consts, UnknownObjectException
+from github import Consts, GithubException, UnknownObjectException
 from githubapp import Config
 from githubapp.events import IssueEditedEvent, IssueOpenedEvent
 from githubapp.events.issues import IssueClosedEvent
 
+from config import SETTINGS
+from src.helpers.db_helper import BaseModelService
+from src.helpers.storage_helper import MemoryBackend
 from src.helpers.text_helper import markdown_progress
 from src.managers.issue_manager import (
+    AsyncJobPipeline,
+    JobPipeline,
     _get_repository,
     _get_repository_url_and_title,
     _instantiate_github_class,
+    archive_finished_jobs,
     close_issue_if_all_checked,
     close_sub_tasks,
     get_or_create_issue_job,
+    github_executor,
     handle_task_list,
+    job_pipeline_class,
     manage,
     process_create_issue,
     process_jobs,
@@ -23,6 +34,7 @@ from src.managers.issue_manager import (
     process_update_issue_body,
     process_update_issue_status,
     process_update_progress,
+    set_issue_job_to_done,
     set_jobs_to_done,
 )
 from src.models import IssueJob, IssueJobStatus, Job, JobStatus
@@ -41,6 +53,30 @@ def github():
         yield mock
 
 
+@pytest.fixture
+def issue_states():
+    with patch("src.managers.issue_manager.get_issue_states") as mock:
+        mock.side_effect = lambda _requester, issue_urls: {issue_url: {"state": "open"} for issue_url in issue_urls}
+        yield mock
+
+
+@pytest.fixture
+def repository_ids():
+    with patch("src.managers.issue_manager.get_repository_ids") as mock:
+        mock.side_effect = lambda _requester, repository_urls: {url: f"R_{url}" for url in repository_urls}
+        yield mock
+
+
+@pytest.fixture
+def created_issues():
+    with patch("src.managers.issue_manager.create_issues") as mock:
+        mock.side_effect = lambda _requester, issues: (
+            [f"owner/repo#{9 + index}" for index in range(len(issues))],
+            None,
+        )
+        yield mock
+
+
 @pytest.fixture
 def issue_helper(request):
     with patch("src.managers.issue_manager.issue_helper") as mock:
@@ -71,6 +107,8 @@ def test_get_or_create_issue_job(issue_job_service_output, issue_job_exists, eve
             hook_installation_target_id=event.hook_installation_target_id,
             installation_id=event.installation_id,
             milestone_url="issue.milestone.url if issue.milestone else None",
+            total_tasks=0,
+            done_tasks=0,
         )
         issue_helper.update_issue_comment_status.assert_called_once()
 
@@ -143,7 +181,7 @@ def test_handle_task_list(event, issue, tasks, existing_tasks: list[dict], issue
 
     issue_helper.has_tasklist.return_value = bool(tasks)
     issue_helper.get_tasklist.return_value = tasks
-    issue_job = Mock(issue_job_status=issue_job_status)
+    issue_job = Mock(issue_job_status=issue_job_status, version=0, total_tasks=0, done_tasks=0)
     with patch("src.managers.issue_manager.get_or_create_issue_job", return_value=issue_job):
         result = handle_task_list(event)
         if tasks:
@@ -153,6 +191,7 @@ def test_handle_task_list(event, issue, tasks, existing_tasks: list[dict], issue
         assert issue_job.issue_job_status != IssueJobStatus.DONE
     jobs = JobService.all()
     assert len(jobs) == len(tasks)
+    assert issue_job.total_tasks == len(tasks) - len(existing_tasks)
     for job, task in zip(jobs, tasks):
         assert (job.issue_ref or job.task) == task[0]
         assert job.original_issue_url == event.issue.url
@@ -225,7 +264,7 @@ def test_get_repository(repository_name, expected_repository_name, issue_job):
 def test_instantiate_github_class(_get_auth, github):
     clazz = Mock()
 
-    with patch("src.managers.issue_manager.Requester") as requester:
+    with patch("src.managers.issue_manager.CachingRequester") as requester:
         _instantiate_github_class(clazz, 1, 2, "url")
         requester.assert_called_once_with(
             auth=_get_auth.return_value,
@@ -235,7 +274,8 @@ def test_instantiate_github_class(_get_auth, github):
             per_page=Consts.DEFAULT_PER_PAGE,
             verify=True,
             retry=github.GithubRetry(),
-            pool_size=None,
+            pool_size=SETTINGS["GITHUB_MAX_WORKERS"],
+            installation_id=2,
         )
         clazz.assert_called_once_with(
             requester=requester(),
@@ -263,6 +303,52 @@ def test_set_jobs_to_done(issue_job):
         assert job.job_status == JobStatus.DONE
 
 
+def test_set_issue_job_to_done(issue_job, monkeypatch):
+    monkeypatch.setenv("FINISHED_JOBS_TTL_DAYS", "2")
+    IssueJobService.insert_one(issue_job)
+    JobService.insert_one(Job(task="task1", original_issue_url=issue_job.issue_url, checked=True))
+    with patch("src.managers.issue_manager.time.time", return_value=1000.5):
+        set_issue_job_to_done(issue_job)
+    expires_at = 1000 + 2 * 24 * 60 * 60
+    assert (issue_job.issue_job_status, issue_job.expires_at) == (IssueJobStatus.DONE, expires_at)
+    assert [job.expires_at for job in JobService.all()] == [expires_at]
+
+
+def test_handle_task_list_reactivates_expiring_jobs(event, issue_job, issue_helper):
+    issue_job.issue_job_status = IssueJobStatus.DONE
+    issue_job.expires_at = 1000
+    IssueJobService.insert_one(issue_job)
+    JobService.insert_one(Job(task="task1", original_issue_url=event.issue.url, checked=True, expires_at=1000))
+    issue_helper.get_tasklist.return_value = [("task1", True)]
+    handle_task_list(event)
+    assert [job.expires_at for job in JobService.all()] == [None]
+    stored = IssueJobService.get(issue_url=issue_job.issue_url)
+    assert (stored.issue_job_status, stored.expires_at) == (IssueJobStatus.PENDING, None)
+
+
+def test_handle_task_list_tasks_document(event, issue_helper, base_model_service_stub, monkeypatch):
+    monkeypatch.setattr(base_model_service_stub, "resource", MemoryBackend())
+    monkeypatch.setenv("TASKS_STORAGE", "document")
+    issue_helper.update_issue_comment_status.return_value = Mock(id=1)
+    issue_helper.get_tasklist.return_value = [("a task", False), ("#2", True)]
+    issue_job = handle_task_list(event)
+    process_pending_jobs(issue_job)
+    assert JobService.all() == []
+    stored = IssueJobService.get(issue_url=event.issue.url)
+    assert stored.tasks == {
+        "#2": {"checked": True, "job_status": "update_issue_status", "issue_url": "repository.url/issues/2"},
+        "a task": {
+            "checked": False,
+            "job_status": "create_issue",
+            "repository_url": "repository.url",
+            "title": "a task",
+        },
+    }
+    issue_helper.get_tasklist.return_value = [("a task", False), ("#2", True), ("other task", False)]
+    handle_task_list(event)
+    assert JobService.count(original_issue_url=event.issue.url, job_status=JobStatus.PENDING) == 1
+
+
 @pytest.mark.parametrize(
     "issue_job_status,expected_return",
     [
@@ -282,10 +368,7 @@ def test_process_jobs(issue_job_status, expected_return, issue_job):
         IssueJobService.insert_one(issue_job)
 
     with (
-        patch("src.managers.issue_manager.process_update_issue_body"),
-        patch("src.managers.issue_manager.process_pending_jobs"),
-        patch("src.managers.issue_manager.process_update_issue_status"),
-        patch("src.managers.issue_manager.process_create_issue"),
+        patch("src.managers.issue_manager.JobPipeline"),
         patch("src.managers.issue_manager.close_issue_if_all_checked"),
         patch("src.managers.issue_manager.process_update_progress"),
     ):
@@ -294,6 +377,17 @@ def test_process_jobs(issue_job_status, expected_return, issue_job):
             assert issue_job.issue_job_status == expected_return
 
 
+def test_process_jobs_taken_by_other_worker(issue_job):
+    IssueJobService.insert_one(issue_job)
+    other_worker_issue_job = IssueJobService.get(issue_url=issue_job.issue_url)
+    with patch("src.managers.issue_manager.IssueJobService.get", return_value=issue_job):
+        IssueJobService.update(other_worker_issue_job, issue_job_status=IssueJobStatus.RUNNING)
+        with patch("src.managers.issue_manager.JobPipeline") as job_pipeline_mock:
+            assert process_jobs(issue_job.issue_url) == IssueJobStatus.RUNNING
+            job_pipeline_mock.assert_not_called()
+    assert IssueJobService.all()[0].version == 1
+
+
 @pytest.mark.parametrize(
     "task,expected_job_update_values,_get_repository_return",
     [
@@ -354,16 +448,19 @@ def test_process_pending_jobs(task, expected_job_update_values, _get_repository_
         ("open", True, JobStatus.ERROR),
     ],
 )
-def test_process_update_issue_status(issue_state, checked, issue_job, final_job_status):
+def test_process_update_issue_status(issue_state, checked, issue_job, final_job_status, issue_states):
     JobService.insert_one(
         Job(
             original_issue_url=issue_job.issue_url,
             task="task",
             checked=checked,
             job_status=JobStatus.UPDATE_ISSUE_STATUS,
+            issue_url="issue_url",
         )
     )
-    issue = Mock(state=issue_state)
+    issue = Mock()
+    issue_states.side_effect = None
+    issue_states.return_value = {"issue_url": {"state": issue_state}}
     with (patch("src.managers.issue_manager._instantiate_github_class", return_value=issue),):
         if final_job_status == JobStatus.ERROR:
             issue.edit.side_effect = UnknownObjectException(0)
@@ -376,32 +473,94 @@ def test_process_update_issue_status(issue_state, checked, issue_job, final_job_
             issue.edit.assert_not_called()
         job = JobService.all()[0]
         assert job.job_status == final_job_status
+    issue_states.assert_called_once_with(ANY, ["issue_url"])
 
 
-def test_process_create_issue(issue_job):
+def test_process_update_issue_status_not_found(issue_job, issue_states):
     JobService.insert_one(
         Job(
             original_issue_url=issue_job.issue_url,
             task="task",
-            checked=False,
-            job_status=JobStatus.CREATE_ISSUE,
-            title="title",
+            checked=True,
+            job_status=JobStatus.UPDATE_ISSUE_STATUS,
+            issue_url="issue_url",
         )
     )
-    repository = Mock()
+    issue_states.side_effect = None
+    issue_states.return_value = {}
+    with patch("src.managers.issue_manager._instantiate_github_class") as instantiate_github_class:
+        process_update_issue_status(issue_job)
+    instantiate_github_class.assert_not_called()
+    assert JobService.all()[0].job_status == JobStatus.ERROR
+
+
+def test_process_create_issue(issue_job, repository_ids, created_issues):
+    JobService.insert_many(
+        [
+            Job(
+                original_issue_url=issue_job.issue_url,
+                task=f"task{index}",
+                checked=False,
+                job_status=JobStatus.CREATE_ISSUE,
+                title=f"title{index}",
+                repository_url="missing.url" if index == 3 else "repository.url",
+            )
+            for index in range(5)
+        ]
+    )
+    repository_ids.side_effect = lambda _requester, repository_urls: {"repository.url": "R_1"}
+    created_issues.side_effect = [(["owner/repo#9", None], None), (["owner/repo#11", "owner/repo#12"], None)]
     with (
-        patch(
-            "src.managers.issue_manager._instantiate_github_class",
-            return_value=repository,
-        ),
+        patch("src.managers.issue_manager.graphql_helper.GRAPHQL_MAX_MUTATIONS", 2),
+        patch.object(Config.issue_manager, "create_issues_from_tasklist", True),
+        patch.object(JobService, "bulk_update", wraps=JobService.bulk_update) as bulk_update,
     ):
         process_create_issue(issue_job)
-        repository.create_issue.assert_called_once_with(title="title")
-        job = JobService.all()[0]
-        assert job.job_status == JobStatus.UPDATE_ISSUE_BODY
+    repository_ids.assert_called_once_with(ANY, ["repository.url"] * 3 + ["missing.url", "repository.url"])
+    assert created_issues.call_args_list == [
+        call(ANY, [("R_1", "title0"), ("R_1", "title1")]),
+        call(ANY, [("R_1", "title2"), ("R_1", "title4")]),
+    ]
+    # Written after each mutation
+    assert bulk_update.call_count == 2
+    assert {job.task: (job.job_status, job.issue_ref) for job in JobService.all()} == {
+        "task0": (JobStatus.UPDATE_ISSUE_BODY, "owner/repo#9"),
+        "task1": (JobStatus.ERROR, None),
+        "task2": (JobStatus.UPDATE_ISSUE_BODY, "owner/repo#11"),
+        "task3": (JobStatus.ERROR, None),
+        "task4": (JobStatus.UPDATE_ISSUE_BODY, "owner/repo#12"),
+    }
+
+
+def test_process_create_issue_mutation_error(issue_job, repository_ids, created_issues):
+    JobService.insert_many(
+        [
+            Job(
+                original_issue_url=issue_job.issue_url,
+                task=f"task{index}",
+                checked=False,
+                job_status=JobStatus.CREATE_ISSUE,
+                title=f"title{index}",
+                repository_url="repository.url",
+            )
+            for index in range(2)
+        ]
+    )
+    # The first issue was created before the mutation failed
+    created_issues.side_effect = None
+    created_issues.return_value = (["owner/repo#9", None], GithubException(400))
+    with (
+        patch.object(Config.issue_manager, "create_issues_from_tasklist", True),
+        pytest.raises(GithubException),
+    ):
+        process_create_issue(issue_job)
+    assert {job.task: (job.job_status, job.issue_ref) for job in JobService.all()} == {
+        "task0": (JobStatus.UPDATE_ISSUE_BODY, "owner/repo#9"),
+        "task1": (JobStatus.CREATE_ISSUE, None),
+    }
 
 
-def test_process_not_create_issue(issue_job):
+def test_process_not_create_issue(issue_job, created_issues):
     JobService.insert_one(
         Job(
             original_issue_url=issue_job.issue_url,
@@ -420,12 +579,13 @@ def test_process_not_create_issue(issue_job):
     ):
         Config.issue_manager.create_issues_from_tasklist = False
         process_create_issue(issue_job)
-        repository.create_issue.assert_not_called()
+        created_issues.assert_not_called()
         job = JobService.all()[0]
         assert job.job_status == JobStatus.DONE
 
 
-def test_process_update_issue_body(issue_job):
+@pytest.mark.parametrize("issue_ref", ["owner/repo#9", None])
+def test_process_update_issue_body(issue_job, issue_ref):
     JobService.insert_many(
         [
             Job(
@@ -434,11 +594,12 @@ def test_process_update_issue_body(issue_job):
                 checked=False,
                 job_status=JobStatus.UPDATE_ISSUE_BODY,
                 title="title",
+                issue_ref=issue_ref and f"{issue_ref}{i}",
             )
             for i in range(5)
         ]
     )
-    issue = Mock(body="body")
+    issue = Mock(body="body\n" + "\n".join(f"- [ ] task_{i}" for i in range(5)))
     with (
         patch(
             "src.managers.issue_manager._instantiate_github_class",
@@ -448,7 +609,174 @@ def test_process_update_issue_body(issue_job):
         process_update_issue_body(issue_job)
         for job in JobService.all():
             assert job.job_status == JobStatus.DONE
-        issue.edit.assert_called_once()
+        if issue_ref:
+            issue.edit.assert_called_once_with(body="body\n" + "\n".join(f"- [ ] owner/repo#9{i}" for i in range(5)))
+        else:
+            # The body doesn't change
+            issue.edit.assert_not_called()
+
+
+def test_job_pipeline(issue_job, issue_states, repository_ids, created_issues):
+    issue_job.total_tasks = 4
+    issue_job.done_tasks = 1
+    IssueJobService.insert_one(issue_job)
+    JobService.insert_many(
+        [
+            Job(original_issue_url=issue_job.issue_url, task="#1", checked=True),
+            Job(original_issue_url=issue_job.issue_url, task="task", checked=False),
+            Job(original_issue_url=issue_job.issue_url, task="done", checked=False, job_status=JobStatus.DONE),
+            Job(
+                original_issue_url=issue_job.issue_url,
+                task="left",
+                checked=True,
+                job_status=JobStatus.UPDATE_ISSUE_BODY,
+                issue_ref="#5",
+            ),
+        ]
+    )
+    github_object = Mock(body="- [x] #1\n- [ ] task\n- [x] left")
+    with (
+        patch("src.managers.issue_manager._instantiate_github_class", return_value=github_object),
+        patch("src.managers.issue_manager._get_repository", return_value=None),
+        patch("src.managers.issue_manager.issue_helper.update_issue_comment_status"),
+        patch.object(JobService, "filter", wraps=JobService.filter) as filter_mock,
+        patch.object(Config.issue_manager, "create_issues_from_tasklist", True),
+    ):
+        with BaseModelService.session(write_behind=True):
+            loaded = IssueJobService.get(issue_url=issue_job.issue_url)
+            JobPipeline(loaded, batch_size=2).run()
+        filter_mock.assert_called_once()
+    created_issues.assert_called_once_with(ANY, [(f"R_{issue_job.repository_url}", "task")])
+    github_object.edit.assert_any_call(body="- [x] #1\n- [ ] owner/repo#9\n- [x] #5")
+    assert {job.task: job.job_status for job in JobService.all()} == dict.fromkeys(
+        ["#1", "task", "done", "left"], JobStatus.DONE
+    )
+    assert IssueJobService.get(issue_url=issue_job.issue_url).done_tasks == 4
+
+
+def test_job_pipeline_github_errors(issue_job, issue_states):
+    IssueJobService.insert_one(issue_job)
+    JobService.insert_many(
+        [
+            Job(
+                original_issue_url=issue_job.issue_url,
+                task=f"#{number}",
+                checked=True,
+                job_status=JobStatus.UPDATE_ISSUE_STATUS,
+                issue_url=f"repository.url/issues/{number}",
+            )
+            for number in range(1, 4)
+        ]
+    )
+    issues = {}
+
+    def instantiate_github_class_mock(_clazz, _hook_id, _installation_id, issue_url):
+        issues[issue_url] = Mock(state="open")
+        if issue_url.endswith("2"):
+            issues[issue_url].edit.side_effect = UnknownObjectException(0)
+        elif issue_url.endswith("3"):
+            issues[issue_url].edit.side_effect = ValueError("error")
+        return issues[issue_url]
+
+    with (
+        patch("src.managers.issue_manager._instantiate_github_class", side_effect=instantiate_github_class_mock),
+        pytest.raises(ValueError, match="error"),
+    ):
+        JobPipeline(issue_job, {JobStatus.UPDATE_ISSUE_STATUS}).run()
+    assert len(issues) == 3
+    assert {job.task: job.job_status for job in JobService.all()} == {
+        "#1": JobStatus.DONE,
+        "#2": JobStatus.ERROR,
+        "#3": JobStatus.UPDATE_ISSUE_STATUS,
+    }
+
+
+def test_async_job_pipeline(issue_job, issue_states, repository_ids, created_issues):
+    IssueJobService.insert_one(issue_job)
+    JobService.insert_many(
+        [
+            Job(
+                original_issue_url=issue_job.issue_url,
+                task=f"#{number}",
+                checked=True,
+                job_status=JobStatus.UPDATE_ISSUE_STATUS,
+                issue_url=f"https://api.github.com/repos/owner/repo/issues/{number}",
+            )
+            for number in range(1, 4)
+        ]
+        + [Job(original_issue_url=issue_job.issue_url, task="task", checked=False, job_status=JobStatus.PENDING)]
+    )
+    client = Mock()
+    client.__aenter__ = AsyncMock(return_value=client)
+    client.__aexit__ = AsyncMock()
+
+    blocking_threads = set()
+
+    def get_issue_states(_requester, issue_urls):
+        blocking_threads.add(threading.current_thread())
+        return {issue_url: {"state": "closed" if issue_url.endswith("3") else "open"} for issue_url in issue_urls}
+
+    issue_states.side_effect = get_issue_states
+    write = JobService.bulk_update
+
+    def bulk_update(*args, **kwargs):
+        blocking_threads.add(threading.current_thread())
+        write(*args, **kwargs)
+
+    async def edit_issue(_installation_id, _authorization, url, **_fields):
+        if url.endswith("2"):
+            raise UnknownObjectException(404)
+
+    client.edit_issue = AsyncMock(side_effect=edit_issue)
+    github_object = Mock(body="- [x] #1\n- [x] #2\n- [x] #3\n- [ ] task")
+    with (
+        patch("src.managers.issue_manager.AsyncGithubClient", return_value=client) as client_class,
+        patch("src.managers.issue_manager._instantiate_github_class", return_value=github_object),
+        patch("src.managers.issue_manager._get_repository", return_value=None),
+        patch("src.managers.issue_manager.issue_helper.update_issue_comment_status"),
+        patch.object(Config.issue_manager, "create_issues_from_tasklist", True),
+        patch.object(JobService, "bulk_update", side_effect=bulk_update),
+        patch("src.managers.issue_manager.github_executor") as github_executor,
+    ):
+        AsyncJobPipeline(issue_job).run()
+    github_executor.assert_not_called()
+    client_class.assert_called_once_with(SETTINGS["GITHUB_MAX_WORKERS"])
+    # The blocking calls don't run in the event loop
+    assert blocking_threads and threading.main_thread() not in blocking_threads
+    client.edit_issue.assert_has_awaits(
+        [
+            call(1, ANY, "https://api.github.com/repos/owner/repo/issues/1", state="closed"),
+            call(1, ANY, "https://api.github.com/repos/owner/repo/issues/2", state="closed"),
+        ],
+        any_order=True,
+    )
+    assert client.edit_issue.await_count == 2
+    created_issues.assert_called_once_with(ANY, [(f"R_{issue_job.repository_url}", "task")])
+    github_object.edit.assert_called_once_with(body="- [x] #1\n- [x] #2\n- [x] #3\n- [ ] owner/repo#9")
+    assert {job.task: job.job_status for job in JobService.all()} == {
+        "#1": JobStatus.DONE,
+        "#2": JobStatus.ERROR,
+        "#3": JobStatus.DONE,
+        "task": JobStatus.DONE,
+    }
+
+
+@pytest.mark.parametrize(
+    "engine, pipeline_class", [(None, JobPipeline), ("sync", JobPipeline), ("async", AsyncJobPipeline)]
+)
+def test_job_pipeline_class(monkeypatch, engine, pipeline_class):
+    if engine:
+        monkeypatch.setenv("GITHUB_ENGINE", engine)
+    assert job_pipeline_class() is pipeline_class
+
+
+def test_github_executor(monkeypatch):
+    monkeypatch.setattr("src.managers.issue_manager._github_executors", {})
+    monkeypatch.setenv("GITHUB_MAX_WORKERS", "2")
+    executor = github_executor(1)
+    assert executor is github_executor(1)
+    assert executor is not github_executor(2)
+    assert executor._max_workers == 2
 
 
 @pytest.mark.parametrize(
@@ -526,24 +854,50 @@ def test_process_update_progress(issue_job, issue_job_status, issue_helper):
             )
 
 
-def test_close_sub_tasks(event, issue_helper):
+def test_process_update_progress_counters(issue_job, issue_helper):
+    issue_job.issue_job_status = IssueJobStatus.RUNNING
+    issue_job.total_tasks = 0
+    issue_job.done_tasks = 0
+    IssueJobService.insert_one(issue_job)
+    jobs = [Job(original_issue_url=issue_job.issue_url, task=f"task_{i}", checked=False) for i in range(4)]
+    JobService.insert_many(jobs)
+    IssueJobService.increment(issue_job, total_tasks=4)
+    issue = Mock()
+    with (
+        patch("src.managers.issue_manager._instantiate_github_class", return_value=issue),
+        patch.object(JobService, "count") as count_mock,
+    ):
+        set_jobs_to_done(jobs[:2], issue_job)
+        set_jobs_to_done(jobs[:3], issue_job)
+    count_mock.assert_not_called()
+    assert IssueJobService.get(issue_url=issue_job.issue_url).done_tasks == 3
+    issue_helper.update_issue_comment_status.assert_called_with(
+        issue, f"Analyzing the tasklist [3/4]\n{markdown_progress(3, 4)}", issue_comment_id=issue_job.issue_comment_id
+    )
+
+
+def test_close_sub_tasks(event, issue_helper, issue_states):
     tasks = [
         ("not ref", False),
         ("owner/repo#1", False),
         ("#2", False),
         ("#0", False),
         ("owner/error#3", False),
+        ("#4", False),
     ]
     issue_helper.get_tasklist.return_value = tasks
     event.repository = Mock(url="repository.url")
     issues = []
+    issue_states.side_effect = lambda _requester, issue_urls: {
+        issue_url: {"state": "closed" if issue_url.endswith("0") else "open"}
+        for issue_url in issue_urls
+        if not issue_url.endswith("4")
+    }
 
     def instantiate_github_class_mock(_clazz, _hook_id, _installlation_id, issue_url):
         issue_ = Mock()
         issues.append(issue_)
-        if issue_url.endswith("0"):
-            issue_.state = "closed"
-        elif issue_url.endswith("3"):
+        if issue_url.endswith("3"):
             issue_.edit.side_effect = UnknownObjectException(0)
         return issue_
 
@@ -552,16 +906,57 @@ def test_close_sub_tasks(event, issue_helper):
         side_effect=instantiate_github_class_mock,
     ) as mock_instantiate_github_class:
         close_sub_tasks(event)
-        mock_instantiate_github_class.assert_has_calls(
+        issue_states.assert_called_once_with(
+            ANY,
             [
-                call(ANY, ANY, ANY, "https://api.github.com/repos/owner/repo/issues/1"),
-                call(ANY, ANY, ANY, "repository.url/issues/2"),
-                call(ANY, ANY, ANY, "repository.url/issues/0"),
-                call(ANY, ANY, ANY, "https://api.github.com/repos/owner/error/issues/3"),
-            ]
+                "https://api.github.com/repos/owner/repo/issues/1",
+                "repository.url/issues/2",
+                "repository.url/issues/0",
+                "https://api.github.com/repos/owner/error/issues/3",
+                "repository.url/issues/4",
+            ],
         )
+        # The closed and the not found issues are not edited
+        assert mock_instantiate_github_class.call_args_list == [
+            call(ANY, ANY, ANY, "https://api.github.com/repos/owner/repo/issues/1"),
+            call(ANY, ANY, ANY, "repository.url/issues/2"),
+            call(ANY, ANY, ANY, "https://api.github.com/repos/owner/error/issues/3"),
+        ]
         for issue in issues:
-            if issue.state == "closed":
-                issue.edit.assert_not_called()
-            else:
-                issue.edit.assert_called_once_with(state="closed", state_reason=event.issue.state_reason)
+            issue.edit.assert_called_once_with(state="closed", state_reason=event.issue.state_reason)
+
+
+def test_archive_finished_jobs(issue_job, base_model_service_stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(base_model_service_stub, "resource", MemoryBackend())
+    monkeypatch.setenv("FINISHED_JOBS_TTL_DAYS", "10")
+    day = 24 * 60 * 60
+    issue_jobs = [
+        issue_job.model_copy(update={"issue_url": "done.url", "issue_job_status": IssueJobStatus.DONE}),
+        issue_job.model_copy(update={"issue_url": "recent.url", "issue_job_status": IssueJobStatus.DONE}),
+        issue_job.model_copy(update={"issue_url": "pending.url"}),
+    ]
+    IssueJobService.insert_many(issue_jobs)
+    jobs = [
+        Job(task=f"task_{i}", original_issue_url=issue_job.issue_url, checked=True)
+        for issue_job in issue_jobs
+        for i in range(2)
+    ]
+    JobService.insert_many(jobs)
+    with patch("src.managers.issue_manager.time.time") as time_mock:
+        for issue_job, done_at in zip(issue_jobs[:2], [98 * day, 100 * day]):
+            time_mock.return_value = done_at
+            set_issue_job_to_done(issue_job)
+        assert archive_finished_jobs(str(tmp_path / "archive"), older_than_days=1) == (1, 2)
+
+    def archived(table_name):
+        (path,) = (tmp_path / "archive").glob(f"{table_name}-*.jsonl.gz")
+        with gzip.open(path, "rt") as file:
+            return [json.loads(line) for line in file]
+
+    assert [item["issue_url"] for item in archived("issuejob")] == ["done.url"]
+    assert [(item["original_issue_url"], item["task"]) for item in archived("job_v2")] == [
+        ("done.url", "task_0"),
+        ("done.url", "task_1"),
+    ]
+    assert [issue_job.issue_url for issue_job in IssueJobService.all()] == ["pending.url", "recent.url"]
+    assert {job.original_issue_url for job in JobService.all()} == {"pending.url", "recent.url"}
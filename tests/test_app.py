@@ -65,7 +65,7 @@ class TestApp(TestCase):
             p.stop()
 
     def test_process_jobs(self):
-        self.issue_job_service.filter.return_value = [Mock(spec=IssueJob, issue_job_status=IssueJobStatus.RUNNING)]
+        self.issue_job_service.get.return_value = Mock(spec=IssueJob, issue_job_status=IssueJobStatus.RUNNING)
         with patch("app.Process") as process:
             process.return_value.is_alive.return_value = False
             response = self.client.post("/process_jobs", json={"issue_url": "issue_url"})
@@ -80,7 +80,7 @@ class TestApp(TestCase):
     @patch("app.IssueJobService")
     def test_process_jobs_process_alive(self, issue_job_service):
         issue_job = Mock(spec=IssueJob, issue_job_status=IssueJobStatus.PENDING)
-        issue_job_service.filter.return_value = [issue_job]
+        issue_job_service.get.return_value = issue_job
         self.request_helper.get_request_url.return_value = "request.url"
         with patch("app.Process") as process:
             process.return_value.is_alive.return_value = True
@@ -88,11 +88,57 @@ class TestApp(TestCase):
             response = self.client.post("/process_jobs", json={"issue_url": "issue_url"})
             assert response.status_code == 200
             assert response.json["status"] == "pending"
-            issue_job_service.update.assert_called_once_with(issue_job, issue_job_status=IssueJobStatus.PENDING)
+            issue_job_service.compare_and_set.assert_called_once_with(
+                issue_job,
+                {"issue_job_status": IssueJobStatus.PENDING},
+                issue_job_status=IssueJobStatus.PENDING,
+            )
 
             self.request_helper.make_thread_request.assert_called_once_with("request.url", "issue_url")
 
+    @patch("app.IssueJobService")
+    def test_process_jobs_process_alive_job_changed(self, issue_job_service):
+        issue_job = Mock(spec=IssueJob, issue_job_status=IssueJobStatus.RUNNING)
+        issue_job_service.get.return_value = issue_job
+        issue_job_service.compare_and_set.return_value = False
+        with patch("app.Process") as process:
+            # The process finishes the job
+            process.return_value.is_alive.side_effect = [True, False]
+
+            response = self.client.post("/process_jobs", json={"issue_url": "issue_url"})
+            assert response.status_code == 200
+            assert issue_job_service.get.call_count == 2
+            process.return_value.terminate.assert_not_called()
+            self.request_helper.make_thread_request.assert_not_called()
+
+    @patch("app.IssueJobService")
+    def test_process_jobs_process_alive_progress_changed(self, issue_job_service):
+        issue_job = Mock(spec=IssueJob, issue_job_status=IssueJobStatus.RUNNING)
+        issue_job_service.get.return_value = issue_job
+        issue_job_service.compare_and_set.side_effect = [False, True]
+        self.request_helper.get_request_url.return_value = "request.url"
+        with patch("app.Process") as process:
+            process.return_value.is_alive.return_value = True
+
+            response = self.client.post("/process_jobs", json={"issue_url": "issue_url"})
+            assert response.status_code == 200
+            assert issue_job_service.get.call_count == 2
+            process.return_value.terminate.assert_called_once()
+            self.request_helper.make_thread_request.assert_called_once_with("request.url", "issue_url")
+
+    @patch("app.issue_manager")
+    def test_process_jobs_in_process_storage(self, issue_manager):
+        issue_manager.process_jobs.side_effect = [IssueJobStatus.DONE, None]
+        with patch("app.Process") as process, patch.dict("os.environ", {"STORAGE_BACKEND": "memory"}):
+            response = self.client.post("/process_jobs", json={"issue_url": "issue_url"})
+            assert response.status_code == 200
+            assert response.json["status"] == "done"
+            assert self.client.post("/process_jobs", json={"issue_url": "not found"}).status_code == 404
+            process.assert_not_called()
+        issue_manager.process_jobs.assert_called_with("not found")
+
     def test_process_jobs_issue_url_not_found(self):
+        self.issue_job_service.get.return_value = None
         response = self.client.post("/process_jobs", json={"issue_url": "not found"})
         assert response.status_code == 404
         assert response.json["error"] == "IssueJob for issue_url='not found' not found"
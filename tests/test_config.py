@@ -0,0 +1,35 @@
+from unittest.mock import Mock
+
+import pytest
+
+import config
+from config import after_fork, setting
+
+
+@pytest.mark.parametrize(
+    "name, value, expected",
+    [
+        ("GITHUB_ENGINE", None, "sync"),
+        ("GITHUB_ENGINE", "async", "async"),
+        ("GITHUB_MAX_WORKERS", "2", 2),
+        ("DYNAMODB_READ_TIMEOUT", "1.5", 1.5),
+        ("DYNAMODB_ENDPOINT_URL", "", None),
+        ("DYNAMODB_ENDPOINT_URL", "http://localhost:8000", "http://localhost:8000"),
+        ("TRUST_TABLE_SCHEMA", "yes", True),
+        ("TRUST_TABLE_SCHEMA", "false", False),
+    ],
+)
+def test_setting(name, value, expected, monkeypatch):
+    if value is None:
+        monkeypatch.delenv(name, raising=False)
+    else:
+        monkeypatch.setenv(name, value)
+    assert setting(name) == expected
+
+
+def test_after_fork(monkeypatch):
+    monkeypatch.setattr(config, "_after_fork_callbacks", [])
+    callback = Mock()
+    assert after_fork(callback) is callback
+    config._run_after_fork()
+    callback.assert_called_once_with()